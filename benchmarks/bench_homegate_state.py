@@ -0,0 +1,130 @@
+# benchmarks/bench_homegate_state.py
+"""
+Homegate result-list extraction from __INITIAL_STATE__: the old DOTALL regex
++ json.loads of the whole blob against listings_from_state_text()
+(modules/scrapers/homegate_state.py), which decodes only the listings array.
+
+    python benchmarks/bench_homegate_state.py [--mb 5] [--repeat 20] [--fixture page.html ...]
+
+Without --fixture a result page is generated whose state is --mb megabytes:
+the listings sit between large unrelated sections (translations, config,
+other stores), as on the live site. Saved result pages or state scripts
+(e.g. from `page.content()`) can be passed with --fixture. Both paths must
+return the same items.
+
+This measures the Python side only. On a live page the list is now read by
+a single evaluate() that parses the state in the browser and returns just
+the listings, so the blob no longer crosses the Playwright bridge at all.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.scrapers.homegate_state import listings_from_state_text, search_items  # noqa: E402
+
+
+def _entry(i: int, rnd: random.Random) -> dict:
+    return {
+        "id": str(4000000000 + i),
+        "listing": {
+            "id": str(4000000000 + i),
+            "localization": {"de": {"text": {"title": f"Helle {rnd.choice([2.5, 3.5, 4.5])}-Zimmer-Wohnung {i}",
+                                             "description": "Lorem ipsum " * 40}}},
+            "prices": {"currency": "CHF", "rent": {"gross": rnd.randint(1500, 4500), "net": 2000}},
+            "characteristics": {"numberOfRooms": rnd.choice([2.5, 3.5, 4.5]), "livingSpace": 80},
+            "address": {"street": f"Musterstrasse {i}", "postalCode": "8001", "locality": "Zürich"},
+            "attachments": [{"url": f"https://media.homegate.ch/{i}/{j}.jpg", "type": "IMAGE"} for j in range(15)],
+        },
+    }
+
+
+def synthetic_page(mb: float, n_listings: int = 20, seed: int = 3) -> str:
+    rnd = random.Random(seed)
+    filler_items = max(1, int(mb * 1024 * 1024 / 2 / 120))
+    state = {
+        "app": {"translations": {f"key.{i}": f"Übersetzung Nummer {i} " * 4 for i in range(filler_items)}},
+        "resultList": {
+            "search": {
+                "searchParams": {"location": "plz-8001", "radius": 2000},
+                "fullSearch": {"result": {"resultCount": n_listings,
+                                          "listings": [_entry(i, rnd) for i in range(n_listings)]}},
+            },
+            "ads": [{"slot": i, "html": "<div>" + "x" * 200 + "</div>"} for i in range(50)],
+        },
+        "config": {"features": [{"name": f"flag{i}", "payload": "y" * 100} for i in range(filler_items)]},
+    }
+    script = "window.__INITIAL_STATE__ = " + json.dumps(state, ensure_ascii=False) + ";"
+    head = "<!DOCTYPE html><html><head><title>Mieten</title>" + "<link rel='preload' href='/a.js'>" * 50
+    return head + "</head><body><div id='app'></div><script>" + script + "</script>" \
+        + "<script src='/bundle.js'></script></body></html>"
+
+
+_OLD_SCRIPT_RE = re.compile(r"<script[^>]*>\s*(window\.__INITIAL_STATE__\s*=.*?)</script>", re.DOTALL)
+
+
+def old_items(text: str) -> list:
+    """The pre-change path: find the script, DOTALL regex, json.loads of the whole state."""
+    if "<script" in text:
+        m = _OLD_SCRIPT_RE.search(text)
+        text = m.group(1) if m else ""
+    m = re.search(r"window\.__INITIAL_STATE__\s*=\s*(\{.*\})\s*;?", text.strip(), flags=re.DOTALL)
+    data = json.loads(m.group(1) if m else text.strip())
+    listings = (data.get("resultList", {}).get("search", {}).get("fullSearch", {})
+                .get("result", {}).get("listings", []))
+    return search_items(listings)
+
+
+def new_items(text: str) -> list:
+    return search_items(listings_from_state_text(text))
+
+
+def _measure(fn, text: str, repeat: int):
+    fn(text)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    per_call = (time.perf_counter() - t0) / repeat
+    tracemalloc.start()
+    fn(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_call, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=float, default=5.0)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--fixture", nargs="*", default=[])
+    args = ap.parse_args()
+
+    pages = []
+    for path in args.fixture:
+        with open(path, encoding="utf-8") as f:
+            pages.append((os.path.basename(path), f.read()))
+    if not pages:
+        pages.append((f"synthetic result page (~{args.mb:g} MB state)", synthetic_page(args.mb)))
+
+    for name, text in pages:
+        expected = old_items(text)
+        got = new_items(text)
+        print(f"\n{name}: {len(text) / 2**20:.1f} MiB, {len(expected)} listings")
+        if got != expected:
+            print("  MISMATCH between old and new extraction")
+            continue
+        old_t, old_mem = _measure(old_items, text, args.repeat)
+        new_t, new_mem = _measure(new_items, text, args.repeat)
+        print(f"  {'regex + json.loads (old)':<28} {old_t * 1000:8.2f} ms  peak {old_mem / 2**20:7.2f} MiB")
+        print(f"  {'targeted raw_decode (new)':<28} {new_t * 1000:8.2f} ms  peak {new_mem / 2**20:7.2f} MiB"
+              f"  ({old_t / new_t:.0f}x faster, {old_mem / max(1, new_mem):.0f}x less memory)")
+
+
+if __name__ == "__main__":
+    main()
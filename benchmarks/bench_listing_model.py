@@ -0,0 +1,103 @@
+# benchmarks/bench_listing_model.py
+"""
+RealEstateListing memory and storage-prep cost: the old __dict__ class,
+whose price/rooms were re-parsed with regexes on every save, against the
+slotted model that parses each derived field once, on first access.
+
+    python benchmarks/bench_listing_model.py [--n 50000] [--saves 3]
+
+"saves" is how many times each listing goes through the storage path
+(record_listing_changes + save_listings run once per scrape cycle each).
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.real_estate_listing import RealEstateListing  # noqa: E402
+
+
+class OldListing:
+    def __init__(self, title, price, location, url, rooms):
+        self.title = title
+        self.price = price
+        self.location = location
+        self.url = url
+        self.rooms = rooms
+
+
+_price_cur_re = re.compile(r"\b([A-Z]{3})\b")
+_price_num_re = re.compile(r"([-+]?\d+(?:[.,]\d+)?)")
+
+
+def _old_parse_price(price):
+    if not price:
+        return (None, None)
+    mcur = _price_cur_re.search(price)
+    cleaned = price.replace("’", "'").replace(" ", "").replace("'", "")
+    mnum = _price_num_re.search(cleaned)
+    return (float(mnum.group(1).replace(",", ".")) if mnum else None, mcur.group(1) if mcur else None)
+
+
+def _old_to_float(x):
+    try:
+        return None if x is None else float(x) if isinstance(x, (int, float)) else float(str(x).replace(",", "."))
+    except Exception:
+        return None
+
+
+def old_row(l):
+    amount, currency = _old_parse_price(l.price if isinstance(l.price, str) else str(l.price) if l.price is not None else "")
+    return (l.title or "", amount, currency, l.location or "", _old_to_float(l.rooms))
+
+
+def raw_items(n: int, seed: int = 5):
+    rnd = random.Random(seed)
+    for i in range(n):
+        rent = rnd.randint(900, 4800)
+        yield (f"{rnd.choice(['2.5', '3.5', '4.5'])}-Zimmer-Wohnung an der Musterstrasse {i}",
+               f"CHF {rent // 1000}’{rent % 1000:03d}.–", f"Musterstrasse {i}, 80{i % 60:02d}, Zürich",
+               f"https://www.homegate.ch/mieten/{4000000000 + i}", rnd.choice(["2.5", "3.5", 4.5, 3]))
+
+
+def _measure(make, row, items, saves):
+    t0 = time.perf_counter()
+    listings = [make(*it) for it in items]
+    build = time.perf_counter() - t0
+    del listings
+    tracemalloc.start()
+    listings = [make(*it) for it in items]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for _ in range(saves):
+        rows = [row(l) for l in listings]
+    prep = time.perf_counter() - t0
+    return listings, rows, build, prep, size
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50000)
+    ap.add_argument("--saves", type=int, default=3)
+    args = ap.parse_args()
+
+    items = list(raw_items(args.n))
+    _, old_rows, old_build, old_prep, old_mem = _measure(OldListing, old_row, items, args.saves)
+    _, new_rows, new_build, new_prep, new_mem = _measure(RealEstateListing, RealEstateListing.to_row, items, args.saves)
+    assert old_rows == new_rows, "stored fields differ"
+
+    print(f"{args.n} listings, {args.saves} save passes")
+    print(f"  {'__dict__ + re-parse (old)':<26} build {old_build * 1000:7.1f} ms  rows {old_prep * 1000:7.1f} ms"
+          f"  total {(old_build + old_prep) * 1000:7.1f} ms  {old_mem / 2**20:6.1f} MiB")
+    print(f"  {'__slots__, parsed lazily':<26} build {new_build * 1000:7.1f} ms  rows {new_prep * 1000:7.1f} ms"
+          f"  total {(new_build + new_prep) * 1000:7.1f} ms  {new_mem / 2**20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
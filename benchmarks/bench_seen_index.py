@@ -0,0 +1,100 @@
+# benchmarks/bench_seen_index.py
+"""
+Seen-URL lookups with and without the in-memory index (utils/seen_index.py).
+
+    python benchmarks/bench_seen_index.py [--seen 1000000] [--batch 60] [--rounds 200]
+
+Fills a throwaway SQLite file with N seen URLs for one profile, then replays
+a steady-state polling loop: every round re-scrapes the same newest-first
+result list, with a few new listings pushed in at the top. Each round is
+checked with the plain chunked IN (...) query and with SeenIndex, and the new
+URLs are marked seen afterwards as entrypoint does.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROFILE = "bench_profile"
+
+
+def _url(i: int) -> str:
+    return f"https://www.homegate.ch/mieten/{4000000000 + i}"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seen", type=int, default=1_000_000)
+    ap.add_argument("--batch", type=int, default=60)
+    ap.add_argument("--new-ratio", type=float, default=0.05)
+    ap.add_argument("--rounds", type=int, default=200)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_seen_")
+    os.environ["DEDUP_DB_PATH"] = os.path.join(tmp, "bench.db")
+    from utils import dedupe_db
+    from utils.seen_index import BloomFilter
+    from models.real_estate_listing import RealEstateListing
+
+    dedupe_db.init_db()
+    t0 = time.perf_counter()
+    with dedupe_db.unit_of_work() as con:
+        con.executemany(
+            "INSERT INTO seen_listings (profile_name, url, first_seen_at, last_seen_at) VALUES (?, ?, ?, ?)",
+            ((PROFILE, _url(i), "2025-01-01T00:00:00Z", "2025-01-01T00:00:00Z") for i in range(args.seen)),
+        )
+    print(f"filled {args.seen:,} seen URLs in {time.perf_counter() - t0:.1f}s")
+
+    n_new = max(1, int(args.batch * args.new_ratio))
+    window = [_url(args.seen - 1 - i) for i in range(args.batch)]  # current result list
+    next_id = args.seen
+    batches = []
+    for _ in range(args.rounds):
+        fresh = [_url(next_id + j) for j in range(n_new)]
+        next_id += n_new
+        window = (fresh + window)[:args.batch]
+        batches.append((window, fresh))
+
+    index = dedupe_db.get_seen_index()
+    t0 = time.perf_counter()
+    index.seen(PROFILE, [_url(0)])  # lazy load of the whole profile
+    load = time.perf_counter() - t0
+    bloom = index._profiles[PROFILE].bloom
+
+    base = warm = 0.0
+    for urls, fresh in batches:
+        t0 = time.perf_counter()
+        a = dedupe_db._query_seen(PROFILE, urls, dedupe_db.DEFAULT_DB_PATH)
+        base += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        b = index.seen(PROFILE, urls)
+        warm += time.perf_counter() - t0
+        assert a == b, "index disagrees with SQLite"
+
+        dedupe_db.mark_seen(PROFILE, [RealEstateListing("", "", "", u, None) for u in fresh])
+
+    tracemalloc.start()
+    BloomFilter(bloom.capacity, bloom.error_rate)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = args.rounds * args.batch
+    print(f"batch={args.batch} ({n_new} new per round), rounds={args.rounds}")
+    print(f"  SQLite IN (...)      : {base * 1e3:8.1f} ms total, {base / args.rounds * 1e3:6.3f} ms/batch")
+    print(f"  index load (lazy)    : {load:8.1f} s once, bloom {peak / 2**20:.2f} MiB (k={bloom.k})")
+    print(f"  index lookups        : {warm * 1e3:8.1f} ms total, {warm / args.rounds * 1e3:6.3f} ms/batch")
+    print(f"  DB skipped / checked : {index.db_skips - 1:,} / {index.db_checks:,} of {total:,} URLs")
+    saved = (base - warm) / args.rounds
+    if saved > 0:
+        print(f"  break-even           : {load / saved:,.0f} batches ({load / saved / args.seen:.2f} per seen URL)")
+    else:
+        print("  break-even           : never (index lookups are not faster)")
+
+
+if __name__ == "__main__":
+    main()
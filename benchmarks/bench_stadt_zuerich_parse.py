@@ -0,0 +1,130 @@
+# benchmarks/bench_stadt_zuerich_parse.py
+"""
+Stadt Zürich table extraction: the old BeautifulSoup(html.parser) + select_one
+per cell path against the parse_rows() backends (modules/scrapers/stadt_zuerich_table.py).
+
+    python benchmarks/bench_stadt_zuerich_parse.py [--rows 150] [--repeat 50] [--fixture page.html ...]
+
+Without --fixture a page shaped like the live one is generated: header,
+navigation, filter form and inline scripts around the result table (the
+table being a small part of the page). Saved pages (e.g. `curl -o page.html
+https://www.vermietungen.stadt-zuerich.ch/publication/apartment/`) can be
+passed with --fixture. Every backend must return the same rows as the old path.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.scrapers.stadt_zuerich_table import available_backends, parse_rows  # noqa: E402
+
+
+def synthetic_page(n_rows: int, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    streets = ["Bahnhofstrasse", "Langstrasse", "Badenerstrasse", "Seefeldstrasse", "Hardturmstrasse"]
+    head = [
+        "<!DOCTYPE html><html lang='de'><head><meta charset='utf-8'><title>Wohnungen</title>",
+        *(f"<link rel='stylesheet' href='/static/css/{i}.css'>" for i in range(12)),
+        "<script>" + "var cfg = {" + ",".join(f"k{i}: '{'x' * 60}'" for i in range(400)) + "};</script>",
+        "</head><body><header><nav><ul>",
+        *(f"<li class='nav-item'><a href='/p/{i}'>Menu {i}</a><ul>"
+          + "".join(f"<li><a href='/p/{i}/{j}'>Sub {j}</a></li>" for j in range(8)) + "</ul></li>"
+          for i in range(40)),
+        "</ul></nav></header><main><form class='filter'>",
+        *(f"<label>Feld {i}<select name='f{i}'>" + "".join(f"<option>{j}</option>" for j in range(20))
+          + "</select></label>" for i in range(15)),
+        "</form>",
+    ]
+    rows = []
+    for i in range(n_rows):
+        rooms = rnd.choice(["1.5", "2.5", "3.5", "4.5", "5.5"])
+        rent = rnd.randint(900, 4200)
+        rows.append(
+            "<tr class='row'>"
+            f"<td class='publicated_adress'>{rnd.choice(streets)} {rnd.randint(1, 200)}<br> 80{rnd.randint(0, 57):02d} Zürich</td>"
+            f"<td class='rooms'>{rooms} Zimmer</td>"
+            f"<td class='area'>{rnd.randint(30, 140)} m²</td>"
+            f"<td class='rentalnet'>CHF {rent - 200}.–</td>"
+            f"<td class='rentalgross'>CHF {rent // 1000}’{rent % 1000:03d}.–</td>"
+            f"<td class='apply_button'><span class='icon'></span><a class='btn apply_button' href='/publication/apartment/{10000 + i}/'>Bewerben</a></td>"
+            "</tr>"
+        )
+    table = (
+        "<div class='table-container main-table'><table class='table'><thead><tr>"
+        + "".join(f"<th>Spalte {i}</th>" for i in range(6))
+        + "</tr></thead><tbody>" + "".join(rows) + "</tbody></table></div>"
+    )
+    tail = ["</main><footer>", *(f"<p class='legal'>{'Lorem ipsum ' * 30}</p>" for i in range(60)),
+            "</footer>", "<script>" + "x();" * 5000 + "</script></body></html>"]
+    return "".join(head) + table + "".join(tail)
+
+
+def baseline_rows(html: str) -> list:
+    """The pre-backend code path: full html.parser tree + select_one per cell."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    out = []
+    for tr in soup.select("div.table-container.main-table table tbody tr"):
+        def text_of(css):
+            el = tr.select_one(css)
+            return el.get_text(strip=True) if el else ""
+
+        el = tr.select_one("td.apply_button a.apply_button")
+        out.append({
+            "address": text_of("td.publicated_adress"),
+            "rooms": text_of("td.rooms"),
+            "rent": text_of("td.rentalgross"),
+            "href": (el.get("href") or "") if el else "",
+        })
+    return out
+
+
+def _time(fn, html: str, repeat: int):
+    fn(html)  # warm-up (imports, caches)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(html)
+    per_call = (time.perf_counter() - t0) / repeat
+    tracemalloc.start()
+    fn(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_call, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=150)
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--fixture", nargs="*", default=[])
+    args = ap.parse_args()
+
+    pages = []
+    for path in args.fixture:
+        with open(path, encoding="utf-8") as f:
+            pages.append((os.path.basename(path), f.read()))
+    if not pages:
+        pages.append((f"synthetic ({args.rows} rows)", synthetic_page(args.rows)))
+
+    for name, html in pages:
+        expected = baseline_rows(html)
+        print(f"\n{name}: {len(html) / 1024:.0f} KiB, {len(expected)} rows")
+        base_t, base_mem = _time(baseline_rows, html, args.repeat)
+        print(f"  {'bs4 html.parser (old)':<24} {base_t * 1000:8.2f} ms  peak {base_mem / 2**20:6.1f} MiB")
+        for backend in available_backends():
+            got = parse_rows(html, backend=backend)
+            if got != expected:
+                bad = next(i for i, (a, b) in enumerate(zip(got, expected)) if a != b) if got and expected else 0
+                print(f"  {backend:<24} MISMATCH at row {bad}: {got[bad:bad + 1]} != {expected[bad:bad + 1]}")
+                continue
+            t, mem = _time(lambda h: parse_rows(h, backend=backend), html, args.repeat)
+            print(f"  {backend:<24} {t * 1000:8.2f} ms  peak {mem / 2**20:6.1f} MiB  ({base_t / t:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
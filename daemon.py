@@ -0,0 +1,106 @@
+# daemon.py
+"""
+Long-running mode: python daemon.py
+
+Imports, dotenv, init_db(), the scheduler's worker threads (each with its
+warm browser and SQLite connection), the Homegate Node worker and the
+WhatsApp outbox dispatcher stay up between polls. Every fetch group is
+polled on its own adaptive interval (utils/poll_scheduler.py) within the
+per-site crawl budget. SIGINT/SIGTERM finish the polls already running,
+flush the outbox for up to DAEMON_SHUTDOWN_DRAIN_SEC and exit.
+Stage timings and counters (utils/metrics.py) are written out with every
+housekeeping pass; METRICS_PORT serves them live.
+"""
+import os
+import signal
+import threading
+import time
+
+import entrypoint as app
+from utils.dedupe_db import enable_seen_index, init_db, purge_sent_notifications, purge_stale_fingerprints
+from utils.query_planner import plan_fetches
+from utils.scheduler import SiteScheduler
+from utils.poll_scheduler import PollPlanner
+from modules.scrapers.homegate_scraper import shutdown_pdp_worker
+from utils.async_loop import stop_loop
+from utils.crawl_control import DomainCoolingDown
+from utils.crawl_cache import in_cycle, new_cycle_id
+from utils import metrics
+
+_HOUSEKEEPING_SEC = float(os.getenv("DAEMON_HOUSEKEEPING_SEC", "3600"))
+_SHUTDOWN_DRAIN_SEC = float(os.getenv("DAEMON_SHUTDOWN_DRAIN_SEC", "60"))
+
+
+def main():
+    init_db()
+    enable_seen_index()  # loaded once, then amortized over every poll
+    metrics.serve()  # METRICS_PORT: scrape the daemon's counters live
+    app.notifier.start()
+
+    groups = plan_fetches(app.search_profiles)
+    planner = PollPlanner(groups, cooldown_of=lambda g: app.site_cooldown(g.scraper))
+    print(f"😈 Daemon: {len(app.search_profiles)} profile(s) → {len(groups)} fetch group(s)")
+
+    stop = threading.Event()
+    wake = threading.Event()
+
+    def _on_signal(signum, _frame):
+        print(f"🛑 Signal {signum}: finishing running polls, then exiting.")
+        stop.set()
+        wake.set()
+
+    signal.signal(signal.SIGINT, _on_signal)
+    signal.signal(signal.SIGTERM, _on_signal)
+
+    cycle_of = {}  # group name -> crawl-cache cycle of the batch it was due in
+
+    def poll(group):
+        try:
+            with in_cycle(cycle_of.pop(group.name, None) or new_cycle_id()):
+                new_counts = app.run_group(group)
+        except DomainCoolingDown as e:
+            planner.failed(group, retry_in=e.remaining)
+            print(f"🧊 {group.name}: {e}; next poll after the cooldown")
+        except Exception:
+            planner.failed(group)
+            raise  # logged by the scheduler
+        else:
+            interval = planner.completed(group, new_counts)
+            print(f"⏲️  {group.name}: {sum(new_counts.values())} new, next poll in {interval / 60:.0f} min")
+        finally:
+            wake.set()
+
+    scheduler = SiteScheduler(on_worker_exit=app.close_worker_resources)
+    scheduler.start(site_of=lambda g: g.scraper, handler=poll)
+    next_housekeeping = time.time() + _HOUSEKEEPING_SEC
+    try:
+        while not stop.is_set():
+            due = planner.due()
+            # polls due together may share result pages; later batches refetch, and
+            # polls still running keep the cycle they started in
+            cycle = new_cycle_id()
+            for group in due:
+                cycle_of[group.name] = cycle
+                scheduler.submit(group)
+
+            if time.time() >= next_housekeeping:
+                next_housekeeping = time.time() + _HOUSEKEEPING_SEC
+                purge_sent_notifications()
+                purge_stale_fingerprints()
+                app.report_run_stats(mode="daemon")
+                print("🗓️  Poll plan:\n   " + "\n   ".join(planner.describe()))
+
+            wake.wait(min(planner.next_wakeup(), max(0.0, next_housekeeping - time.time())))
+            wake.clear()
+    finally:
+        scheduler.shutdown(drop_pending=True)
+        shutdown_pdp_worker()
+        stop_loop()
+        if not app.notifier.drain(timeout=_SHUTDOWN_DRAIN_SEC):
+            print(f"⚠️  {app.notifier.pending()} WhatsApp message(s) stay in the outbox.")
+        app.notifier.stop()
+        app.report_run_stats(mode="daemon")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,32 @@
 from modules.scrapers.flatfox_scraper import FlatfoxScraper
-from modules.scrapers.homegate_scraper import HomegateScraper
+from modules.scrapers.homegate_scraper import HomegateScraper, shutdown_pdp_worker
 from modules.scrapers.vermietungen_stadt_zuerich_scraper import VermietungenStadtZuerichScraper
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from utils.whatsapp import send_whatsapp_message
-from utils.dedupe_db import init_db, filter_new_listings, mark_seen, save_listings
+from utils.whatsapp import send_whatsapp_message, send_whatsapp_batch, whatsapp_message_status
+from utils.dedupe_db import (
+    init_db, filter_new_listings, mark_seen, record_listing_changes, seen_urls,
+    unit_of_work, close_connection, enqueue_notifications, purge_sent_notifications,
+    split_duplicates, purge_stale_fingerprints,
+)
+from utils.scheduler import SiteScheduler
+from utils.notify_dispatcher import NotificationDispatcher
+from utils.browser_pool import close_thread_pool
+from utils.crawl_cache import get_cache, close_cache_connection, start_cycle
+from utils.crawl_control import DomainCoolingDown, close_limiter_connection, cooldown_remaining
+from utils.query_planner import plan_fetches, fan_out, interested_profiles
+from utils.async_loop import stop_loop
+from utils import metrics
 
 
 import os
 print("[env] WA_URL=", os.getenv("WHATSAPP_API_URL"))
-import time
-import sys
+import traceback
 
 from config.search_profiles import search_profiles
+from models.real_estate_listing import RealEstateListing
 
 selector = os.getenv("PROFILE_SELECTOR", "").strip()
 if selector:
@@ -25,74 +37,234 @@ if selector:
     print(f"[run] limiting to profiles: {sorted(wanted)} (from {before} total)")
     
 def print_listings(profile_name, listings):
-    print(f"\n✅ New listings for {profile_name}:")
-    for listing in listings:
-        print(listing)  # uses RealEstateListing.__repr__()
+    # one print per profile so concurrent profiles don't interleave lines
+    lines = [f"\n✅ New listings for {profile_name}:"]
+    lines.extend(str(listing) for listing in listings)  # uses RealEstateListing.__repr__()
+    print("\n".join(lines))
 
-def notify_listings(listings, jid):
-    print(f"JID: {jid}")
-    delay = float(os.getenv("WHATSAPP_SEND_DELAY_SEC", "10"))
+def format_listing_message(l):
+    price = l.price or "—"
+    location = l.location or "—"
+    rooms = l.rooms_label or "—"
 
-    for l in listings:
-        price = l.price or "—"
-        location = l.location or "—"
-        rooms = l.rooms if l.rooms not in (None, "") else "—"
-
-        message = f"""{l.title}\n
+    return f"""{l.title}\n
 💰 {price}
 📍 {location}
 🛏️ {rooms} Zimmer
 🔗 {l.url}"""
 
-        # quick retry-once wrapper (helps if WA service is momentarily busy)
-        try:
-            send_whatsapp_message(message, jid=jid)
-        except Exception as e:
-            # brief backoff then retry once
-            time.sleep(min(2 * delay, 3))
-            try:
-                send_whatsapp_message(message, jid=jid)
-            except Exception:
-                # last resort: don’t block the rest
-                print(f"❌ Failed to send after retry: {l.url} ({e})")
+# drains notification_outbox in the background (retries, optional digest;
+# pacing per JID, or by the service itself in batch mode), so scraping never
+# waits on WhatsApp
+_WA_BATCH = os.getenv("WHATSAPP_BATCH", "true").lower() == "true"
+notifier = NotificationDispatcher(
+    send_whatsapp_message,
+    send_batch=send_whatsapp_batch if _WA_BATCH else None,
+    message_status=whatsapp_message_status,
+)
 
-        # pacing so WhatsApp service isn’t flooded
-        time.sleep(delay)
+def notify_listings(profile_name, listings, jid):
+    """Queue messages in the outbox; call inside the profile's unit_of_work."""
+    if not jid:
+        print(f"❌ WhatsApp JID missing for {profile_name} (got empty/None); not queuing.")
+        return
+    n = enqueue_notifications(profile_name, jid, [(l.url, format_listing_message(l)) for l in listings])
+    print(f"JID: {jid} ← queued {n} message(s)")
 
-def main():
-    init_db()  # ensure SQLite is ready
+def _format_amount(amount, currency):
+    if amount is None:
+        return "—"
+    return f"{currency or 'CHF'} {amount:,.0f}".replace(",", "'")
+
+def format_change_message(change):
+    l = change.listing
+    if change.kind == "price_drop":
+        header = (f"📉 Preis gesenkt: {_format_amount(change.old_price, change.currency)}"
+                  f" → {_format_amount(change.new_price, change.currency)}")
+    else:
+        header = f"🔁 Wieder online (nach {change.away_days:.0f} Tagen)"
+    return f"{header}\n\n{format_listing_message(l)}"
+
+def notify_changes(profile_name, changes, jid):
+    """Queue price-drop / relisting messages; call inside the profile's unit_of_work."""
+    if not jid:
+        return
+    n = enqueue_notifications(profile_name, jid, [(c.listing.url, format_change_message(c)) for c in changes])
+    print(f"JID: {jid} ← queued {n} change message(s)")
 
-    available_scrapers = {
-        "flatfox": FlatfoxScraper,
-        "homegate": HomegateScraper,
-        "vermietungen-stadt-zuerich": VermietungenStadtZuerichScraper,
-    }
+AVAILABLE_SCRAPERS = {
+    "flatfox": FlatfoxScraper,
+    "homegate": HomegateScraper,
+    "vermietungen-stadt-zuerich": VermietungenStadtZuerichScraper,
+}
 
-    for profile in search_profiles:
-        scraper_key = profile["scraper"]
-        ScraperClass = available_scrapers.get(scraper_key)
+def _seen_by_all(group):
+    """
+    seen_filter for a shared fetch: a URL counts as seen once every member whose
+    own filters match the listing has seen it. A member never marks seen what
+    its filters drop, so requiring all members would keep such listings fresh
+    forever. Without item data every member has to have seen the URL.
+    """
+    names = [p["name"] for p in group.profiles]
 
-        if not ScraperClass:
-            print(f"❌ No scraper found for key: {scraper_key}")
-            continue
+    def _filter(urls, items=None):
+        with metrics.timer("seen_filter"):
+            if items is None or len(names) == 1:
+                seen = seen_urls(names[0], urls)
+                for name in names[1:]:
+                    if not seen:
+                        break
+                    seen &= seen_urls(name, seen)
+                return seen
 
-        scraper = ScraperClass(config=profile)
-        listings = scraper.scrape()
+            seen_by = {name: seen_urls(name, urls) for name in names}
+            seen = set()
+            for url, item in zip(urls, items):
+                listing = RealEstateListing(item.get("title"), item.get("price"), item.get("location"),
+                                            url, item.get("rooms"))
+                if all(url in seen_by[p["name"]] for p in interested_profiles(group, listing)):
+                    seen.add(url)
+        return seen
+    return _filter
 
-        # dedupe by (profile, url)
-        print(f'JID entry: {profile["jid"]}')
+def site_cooldown(scraper_key):
+    """Seconds the scraper's domain still cools down after a block (0 = go ahead)."""
+    ScraperClass = AVAILABLE_SCRAPERS.get(scraper_key)
+    if not ScraperClass or not ScraperClass.domain:
+        return 0.0
+    return cooldown_remaining(ScraperClass.domain)
+
+def run_group(group):
+    """
+    One (possibly superset) scrape, fanned out to each profile of the group.
+    Returns {profile name: number of new listings}. Raises DomainCoolingDown
+    when the site is cooling down after a block (before or during the scrape).
+    """
+    ScraperClass = AVAILABLE_SCRAPERS.get(group.scraper)
+
+    if not ScraperClass:
+        print(f"❌ No scraper found for key: {group.scraper}")
+        return {}
+    remaining = site_cooldown(group.scraper)
+    if remaining > 0:
+        raise DomainCoolingDown(ScraperClass.domain, remaining)
+
+    # everything timed or counted below (browser, rate limiter, DB, ...) carries the scraper label
+    with metrics.labels(scraper=group.scraper):
+        scraper = ScraperClass(config=group.config(), seen_filter=_seen_by_all(group))
+        try:
+            with metrics.timer("scrape"):
+                listings = scraper.scrape()
+        finally:
+            metrics.count_all(scraper.stats)
+            metrics.count("fetch_groups")
+        metrics.count("listings_scraped", len(listings))
+
+        new_counts = {}
+        for profile, profile_listings in fan_out(group, listings):
+            try:
+                with metrics.labels(profile=profile["name"]), metrics.timer("process_profile"):
+                    new_counts[profile["name"]] = process_profile(profile, profile_listings)
+            except Exception as e:
+                print(f"❌ [{profile['name']}] processing failed: {e}")
+                traceback.print_exc()
+        return new_counts
+
+# drop listings whose address/rooms/price fingerprint was already notified to the
+# same JID from another site or profile (LISTING_FINGERPRINT_DAYS keeps them)
+_CROSS_SITE_DEDUPE = os.getenv("CROSS_SITE_DEDUPE", "true").lower() == "true"
+
+def process_profile(profile, listings):
+    """dedupe / detect changes → notify → persist, for a single profile. Returns the number of new listings."""
+    # dedupe by (profile, canonical url) and per-JID fingerprint → outbox → persist, committed as one transaction
+    # (notify only writes outbox rows, so the write lock is held for milliseconds)
+    print(f'JID entry: {profile["jid"]}')
+    with metrics.timer("dedupe_db"), unit_of_work():
         new_listings = filter_new_listings(profile["name"], listings)
-        if not new_listings:
+        duplicates = []
+        if new_listings and _CROSS_SITE_DEDUPE:
+            # same flat already notified to this JID from another site/profile
+            new_listings, duplicates = split_duplicates(profile.get("jid") or profile["name"], profile["name"], new_listings)
+            if duplicates:
+                print(f"🪞 {len(duplicates)} listing(s) for {profile['name']} already notified via another site/profile: "
+                      + ", ".join(l.url for l in duplicates))
+                mark_seen(profile["name"], duplicates)
+                metrics.count("cross_site_duplicates", len(duplicates))
+        # upserts all scraped listings, but only writes rows whose content changed
+        changes = record_listing_changes(profile["name"], listings)
+        if not new_listings and not changes:
             print(f"ℹ️ No new listings for {profile['name']}")
-            continue
-
-        print_listings(profile["name"], new_listings)
-        notify_listings(new_listings, jid=profile["jid"])
-        
-         # mark after successful handling
-         # persist them
-        save_listings(profile["name"], new_listings)
-        mark_seen(profile["name"], new_listings)
+            return 0
+
+        metrics.count("new_listings", len(new_listings))
+        metrics.count("listing_changes", len(changes))
+        if new_listings:
+            print_listings(profile["name"], new_listings)
+            notify_listings(profile["name"], new_listings, jid=profile["jid"])
+            mark_seen(profile["name"], new_listings)
+        if changes:
+            print(f"🔔 {len(changes)} changed listing(s) for {profile['name']}: "
+                  + ", ".join(f"{c.kind} {c.listing.url}" for c in changes))
+            notify_changes(profile["name"], changes, jid=profile["jid"])
+    notifier.wake()  # rows are committed now
+    return len(new_listings)
+
+def report_run_stats(**extra):
+    """
+    Print the stage timings and counters since the last report and write them
+    out (utils/metrics.py: JSON summary, Prometheus file); purge the crawl cache.
+    """
+    cache = get_cache()
+    if cache is not None:
+        metrics.count_all(cache.stats(reset=True))
+        cache.purge_expired()
+    return metrics.report(extra)
+
+def close_worker_resources():
+    """Scheduler on_worker_exit hook: browser, DB, cache and rate-limit connections are per thread."""
+    close_thread_pool()
+    close_connection()
+    close_cache_connection()
+    close_limiter_connection()
+
+def _run_group_or_skip(group):
+    try:
+        run_group(group)
+    except DomainCoolingDown as e:
+        print(f"🧊 Skipping {group.name}: {e}")
+        metrics.count("fetch_groups_cooling", scraper=group.scraper)
+
+def main():
+    init_db()  # ensure SQLite is ready
+    metrics.serve()  # METRICS_PORT
+    notifier.start()  # also delivers leftovers from an earlier, interrupted run
+
+    # profiles of different sites run in parallel; each site keeps its own
+    # concurrency cap (RUN_SITE_CONCURRENCY, e.g. "homegate=1,flatfox=2")
+    # each worker keeps its browser and DB connection warm across profiles and closes them on exit
+    # profiles of the same scraper and area share one superset fetch (QUERY_PLANNER)
+    groups = plan_fetches(search_profiles)
+    print(f"🗺️  {len(search_profiles)} profile(s) → {len(groups)} fetch(es)")
+    start_cycle()  # cached result pages are shared within this run only
+    scheduler = SiteScheduler(on_worker_exit=close_worker_resources)
+    try:
+        # a blocked site cools down (utils/crawl_control.py); its remaining groups are skipped
+        scheduler.run(groups, site_of=lambda g: g.scraper, handler=_run_group_or_skip)
+    finally:
+        shutdown_pdp_worker()
+        stop_loop()  # closes the shared async HTTP clients
+
+    pending = notifier.pending()
+    if pending:
+        print(f"⏳ Waiting for {pending} WhatsApp message(s) to go out...")
+    if not notifier.drain(timeout=float(os.getenv("WHATSAPP_DRAIN_TIMEOUT_SEC", "900"))):
+        print(f"⚠️  {notifier.pending()} WhatsApp message(s) still pending; they stay in the outbox for the next run.")
+    notifier.stop()
+    print(f"📤 WhatsApp: sent={notifier.sent}, failed={notifier.failed}")
+    purge_sent_notifications()
+    purge_stale_fingerprints()
+
+    report_run_stats(mode="once", profiles=len(search_profiles), planned_groups=len(groups))
 
 if __name__ == "__main__":
     main()
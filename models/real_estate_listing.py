@@ -1,10 +1,119 @@
+import re
+import sys
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from utils.url_canon import canonical_url
+
+_price_cur_re = re.compile(r"\b([A-Z]{3})\b")
+# "2’450", "1,950", "12 300" (thousands groups, optional 1–2 decimals) or a plain "1450.50" / "3,5"
+_price_num_re = re.compile(
+    r"(?P<grouped>\d{1,3}(?:['’,. \u00a0\u202f]\d{3})+)(?!\d)(?:[.,](?P<cents>\d{1,2})(?!\d))?"
+    r"|(?P<plain>\d+(?:[.,]\d+)?)"
+)
+_num_re = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+# prices and room labels repeat across listings and polling cycles; lru_cache
+# is thread-safe and cached results also share one float/str per value
+@lru_cache(maxsize=4096)
+def _parse_price_text(price: str) -> Tuple[Optional[float], Optional[str]]:
+    mcur = _price_cur_re.search(price)
+    currency = sys.intern(mcur.group(1)) if mcur else None
+    mnum = _price_num_re.search(price)
+    if not mnum:
+        return (None, currency)
+    if mnum.group("grouped"):
+        amount = float(re.sub(r"\D", "", mnum.group("grouped")) + "." + (mnum.group("cents") or "0"))
+    else:
+        amount = float(mnum.group("plain").replace(",", "."))
+    return (amount, currency)
+
+
+def parse_price(price) -> Tuple[Optional[float], Optional[str]]:
+    """'CHF 2’450.–' → (2450.0, 'CHF'), 'CHF 1,950' → (1950.0, 'CHF'); numbers pass through without a currency."""
+    if price is None or price == "":
+        return (None, None)
+    if isinstance(price, (int, float)):
+        return (float(price), None)
+    return _parse_price_text(str(price))
+
+
+@lru_cache(maxsize=1024)
+def _parse_number_text(value: str) -> Optional[float]:
+    m = _num_re.search(value.replace("’", "").replace("'", "").replace(" ", ""))
+    return float(m.group(0).replace(",", ".")) if m else None
+
+
+def parse_number(value) -> Optional[float]:
+    """First number in `value` ('3.5 Zimmer', '3,5', 3) as float, else None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return _parse_number_text(str(value))
+
+
+_UNPARSED = object()
+
+
 class RealEstateListing:
+    """
+    One scraped listing. `price` is kept as the site shows it; price_amount,
+    price_currency, the numeric rooms and url_key are derived on first access
+    and kept, so construction stays as cheap as storing five attributes
+    (scrapers build many listings that are dropped as seen after only their
+    url_key was read) and storage and filtering never re-parse them. Equal
+    listings have the same url_key and stored fields; the hash is the
+    url_key's. title and location keep what the scraper passed (None
+    included); to_row() stores "" for None.
+    """
+    __slots__ = ("title", "price", "location", "url", "_rooms_raw",
+                 "_rooms", "_price_amount", "_price_currency", "_url_key")
+
     def __init__(self, title, price, location, url, rooms):
         self.title = title
-        self.price = price
+        self.price = price if price is None or isinstance(price, str) else str(price)
         self.location = location
         self.url = url
-        self.rooms = rooms
+        self._rooms_raw = rooms
+        self._rooms = self._price_amount = self._url_key = _UNPARSED
+
+    @property
+    def rooms(self) -> Optional[float]:
+        if self._rooms is _UNPARSED:
+            self._rooms = parse_number(self._rooms_raw)
+        return self._rooms
+
+    def _parse_price(self) -> None:
+        self._price_amount, self._price_currency = parse_price(self.price)
+
+    @property
+    def price_amount(self) -> Optional[float]:
+        if self._price_amount is _UNPARSED:
+            self._parse_price()
+        return self._price_amount
+
+    @property
+    def price_currency(self) -> Optional[str]:
+        if self._price_amount is _UNPARSED:
+            self._parse_price()
+        return self._price_currency
+
+    @property
+    def url_key(self) -> str:
+        if self._url_key is _UNPARSED:
+            self._url_key = canonical_url(self.url)
+        return self._url_key
+
+    def to_row(self) -> Tuple:
+        """(title, price_amount, price_currency, location, rooms) as stored in `listings`."""
+        return (self.title or "", self.price_amount, self.price_currency, self.location or "", self.rooms)
+
+    @property
+    def rooms_label(self) -> str:
+        """3.0 → '3', 3.5 → '3.5', unknown → ''."""
+        return f"{self.rooms:g}" if self.rooms is not None else ""
 
     def to_dict(self):
         return {
@@ -15,11 +124,19 @@ class RealEstateListing:
             "rooms": self.rooms
         }
 
+    def __eq__(self, other):
+        if not isinstance(other, RealEstateListing):
+            return NotImplemented
+        return self.url_key == other.url_key and self.to_row() == other.to_row()
+
+    def __hash__(self):
+        return hash(self.url_key)  # str caches its hash
+
     def __repr__(self):
         parts = [f"🏠 {self.title}"]
 
-        if self.rooms:
-            parts.append(f"{self.rooms} Zi")
+        if self.rooms is not None:
+            parts.append(f"{self.rooms_label} Zi")
         if self.price:
             parts.append(self.price)
         if self.location:
@@ -27,4 +144,3 @@ class RealEstateListing:
 
         main_line = " | ".join(parts)
         return f"{main_line}\n🔗 {self.url}"
-
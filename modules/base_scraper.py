@@ -1,9 +1,33 @@
+from collections import Counter
+
+
 class BaseScraper:
-    def __init__(self, config):
+    # key of the site's rate limit / cooldown state in utils/crawl_control.py
+    domain = None
+
+    def __init__(self, config, seen_filter=None):
         self.config = config
+        # optional hook: (URLs, optional matching item dicts) -> set of those already seen
+        self.seen_filter = seen_filter
+        self.stats = Counter()
 
     def get_name(self):
         return self.config.get("name", "unnamed")
 
+    def drop_seen(self, urls, items=None):
+        """
+        Remove already-seen URLs before any detail navigation happens. `items`
+        (dicts with title/price/location/url/rooms, same order as `urls`) let a
+        shared fetch check only the profiles the listing is relevant for.
+        """
+        if not self.seen_filter or not urls:
+            return urls
+        seen = self.seen_filter(urls, items)
+        if not seen:
+            return urls
+        fresh = [u for u in urls if u not in seen]
+        self.stats["detail_fetches_avoided"] += len(urls) - len(fresh)
+        return fresh
+
     def scrape(self):
-        raise NotImplementedError("Each scraper must implement scrape()")
\ No newline at end of file
+        raise NotImplementedError("Each scraper must implement scrape()")
@@ -2,72 +2,86 @@ from modules.base_scraper import BaseScraper
 from models.real_estate_listing import RealEstateListing
 import re
 from utils.url_builder import build_flatfox_url
-from playwright.sync_api import sync_playwright
-import os
+from utils.browser_pool import borrow_page
+from utils.crawl_cache import cached_fetch
+from utils.crawl_control import DomainCoolingDown, cooldown_remaining, polite_pause, report_blocked, report_success
+from utils import metrics
 
 class FlatfoxScraper(BaseScraper):
+    domain = "flatfox.ch"
+
     def scrape(self):
         params = self.config["params"]
         url = build_flatfox_url(params)
 
-        headless = os.environ.get("HEADLESS", "true").lower() == "true"
-        channel = os.getenv("PW_CHANNEL")  # optional (e.g., "msedge" or "chrome")
-
-        with sync_playwright() as p:
-            launch_opts = {"headless": headless}
-            if channel:
-                launch_opts["channel"] = channel
+        # profiles with the same search share one page load per cache TTL
+        items = cached_fetch(url, lambda: self._fetch_items(url))
+        return [
+            RealEstateListing(
+                title=item.get("title"),
+                price=item.get("price"),
+                location=item.get("location"),
+                url=item.get("url"),
+                rooms=item.get("rooms")
+            )
+            for item in items
+        ]
 
-            browser = p.chromium.launch(**launch_opts)
-            page = browser.new_page()
+    def _fetch_items(self, url):
+        with borrow_page("flatfox") as lease:
+            page = lease.page
             print(f"🔍 Navigating to: {url}")
-            page.goto(url)
+            polite_pause(url)
+            with metrics.timer("navigation", domain=self.domain):
+                response = page.goto(url)
 
-            # Accept cookies if visible (best effort)
-            try:
-                page.click('button:has-text("Akzeptieren")', timeout=5000)
-            except:
-                pass
+            # 403/429: slow flatfox.ch down and let the scheduler move on instead of retrying
+            status = response.status if response is not None else None
+            if status in (403, 429):
+                print(f"⚠️  Flatfox answered HTTP {status}, cooling flatfox.ch down...")
+                report_blocked(url)
+                raise DomainCoolingDown(self.domain, cooldown_remaining(url))
 
-            page.wait_for_selector(".listing-thumb", timeout=20000)
-            page.wait_for_timeout(2000)
+            # Accept cookies if visible (best effort; warm contexts already accepted)
+            if lease.fresh:
+                try:
+                    page.click('button:has-text("Akzeptieren")', timeout=5000)
+                except:
+                    pass
 
-            listings = []
-            for el in page.query_selector_all(".listing-thumb"):
-                title_el = el.query_selector(".listing-thumb-title h2")
-                price_el = el.query_selector(".price")
-                link_el = el.query_selector("a")
+            with metrics.timer("render_wait", domain=self.domain):
+                page.wait_for_selector(".listing-thumb", timeout=20000)
+                page.wait_for_timeout(2000)
 
-                if not (title_el and price_el and link_el):
-                    continue
+            items = []
+            with metrics.timer("parse"):
+                for el in page.query_selector_all(".listing-thumb"):
+                    title_el = el.query_selector(".listing-thumb-title h2")
+                    price_el = el.query_selector(".price")
+                    link_el = el.query_selector("a")
 
-                title_text = title_el.inner_text().strip()
-                price_text = price_el.inner_text().strip()
-                href = link_el.get_attribute("href") or ""
-                full_url = "https://flatfox.ch" + href
+                    if not (title_el and price_el and link_el):
+                        continue
 
-                # Extract rooms from the title if present (e.g., "3.5 Zimmer")
-                rooms_match = re.search(r"([\d.]+)\s*Zimmer", title_text)
-                rooms_val = float(rooms_match.group(1)) if rooms_match else None
+                    title_text = title_el.inner_text().strip()
+                    price_text = price_el.inner_text().strip()
+                    href = link_el.get_attribute("href") or ""
+                    full_url = "https://flatfox.ch" + href
 
-                # Location heuristic: last comma-separated token
-                location_text = title_text.split(",")[-1].strip() if "," in title_text else ""
+                    # Extract rooms from the title if present (e.g., "3.5 Zimmer")
+                    rooms_match = re.search(r"([\d.]+)\s*Zimmer", title_text)
+                    rooms_val = float(rooms_match.group(1)) if rooms_match else None
 
-                item = {
-                    "title": title_text,
-                    "price": price_text,  # keep original (already includes currency on Flatfox)
-                    "location": location_text,
-                    "url": full_url,
-                    "rooms": rooms_val,
-                }
+                    # Location heuristic: last comma-separated token
+                    location_text = title_text.split(",")[-1].strip() if "," in title_text else ""
 
-                listings.append(RealEstateListing(
-                    title=item.get("title"),
-                    price=item.get("price"),
-                    location=item.get("location"),
-                    url=item.get("url"),
-                    rooms=item.get("rooms")
-                ))
+                    items.append({
+                        "title": title_text,
+                        "price": price_text,  # keep original (already includes currency on Flatfox)
+                        "location": location_text,
+                        "url": full_url,
+                        "rooms": rooms_val,
+                    })
 
-            browser.close()
-            return listings
+            report_success(url)
+            return items
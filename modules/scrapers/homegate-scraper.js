@@ -1,5 +1,5 @@
 // modules/scrapers/homegate-scraper.js
-// Rich PDP extractor with stealth + polite pacing & block backoff
+// Rich PDP extractor with stealth + polite pacing; blocks are reported and skipped, never slept off
 
 const puppeteer = require('puppeteer-extra');
 const StealthPlugin = require('puppeteer-extra-plugin-stealth');
@@ -14,19 +14,99 @@ const asFloat = (name, def) => {
 
 const CRAWL_MIN_DELAY_SEC = asFloat('CRAWL_MIN_DELAY_SEC', 2.0);     // base delay between actions
 const CRAWL_JITTER_SEC    = asFloat('CRAWL_JITTER_SEC', 2.0);        // extra 0..JITTER
-const BACKOFF_MIN_SEC     = asFloat('CRAWL_BACKOFF_MIN', 10);        // on block
-const BACKOFF_MAX_SEC     = asFloat('CRAWL_BACKOFF_MAX', 300);
+const COOLDOWN_SEC        = asFloat('CRAWL_COOLDOWN_BASE_SEC', 120); // local limiter: pause after a block
 const ATTEMPTS_PER_PDP    = Math.max(1, Number(process.env.CRAWL_PDP_ATTEMPTS ?? 2));
+const PDP_CONCURRENCY     = Math.max(1, Math.floor(asFloat('CRAWL_PDP_CONCURRENCY', 3)));
+const RATE_BURST          = Math.max(1, Math.floor(asFloat('CRAWL_RATE_BURST', 1)));
 
 // ---- Helpers ----
 const sleep = (ms) => new Promise((r) => setTimeout(r, ms));
 const rand = (a, b) => a + Math.random() * (b - a);
-const politePause = async () =>
-  sleep((CRAWL_MIN_DELAY_SEC + Math.random() * CRAWL_JITTER_SEC) * 1000);
 
 const jitter = (min = 900, max = 1800) => Math.floor(rand(min, max));
-const backoff = async () =>
-  sleep(rand(BACKOFF_MIN_SEC * 1000, BACKOFF_MAX_SEC * 1000));
+
+// Global token bucket shared by all pages. The refill rate equals the average
+// request rate of the old sequential loop (polite pause + read jitter +
+// occasional long read pause), no matter how many pages are open. Each take()
+// costs a random 0.5–1.5 tokens so the spacing is not metronomic. Same interface
+// as RemoteLimiter: after report(url, true) take() resolves false for
+// COOLDOWN_SEC, so queued URLs are skipped instead of navigating into the block.
+class TokenBucket {
+  constructor(ratePerSec, burst) {
+    this.ratePerSec = ratePerSec;
+    this.capacity = burst + 0.5; // room for the largest single cost
+    this.tokens = 1;
+    this.last = Date.now();
+    this.tail = Promise.resolve();
+    this.cooldownUntil = 0;
+  }
+
+  _refill() {
+    const now = Date.now();
+    this.tokens = Math.min(this.capacity, this.tokens + ((now - this.last) / 1000) * this.ratePerSec);
+    this.last = now;
+  }
+
+  // Waiters are served FIFO; each take() resolves true once its cost is covered,
+  // or false (without spending tokens) while cooling down.
+  take() {
+    const cost = rand(0.5, 1.5);
+    const turn = this.tail.then(async () => {
+      if (Date.now() < this.cooldownUntil) return false;
+      this._refill();
+      while (this.tokens < cost) {
+        await sleep(((cost - this.tokens) / this.ratePerSec) * 1000);
+        this._refill();
+      }
+      this.tokens -= cost;
+      return true;
+    });
+    this.tail = turn.catch(() => {});
+    return turn;
+  }
+
+  report(_url, blocked) {
+    if (blocked) this.cooldownUntil = Date.now() + COOLDOWN_SEC * 1000;
+  }
+}
+
+// --worker --shared-rate: every navigation waits for a grant from the Python side,
+// whose SQLite-backed limiter (utils/crawl_control.py) paces all threads and
+// processes per domain. The bucket itself stays in Python, as does the
+// block/cooldown state: take() resolves false while the domain cools down,
+// and report() feeds each navigation's outcome back.
+class RemoteLimiter {
+  constructor(send) {
+    this.send = send;
+    this.waiting = new Map(); // token -> resolve
+    this.seq = 0;
+  }
+
+  take(url) {
+    const token = ++this.seq;
+    return new Promise((resolve) => {
+      this.waiting.set(token, resolve);
+      this.send({ type: 'acquire', token, url });
+    });
+  }
+
+  grant(token, denied) {
+    const resolve = this.waiting.get(token);
+    if (resolve) {
+      this.waiting.delete(token);
+      resolve(!denied);
+    }
+  }
+
+  report(url, blocked) {
+    this.send({ type: 'outcome', url, blocked });
+  }
+}
+
+const READ_PAUSE_SEC = 1.35 + 0.12 * 3.85; // mean of jitter() + the 12% long pause
+const meanGapSec = Math.max(0.05, CRAWL_MIN_DELAY_SEC + CRAWL_JITTER_SEC / 2 + READ_PAUSE_SEC);
+// replaced by a RemoteLimiter in --shared-rate worker mode
+let rateLimiter = new TokenBucket(1 / meanGapSec, RATE_BURST);
 
 function looksBlocked(title, url, htmlSample = '') {
   const t = (title || '').toLowerCase();
@@ -81,36 +161,47 @@ function extractListingFromState(state) {
 }
 
 async function extractFromPDP(page, url) {
-  const scriptTxt = await page.evaluate(() => {
-    const nodes = Array.from(document.querySelectorAll('script'));
-    const node = nodes.find(
+  // Parse the (multi-MB) state inside the page and hand back only state.listing.listing,
+  // instead of shipping the whole script text over the DevTools bridge.
+  const found = await page.evaluate(() => {
+    const node = Array.from(document.scripts).find(
       (s) => s.textContent && s.textContent.includes('__INITIAL_STATE__')
     );
-    return node ? node.textContent : '';
+    if (node) {
+      try {
+        const raw = node.textContent;
+        const state = JSON.parse(raw.slice(raw.indexOf('{'), raw.lastIndexOf('}') + 1));
+        return { state: { listing: { listing: state?.listing?.listing ?? null } } };
+      } catch (e) { /* not plain JSON; try the live object */ }
+    }
+    const live = window.__INITIAL_STATE__;
+    if (live && live.listing) return { state: { listing: { listing: live.listing.listing ?? null } } };
+    return { script: node ? node.textContent : '' };
   });
 
-  if (!scriptTxt) return null;
-
-  const jsonTxt = stripInitialState(scriptTxt);
-  if (!jsonTxt) return null;
-
-  try {
-    const state = JSON.parse(jsonTxt);
-    const data = extractListingFromState(state);
-    if (!data) return null;
-    return {
-      url,
-      title: data.title || null,
-      price: data.price || null,
-      location: data.location || null,
-      rooms: data.rooms ?? null,
-    };
-  } catch {
-    return null;
+  let state = found && found.state;
+  if (!state) {
+    const jsonTxt = stripInitialState(found && found.script);
+    if (!jsonTxt) return null;
+    try {
+      state = JSON.parse(jsonTxt);
+    } catch {
+      return null;
+    }
   }
+
+  const data = extractListingFromState(state);
+  if (!data) return null;
+  return {
+    url,
+    title: data.title || null,
+    price: data.price || null,
+    location: data.location || null,
+    rooms: data.rooms ?? null,
+  };
 }
 
-async function scrapePDPs(urls) {
+async function openSession() {
   const launchOptions = {
     headless: true,
     // If you really want the real Chrome channel:
@@ -123,99 +214,241 @@ async function scrapePDPs(urls) {
   };
 
   const browser = await puppeteer.launch(launchOptions);
-  const page = await browser.newPage();
 
-  // Realistic headers/viewport
-  await page.setExtraHTTPHeaders({
-    'Accept-Language': 'de-CH,de;q=0.9,en;q=0.8',
-  });
-  await page.setViewport({ width: 1440, height: 900 });
-
-  // Keep traffic light; __INITIAL_STATE__ lives in HTML, so we can block heavy assets
-  await page.setRequestInterception(true);
-  page.on('request', (req) => {
-    const type = req.resourceType();
-    if (['image', 'font', 'media', 'stylesheet', 'other'].includes(type)) {
-      req.abort();
-    } else {
-      req.continue();
-    }
-  });
+  // All pages live in the default context, so they share the warm-up cookies.
+  const pages = [];
+  for (let i = 0; i < PDP_CONCURRENCY; i++) {
+    const page = i === 0 ? (await browser.pages())[0] || (await browser.newPage()) : await browser.newPage();
 
-  // Warm-up hit (gives us cookies/session)
-  try {
-    await politePause();
-    await page.goto('https://www.homegate.ch/', {
-      waitUntil: 'domcontentloaded',
-      timeout: 30000,
+    // Realistic headers/viewport
+    await page.setExtraHTTPHeaders({
+      'Accept-Language': 'de-CH,de;q=0.9,en;q=0.8',
+    });
+    await page.setViewport({ width: 1440, height: 900 });
+
+    // Keep traffic light; __INITIAL_STATE__ lives in HTML, so we can block heavy assets
+    await page.setRequestInterception(true);
+    page.on('request', (req) => {
+      const type = req.resourceType();
+      if (['image', 'font', 'media', 'stylesheet', 'other'].includes(type)) {
+        req.abort();
+      } else {
+        req.continue();
+      }
     });
-    await sleep(600 + jitter());
+    pages.push(page);
+  }
+
+  // Warm-up hit (gives us cookies/session); skipped while homegate.ch cools down
+  const home = 'https://www.homegate.ch/';
+  try {
+    if ((await rateLimiter.take(home)) === false) {
+      console.error('🧊 Skipping warm-up: homegate.ch is cooling down');
+    } else {
+      await pages[0].goto(home, { waitUntil: 'domcontentloaded', timeout: 30000 });
+      rateLimiter.report(home, looksBlocked(await pages[0].title().catch(() => ''), pages[0].url()));
+    }
   } catch {}
 
-  const results = [];
+  return { browser, pages };
+}
 
-  for (const url of urls) {
-    let out = { url, title: null, price: null, rooms: null, location: null };
+async function scrapeOne(page, url, cancelled = () => false) {
+  let out = { url, title: null, price: null, rooms: null, location: null };
 
-    for (let attempt = 1; attempt <= ATTEMPTS_PER_PDP; attempt++) {
-      try {
-        console.error(`🔎 Visiting PDP [${attempt}/${ATTEMPTS_PER_PDP}]: ${url}`);
+  for (let attempt = 1; attempt <= ATTEMPTS_PER_PDP; attempt++) {
+    try {
+      console.error(`🔎 Visiting PDP [${attempt}/${ATTEMPTS_PER_PDP}]: ${url}`);
 
-        await politePause();
-        await page.goto(url, { waitUntil: 'domcontentloaded', timeout: 30000 });
+      // global pacing replaces per-page sleeps; false = domain cooling down, skip it
+      if ((await rateLimiter.take(url)) === false) {
+        console.error(`🧊 Skipping ${url}: homegate.ch is cooling down`);
+        out.skipped = true;
+        break;
+      }
+      if (cancelled()) break; // the caller gave up while we waited for the grant
+      await page.goto(url, { waitUntil: 'domcontentloaded', timeout: 30000 });
+
+      const title = await page.title().catch(() => '');
+      const htmlSample = await page
+        .$eval('body', (b) => (b && b.innerText ? b.innerText.slice(0, 800) : ''))
+        .catch(() => '');
+
+      if (looksBlocked(title, page.url(), htmlSample)) {
+        // the limiter starts the cooldown (in Python with --shared-rate, locally
+        // otherwise) and denies the queued URLs; the result tells Python either way
+        console.error('⚠️  Block/Cloudflare detected, reporting and skipping...');
+        rateLimiter.report(url, true);
+        out.blocked = true;
+        break;
+      }
+      rateLimiter.report(url, false);
 
-        // Short, human-ish pause before reading
-        await sleep(jitter());
-        if (Math.random() < 0.12) await sleep(2500 + jitter());
+      const rich = await extractFromPDP(page, url);
+      if (rich) {
+        out = rich;
+      } else {
+        out.title = title || null; // graceful fallback
+      }
+      break; // success for this URL
+    } catch (err) {
+      console.error(`❌ Error for ${url}: ${err?.message || err}`);
+      // exponential-ish pause before next attempt
+      const pause = 800 * Math.pow(2, attempt - 1) + jitter(400, 900);
+      await sleep(pause);
+      if (attempt === ATTEMPTS_PER_PDP) {
+        // give up (keep fallback out)
+      }
+    }
+  }
 
-        const title = await page.title().catch(() => '');
-        const htmlSample = await page
-          .$eval('body', (b) => (b && b.innerText ? b.innerText.slice(0, 800) : ''))
-          .catch(() => '');
+  return out;
+}
 
-        if (looksBlocked(title, page.url(), htmlSample)) {
-          console.error('⚠️  Block/Cloudflare detected, backing off...');
-          await backoff();
-          if (attempt < ATTEMPTS_PER_PDP) continue;
-          break;
-        }
+// Async FIFO shared by the page workers; next() resolves null once closed and drained.
+function createQueue() {
+  const items = [];
+  const waiters = [];
+  let closed = false;
+  return {
+    push(item) {
+      const w = waiters.shift();
+      if (w) w(item);
+      else items.push(item);
+    },
+    close() {
+      closed = true;
+      while (waiters.length) waiters.shift()(null);
+    },
+    next() {
+      if (items.length) return Promise.resolve(items.shift());
+      if (closed) return Promise.resolve(null);
+      return new Promise((resolve) => waiters.push(resolve));
+    },
+  };
+}
 
-        const rich = await extractFromPDP(page, url);
-        if (rich) {
-          out = rich;
-        } else {
-          out.title = title || null; // graceful fallback
+// One loop per page, all pulling jobs ({ url, done, cancelled? }) from the shared queue.
+// A cancelled job is dropped without a response.
+function startPageWorkers(pages, queue) {
+  return Promise.all(
+    pages.map(async (page) => {
+      for (let job = await queue.next(); job !== null; job = await queue.next()) {
+        const cancelled = job.cancelled || (() => false);
+        if (cancelled()) {
+          job.done(null, null); // lets the worker forget the id; nothing is sent
+          continue;
         }
-        break; // success for this URL
-      } catch (err) {
-        console.error(`❌ Error for ${url}: ${err?.message || err}`);
-        // exponential-ish pause before next attempt
-        const pause = 800 * Math.pow(2, attempt - 1) + jitter(400, 900);
-        await sleep(pause);
-        if (attempt === ATTEMPTS_PER_PDP) {
-          // give up (keep fallback out)
+        try {
+          job.done(null, await scrapeOne(page, job.url, cancelled));
+        } catch (e) {
+          job.done(e);
         }
       }
-    }
+    })
+  );
+}
 
-    results.push(out);
-  }
+async function scrapePDPs(urls) {
+  const { browser, pages } = await openSession();
+  const queue = createQueue();
+  const workers = startPageWorkers(pages, queue);
+
+  // results[i] belongs to urls[i], whatever order the pages finish in
+  const results = new Array(urls.length);
+  urls.forEach((url, i) =>
+    queue.push({
+      url,
+      done: (err, out) => {
+        results[i] = err ? { url, title: null, price: null, rooms: null, location: null } : out;
+      },
+    })
+  );
+  queue.close();
+  await workers;
 
   await browser.close();
   return results;
 }
 
-// stdin → URLs → stdout JSON
-process.stdin.setEncoding('utf8');
-let input = '';
-process.stdin.on('data', (chunk) => (input += chunk));
-process.stdin.on('end', async () => {
-  try {
-    const urls = JSON.parse(input || '[]');
-    const data = await scrapePDPs(urls);
-    process.stdout.write(JSON.stringify(data));
-  } catch (e) {
-    console.error('Fatal error:', e?.message || e);
-    process.stdout.write('[]');
-  }
-});
+// --worker: one JSON request per stdin line → one JSON response per stdout line.
+//   in:  {"id": 7, "url": "https://www.homegate.ch/mieten/123"}
+//   out: {"id": 7, "result": {url, title, price, rooms, location}}
+// The browser stays warm until stdin closes; up to CRAWL_PDP_CONCURRENCY
+// requests are in progress at once and each response is written when ready.
+// With --shared-rate, navigations are paced by the Python side:
+//   out: {"type": "acquire", "token": 3, "url": "..."}   in: {"type": "grant", "token": 3, "denied": false}
+//   out: {"type": "outcome", "url": "...", "blocked": true}
+// The caller may give up on requests:
+//   in:  {"type": "cancel", "ids": [7, 8]}   → not started (or not yet navigating) ones are dropped
+async function runWorker() {
+  const readline = require('readline');
+  const send = (msg) => process.stdout.write(JSON.stringify(msg) + '\n');
+  if (process.argv.includes('--shared-rate')) rateLimiter = new RemoteLimiter(send);
+
+  const queue = createQueue();
+  const cancelledIds = new Set();
+  const sessionReady = openSession();
+  const workers = sessionReady.then(({ pages }) => {
+    send({ type: 'ready', pages: pages.length });
+    return startPageWorkers(pages, queue);
+  });
+
+  const rl = readline.createInterface({ input: process.stdin, terminal: false });
+  rl.on('line', (line) => {
+    if (!line.trim()) return;
+    let req;
+    try {
+      req = JSON.parse(line);
+    } catch {
+      console.error(`⚠️  Ignoring malformed request: ${line.slice(0, 200)}`);
+      return;
+    }
+    if (req.type === 'grant') {
+      if (rateLimiter instanceof RemoteLimiter) rateLimiter.grant(req.token, req.denied);
+      return;
+    }
+    if (req.type === 'cancel') {
+      for (const id of req.ids || []) cancelledIds.add(id);
+      return;
+    }
+    queue.push({
+      url: req.url,
+      cancelled: () => cancelledIds.has(req.id),
+      done: (err, out) => {
+        if (cancelledIds.delete(req.id)) return; // nobody is waiting for it any more
+        send(err ? { id: req.id, error: err?.message || String(err) } : { id: req.id, result: out });
+      },
+    });
+  });
+  rl.on('close', async () => {
+    queue.close();
+    try {
+      await workers;
+      const { browser } = await sessionReady;
+      await browser.close();
+    } catch (e) {
+      console.error('Fatal error:', e?.message || e);
+    }
+    process.exit(0);
+  });
+}
+
+if (process.argv.includes('--worker')) {
+  runWorker();
+} else {
+  // stdin → URLs → stdout JSON
+  process.stdin.setEncoding('utf8');
+  let input = '';
+  process.stdin.on('data', (chunk) => (input += chunk));
+  process.stdin.on('end', async () => {
+    try {
+      const urls = JSON.parse(input || '[]');
+      const data = await scrapePDPs(urls);
+      process.stdout.write(JSON.stringify(data));
+    } catch (e) {
+      console.error('Fatal error:', e?.message || e);
+      process.stdout.write('[]');
+    }
+  });
+}
@@ -1,14 +1,23 @@
 from modules.base_scraper import BaseScraper
 from utils.url_builder import build_homegate_url
 from models.real_estate_listing import RealEstateListing
-import re
 import subprocess
 import json
 import os
 import random
+import threading
 import time
+from contextlib import ExitStack
 from typing import List
-from playwright.sync_api import sync_playwright, Page
+from playwright.sync_api import Page
+from utils.browser_pool import borrow_page
+from utils.crawl_cache import cached_fetch, get_cache, normalize_request
+from utils.node_worker import NodeWorker
+from utils import metrics
+from utils.crawl_control import (
+    DomainCoolingDown, get_limiter, polite_pause, report_blocked, report_success,
+)
+from modules.scrapers.homegate_state import STATE_LISTINGS_JS, listings_from_state_text, search_items
 
 
 def _env_float(name: str, default: float) -> float:
@@ -26,22 +35,51 @@ def _env_int(name: str, default: int) -> int:
 
 
 # ---- Crawl controls (all configurable via env)
-_CRAWL_MIN_DELAY = _env_float("CRAWL_MIN_DELAY_SEC", 2.0)
-_CRAWL_JITTER = _env_float("CRAWL_JITTER_SEC", 2.0)
-_BACKOFF_MIN = _env_float("CRAWL_BACKOFF_MIN", 10.0)
-_BACKOFF_MAX = _env_float("CRAWL_BACKOFF_MAX", 300.0)
 _MAX_DETAIL_PER_RUN = _env_int("CRAWL_MAX_DETAIL_PER_RUN", 10)
 _NODE_BATCH = _env_int("CRAWL_NODE_BATCH_SIZE", 8)
 _NODE_BATCH_PAUSE = _env_float("CRAWL_NODE_BATCH_PAUSE", 4.0)
-
-
-def _polite_pause():
-    # base + jitter
-    time.sleep(_CRAWL_MIN_DELAY + random.random() * _CRAWL_JITTER)
-
-
-def _backoff():
-    time.sleep(random.uniform(_BACKOFF_MIN, _BACKOFF_MAX))
+_NODE_WORKER = os.getenv("CRAWL_NODE_WORKER", "true").lower() == "true"
+# the PDP worker takes its navigation tokens from utils/crawl_control's shared limiter
+_NODE_SHARED_RATE = os.getenv("CRAWL_NODE_SHARED_RATE", "true").lower() == "true"
+_DETAIL_MODE = os.getenv("HOMEGATE_DETAIL_MODE", "enrich").lower()  # list | enrich | pdp
+_MAX_PAGES = _env_int("HOMEGATE_MAX_PAGES", 5)
+_PREFETCH_PAGES = _env_int("HOMEGATE_PREFETCH_PAGES", 0)  # >0: fetch pages 2..1+N in parallel
+_NODE_TIMEOUT = _env_float("CRAWL_NODE_TIMEOUT_SEC", 600.0)
+_DETAIL_CACHE_TTL = _env_float("CRAWL_CACHE_DETAIL_TTL_SEC", 6 * 3600.0)  # PDP data barely changes
+
+_NODE_SCRIPT = "modules/scrapers/homegate-scraper.js"
+
+
+# --- Anti-detection tuning (applied when the warm "homegate" context is created)
+_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
+]
+
+_CONTEXT_OPTIONS = dict(
+    locale="de-CH",
+    timezone_id="Europe/Zurich",
+    viewport={"width": 1366, "height": 768},
+    extra_http_headers={
+        "Accept-Language": "de-CH,de;q=0.9,en;q=0.8",
+        "Cache-Control": "no-cache",
+        "Pragma": "no-cache",
+        "Upgrade-Insecure-Requests": "1",
+    },
+)
+
+_STEALTH_INIT = """
+Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+Object.defineProperty(navigator, 'languages', {get: () => ['de-CH','de','en']});
+Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
+const origQuery = (navigator.permissions && navigator.permissions.query) ? navigator.permissions.query.bind(navigator.permissions) : null;
+if (origQuery) {
+  navigator.permissions.query = (p) => p && p.name === 'notifications'
+    ? Promise.resolve({ state: 'prompt' })
+    : origQuery(p);
+}
+"""
 
 
 def _looks_blocked(page: Page) -> bool:
@@ -58,29 +96,117 @@ def _looks_blocked(page: Page) -> bool:
     return False
 
 
+_PREFETCH_JS = """
+async (urls) => Promise.all(urls.map((u) =>
+  fetch(u, { credentials: 'include' })
+    .then((r) => (r.ok ? r.text() : ''))
+    .catch(() => '')
+))
+"""
+
+_DETAIL_FIELDS = ("title", "price", "rooms", "location")
+
+
+def _missing_fields(item: dict) -> List[str]:
+    return [f for f in _DETAIL_FIELDS if item.get(f) in (None, "")]
+
+
+# ---- One warm Node/Puppeteer PDP worker per run, shared by all Homegate profiles
+_pdp_worker_lock = threading.Lock()
+_pdp_worker = None
+
+
+def _on_worker_event(msg: dict, reply) -> None:
+    """
+    PDP worker events, handled off the reader thread:
+      {"type": "acquire", "token": n, "url": ...} → wait for the shared limiter, then
+          {"type": "grant", "token": n} (with "denied": true while homegate.ch cools down)
+      {"type": "outcome", "url": ..., "blocked": bool} → AIMD bookkeeping
+    """
+    kind = msg.get("type")
+    if kind not in ("acquire", "outcome"):
+        return
+
+    def handle():
+        denied = False
+        try:
+            if kind == "outcome":
+                get_limiter().report(msg.get("url"), blocked=bool(msg.get("blocked")))
+            else:
+                get_limiter().acquire(msg.get("url"))
+        except DomainCoolingDown:
+            denied = True
+        except Exception as e:
+            print(f"⚠️  Rate limiter unavailable, granting anyway: {e}")
+        finally:
+            get_limiter().close()  # this thread's connection
+        if kind == "acquire":
+            reply({"type": "grant", "token": msg.get("token"), "denied": denied})
+
+    threading.Thread(target=handle, name="homegate-pdp-event", daemon=True).start()
+
+
+def get_pdp_worker() -> NodeWorker:
+    global _pdp_worker
+    with _pdp_worker_lock:
+        if _pdp_worker is None:
+            if _NODE_SHARED_RATE:
+                _pdp_worker = NodeWorker(_NODE_SCRIPT, args=("--worker", "--shared-rate"),
+                                         name="homegate-pdp", on_event=_on_worker_event)
+            else:
+                _pdp_worker = NodeWorker(_NODE_SCRIPT, args=("--worker",), name="homegate-pdp")
+        return _pdp_worker
+
+
+def shutdown_pdp_worker() -> None:
+    global _pdp_worker
+    with _pdp_worker_lock:
+        worker, _pdp_worker = _pdp_worker, None
+    if worker is not None:
+        worker.close()
+
+
 class HomegateScraper(BaseScraper):
+    domain = "homegate.ch"
+
     def scrape(self):
-        urls = self._get_listing_urls(self.config["params"])
-        print(f"🔗 Extracted {len(urls)} listing URLs.")
+        items = self._get_search_items(self.config["params"])
+        print(f"🔗 Extracted {len(items)} listings from the result list.")
+
+        # Drop already-seen listings *before* the cap so it only spends PDP fetches on new ones.
+        # Known listings are still returned with their search-result data (price changes, relistings).
+        fresh_urls = set(self.drop_seen([it["url"] for it in items], items))
+        fresh = [it for it in items if it["url"] in fresh_urls]
+        if len(fresh) < len(items):
+            print(f"⏭️  Skipping {len(items) - len(fresh)} already-seen listings (no detail fetch).")
+
+        # list: search JSON only | enrich: PDP only where fields are missing | pdp: always
+        if _DETAIL_MODE == "pdp":
+            urls = [it["url"] for it in fresh]
+        elif _DETAIL_MODE == "enrich":
+            urls = [it["url"] for it in fresh if _missing_fields(it)]
+        else:
+            urls = []
+        self.stats["detail_fetches_avoided"] += len(fresh) - len(urls)
 
         # Cap detail pages per run
         if _MAX_DETAIL_PER_RUN > 0 and len(urls) > _MAX_DETAIL_PER_RUN:
             urls = urls[:_MAX_DETAIL_PER_RUN]
             print(f"🔒 Capped detail pages to per-run limit: {_MAX_DETAIL_PER_RUN}")
 
-        # ---- FIX: use a local batch_size instead of mutating _NODE_BATCH
-        batch_size = _NODE_BATCH if _NODE_BATCH > 0 else len(urls)
-
-        all_items: List[dict] = []
-        for i in range(0, len(urls), batch_size):
-            batch = urls[i: i + batch_size]
-            items = self._send_urls_to_node(batch)
-            all_items.extend(items)
-            if i + batch_size < len(urls):
-                time.sleep(_NODE_BATCH_PAUSE)  # small pause between batches
+        if urls:
+            by_url = self._fetch_details(urls)
+            for it in items:
+                detail = by_url.get(it["url"])
+                if not detail:
+                    continue
+                for field in _DETAIL_FIELDS:
+                    # pdp mode trusts the detail page; enrich only fills the gaps
+                    if detail.get(field) not in (None, "") and (_DETAIL_MODE == "pdp" or it.get(field) in (None, "")):
+                        it[field] = detail[field]
 
         listings = []
-        for item in all_items:
+        for item in items:
             listings.append(RealEstateListing(
                 title=item.get("title"),
                 price=item.get("price"),
@@ -91,144 +217,239 @@ class HomegateScraper(BaseScraper):
         return listings
 
 
-    def _get_listing_urls(self, params):
-        # --- Anti-detection tuning ---
-        headless = os.environ.get("HEADLESS", "true").lower() == "true"
-        channel = os.getenv("PW_CHANNEL")  # e.g., "msedge" or "chrome"
-
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
-        ]
-        ua = random.choice(user_agents)
-
+    def _get_search_items(self, params):
+        """
+        Walks result pages ep=1..HOMEGATE_MAX_PAGES. Results are sorted newest
+        first, so the walk stops at the first page whose listings are all seen.
+        Pages come from the shared crawl cache when another profile with the same
+        search loaded them this cycle; the browser is only borrowed on a miss.
+        """
+        with ExitStack() as stack:
+            nav = {"cookies_pending": True, "page": None}
+
+            def live_page() -> Page:
+                if nav["page"] is None:
+                    context_options = dict(_CONTEXT_OPTIONS, user_agent=random.choice(_USER_AGENTS))
+                    lease = stack.enter_context(
+                        borrow_page("homegate", context_options=context_options, init_script=_STEALTH_INIT)
+                    )
+                    nav["page"] = lease.page
+                    nav["cookies_pending"] = lease.fresh  # warm contexts already carry the consent cookie
+                return nav["page"]
+
+            items: List[dict] = []
+            urls_so_far = set()
+            prefetched = {}
+            page_size = None
+
+            for page_no in range(1, max(1, _MAX_PAGES) + 1):
+                url = build_homegate_url(params, page=page_no)
+                if page_no in prefetched:
+                    page_items = prefetched.pop(page_no)
+                else:
+                    page_items = cached_fetch(url, lambda: self._load_result_page(live_page(), url, nav))
+                if not page_items:
+                    break
+
+                # listings can shift between pages while we walk; keep the first occurrence
+                for it in page_items:
+                    if it["url"] not in urls_so_far:
+                        urls_so_far.add(it["url"])
+                        items.append(it)
+
+                if self._all_seen(page_items):
+                    print(f"⏹️  Result page {page_no} holds only known listings, stopping pagination.")
+                    break
+                if page_size is None:
+                    page_size = len(page_items)
+                elif len(page_items) < page_size:
+                    break  # short page → last page
+
+                if page_no == 1 and _PREFETCH_PAGES > 0 and _MAX_PAGES > 1:
+                    ahead = range(2, min(_MAX_PAGES, 1 + _PREFETCH_PAGES) + 1)
+                    prefetched = self._prefetch_result_pages(live_page, params, ahead)
+
+            if prefetched:
+                self.stats["result_pages_prefetched_unused"] += len(prefetched)
+            return items
+
+    def _all_seen(self, page_items: List[dict]) -> bool:
+        if not self.seen_filter or not page_items:
+            return False
+        urls = [it["url"] for it in page_items]
+        return set(urls) <= set(self.seen_filter(urls, page_items))
+
+    def _load_result_page(self, page: Page, url: str, nav: dict) -> List[dict]:
         attempts = 3
         backoff_base = 0.8
 
-        with sync_playwright() as p:
-            launch_opts = {"headless": headless}
-            if channel:
-                launch_opts["channel"] = channel
-            browser = p.chromium.launch(**launch_opts)
+        for i in range(1, attempts + 1):
             try:
-                context = browser.new_context(
-                    user_agent=ua,
-                    locale="de-CH",
-                    timezone_id="Europe/Zurich",
-                    viewport={"width": 1366, "height": 768},
-                    extra_http_headers={
-                        "Accept-Language": "de-CH,de;q=0.9,en;q=0.8",
-                        "Cache-Control": "no-cache",
-                        "Pragma": "no-cache",
-                        "Upgrade-Insecure-Requests": "1",
-                    },
-                )
-                context.add_init_script("""
-Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-Object.defineProperty(navigator, 'languages', {get: () => ['de-CH','de','en']});
-Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
-const origQuery = (navigator.permissions && navigator.permissions.query) ? navigator.permissions.query.bind(navigator.permissions) : null;
-if (origQuery) {
-  navigator.permissions.query = (p) => p && p.name === 'notifications'
-    ? Promise.resolve({ state: 'prompt' })
-    : origQuery(p);
-}
-                """)
+                polite_pause(url)  # <<< pace every navigation (shared per-domain budget)
+                with metrics.timer("navigation", domain=self.domain):
+                    page.goto(url, timeout=30000, wait_until="domcontentloaded")
 
-                page = context.new_page()
-                url = build_homegate_url(params)
-
-                for i in range(1, attempts + 1):
+                # accept cookies (best effort)
+                if nav["cookies_pending"]:
                     try:
-                        _polite_pause()  # <<< pace every navigation
-                        page.goto(url, timeout=30000, wait_until="domcontentloaded")
-
-                        # accept cookies (best effort)
-                        try:
-                            page.locator("button:has-text('Akzeptieren')").first.click(timeout=2000)
-                        except:
-                            pass
-
-                        time.sleep(random.uniform(0.4, 1.0))
-
-                        # If Cloudflare shows a challenge / access denied, back off hard.
-                        if _looks_blocked(page):
-                            print("⚠️  Cloudflare/blocked signal on list page, backing off...")
-                            _backoff()
-                            if i < attempts:
-                                continue
-                            return []
-
-                        # Look for embedded state
-                        for script in page.locator("script").all():
-                            try:
-                                content = script.inner_text()
-                                if "window.__INITIAL_STATE__" in content:
-                                    return self._extract_listing_urls(content)
-                            except:
-                                continue
-
-                        # Soft fail & retry with growing delay
-                        if i < attempts:
-                            time.sleep(backoff_base * (2 ** (i - 1)) + random.random() * 0.6)
-                            continue
-                        else:
-                            return []
-                    except Exception:
-                        if i < attempts:
-                            time.sleep(backoff_base * (2 ** (i - 1)) + random.random() * 0.6)
-                            continue
-                        else:
-                            return []
-            finally:
-                try:
-                    browser.close()
-                except:
-                    pass
-
-    def _extract_listing_urls(self, script_text):
-        import re
+                        page.locator("button:has-text('Akzeptieren')").first.click(timeout=2000)
+                        nav["cookies_pending"] = False
+                    except:
+                        pass
+
+                time.sleep(random.uniform(0.4, 1.0))
+
+                # Cloudflare challenge / access denied: slow the domain down and let
+                # the scheduler move on instead of sleeping here
+                if _looks_blocked(page):
+                    print("⚠️  Cloudflare/blocked signal on list page, cooling homegate.ch down...")
+                    report_blocked(url)
+                    raise DomainCoolingDown("homegate.ch", get_limiter().cooldown_remaining(url))
+
+                # Embedded state: one evaluate() that hands back only the listings array
+                with metrics.timer("parse"):
+                    state = page.evaluate(STATE_LISTINGS_JS) or {}
+                    if "listings" in state:
+                        report_success(url)
+                        return search_items(state["listings"])
+                    if state.get("script"):
+                        report_success(url)
+                        return self._extract_search_items(state["script"])
+
+                # Soft fail & retry with growing delay
+                if i < attempts:
+                    time.sleep(backoff_base * (2 ** (i - 1)) + random.random() * 0.6)
+                    continue
+                else:
+                    return []
+            except DomainCoolingDown:
+                raise
+            except Exception:
+                if i < attempts:
+                    time.sleep(backoff_base * (2 ** (i - 1)) + random.random() * 0.6)
+                    continue
+                else:
+                    return []
+        return []
+
+    def _prefetch_result_pages(self, live_page, params, page_numbers) -> dict:
+        """
+        Fetch further result pages in parallel from inside the warm context
+        (same cookies/session) without navigating away. Returns {page_no: items};
+        pages already in the crawl cache are taken from there.
+        """
+        cache = get_cache()
+        out = {}
+        missing = []
+        for n in page_numbers:
+            cached = cache.get(normalize_request(build_homegate_url(params, page=n))) if cache else None
+            if cached:
+                out[n] = cached
+            else:
+                missing.append(n)
+        if not missing:
+            return out
+
+        urls = [build_homegate_url(params, page=n) for n in missing]
         try:
-            # Tolerate spaces & optional semicolon after the assignment
-            m = re.search(
-                r"window\.__INITIAL_STATE__\s*=\s*(\{.*\})\s*;?",
-                script_text.strip(),
-                flags=re.DOTALL
-            )
-            json_str = m.group(1) if m else script_text.strip()
-
-            data = json.loads(json_str)
-            listings = (
-                data.get("resultList", {})
-                    .get("search", {})
-                    .get("fullSearch", {})
-                    .get("result", {})
-                    .get("listings", [])
-            )
-            return [
-                f"https://www.homegate.ch/mieten/{(l.get('listing') or {}).get('id') or l.get('id')}"
-                for l in listings
-                if ((l.get('listing') or {}).get('id') or l.get('id'))
-            ]
+            polite_pause(urls[0], requests=len(urls))  # the fetches run in parallel
+            with metrics.timer("prefetch", domain=self.domain):
+                htmls = live_page().evaluate(_PREFETCH_JS, urls)
+        except DomainCoolingDown as e:
+            print(f"🧊 Skipping prefetch: {e}")
+            return out
         except Exception as e:
-            print(f"❌ Failed to parse listings: {e}")
-            # Optional: dump a short snippet for debugging
-            try:
-                with open("debug_homegate_state_snippet.txt", "w", encoding="utf-8") as f:
-                    f.write(script_text[:2000])
-            except:
-                pass
-            return []
+            print(f"⚠️  Prefetch of result pages failed: {e}")
+            return out
+
+        fetched = 0
+        for n, url, html in zip(missing, urls, htmls):
+            if html and "__INITIAL_STATE__" in html:
+                out[n] = self._extract_search_items(html)
+                fetched += 1
+                if out[n] and cache:
+                    cache.put(normalize_request(url), out[n])
+        print(f"📄 Prefetched result pages {missing[0]}..{missing[-1]} ({fetched} usable).")
+        return out
+
+    def _extract_search_items(self, state_text):
+        """Items from a state script or a whole result page (only the listings array is decoded)."""
+        listings = listings_from_state_text(state_text)
+        if listings is not None:
+            return search_items(listings)
+
+        print("❌ Failed to parse listings: no resultList in __INITIAL_STATE__")
+        # Optional: dump a short snippet for debugging
+        try:
+            start = max(0, state_text.find("__INITIAL_STATE__"))
+            with open("debug_homegate_state_snippet.txt", "w", encoding="utf-8") as f:
+                f.write(state_text[start:start + 2000])
+        except:
+            pass
+        return []
+
+    def _fetch_details(self, urls: List[str]) -> dict:
+        """{url: detail} for `urls`; PDPs another profile fetched recently come from the crawl cache."""
+        cache = get_cache()
+        by_url = {}
+        if cache:
+            for u in urls:
+                detail = cache.get(normalize_request(u), durable=True)
+                if detail:
+                    by_url[u] = detail
+            if by_url:
+                self.stats["detail_fetches_cached"] += len(by_url)
+        missing = [u for u in urls if u not in by_url]
+        if not missing:
+            return by_url
+
+        # Node/Puppeteer time, including the worker's own polite waits
+        with metrics.timer("node_details", domain=self.domain):
+            if _NODE_WORKER:
+                details = self._stream_urls_to_worker(missing)
+            else:
+                details = self._send_urls_in_batches(missing)
+        self.stats["detail_fetches"] += len(missing)
+        for d in details:
+            if d and d.get("url"):
+                by_url[d["url"]] = d
+                if cache and not (d.get("blocked") or d.get("skipped")):  # placeholders, not details
+                    cache.put(normalize_request(d["url"]), d, ttl=_DETAIL_CACHE_TTL, durable=True)
+        return by_url
+
+    def _stream_urls_to_worker(self, urls: List[str]) -> List[dict]:
+        """Hand URLs to the shared Node worker; results arrive one by one as pages finish."""
+        items: List[dict] = []
+        reported = _NODE_SHARED_RATE  # with --shared-rate the worker reports blocks itself
+        for _payload, result in get_pdp_worker().stream([{"url": u} for u in urls], timeout=_NODE_TIMEOUT):
+            if result:
+                items.append(result)
+                if result.get("blocked") and not reported:
+                    report_blocked(result.get("url"))
+                    reported = True
+        return items
+
+    def _send_urls_in_batches(self, urls: List[str]) -> List[dict]:
+        # ---- FIX: use a local batch_size instead of mutating _NODE_BATCH
+        batch_size = _NODE_BATCH if _NODE_BATCH > 0 else len(urls)
+
+        all_items: List[dict] = []
+        for i in range(0, len(urls), batch_size):
+            batch = urls[i: i + batch_size]
+            items = self._send_urls_to_node(batch)
+            all_items.extend(items)
+            if i + batch_size < len(urls):
+                time.sleep(_NODE_BATCH_PAUSE)  # small pause between batches
+        return all_items
 
     def _send_urls_to_node(self, urls: List[str]):
         if not urls:
             return []
         try:
             # Small pacing before heavy work (avoid back-to-back batches)
-            _polite_pause()
+            polite_pause(urls[0])
             proc = subprocess.run(
-                ["node", "modules/scrapers/homegate-scraper.js"],
+                ["node", _NODE_SCRIPT],
                 input=json.dumps(urls),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -237,7 +458,14 @@ if (origQuery) {
             )
             if proc.stderr.strip():
                 print("🔴 Node stderr:", proc.stderr.strip())
-            return json.loads(proc.stdout or "[]")
+            items = json.loads(proc.stdout or "[]")
+            blocked = [d for d in items if d and d.get("blocked")]
+            if blocked:
+                # Node skipped the rest of the batch; later batches hit the cooldown in polite_pause
+                report_blocked(blocked[0].get("url"))
+            return items
+        except DomainCoolingDown as e:
+            print(f"🧊 Skipping detail pages: {e}")
         except subprocess.CalledProcessError as e:
             print(f"❌ Node script failed:\n{e.stderr}")
         except json.JSONDecodeError:
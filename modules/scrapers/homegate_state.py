@@ -0,0 +1,138 @@
+"""
+Targeted extraction of the search results from Homegate's __INITIAL_STATE__.
+
+The state blob is several megabytes, but the result list only needs
+resultList.search.fullSearch.result.listings. On a live page
+STATE_LISTINGS_JS parses the state inside the browser and hands back just
+that array, so the blob never crosses the Playwright bridge. For raw text
+(prefetched HTML, or the script when the in-page parse fails)
+listings_from_state_text() walks the key path with str.find and decodes
+only the listings array with JSONDecoder.raw_decode; the full json.loads is
+the fallback when the shortcut doesn't yield a plausible list.
+"""
+import json
+import re
+from typing import List, Optional
+
+_MARKER = "__INITIAL_STATE__"
+_PATH = ("resultList", "search", "fullSearch", "result", "listings")
+_decoder = json.JSONDecoder()
+_colon_re = re.compile(r"\s*:\s*")
+
+# One evaluate() per result page: {listings: [...]} when the state could be read in
+# the page, otherwise {script: "<raw state script>"} for the Python-side parser.
+STATE_LISTINGS_JS = """
+() => {
+  const pick = (s) => s?.resultList?.search?.fullSearch?.result?.listings;
+  const node = Array.from(document.scripts).find(
+    (s) => s.textContent && s.textContent.includes('__INITIAL_STATE__')
+  );
+  if (node) {
+    try {
+      const raw = node.textContent;
+      const listings = pick(JSON.parse(raw.slice(raw.indexOf('{'), raw.lastIndexOf('}') + 1)));
+      if (Array.isArray(listings)) return { listings };
+    } catch (e) { /* not plain JSON; try the live object */ }
+  }
+  const live = pick(window.__INITIAL_STATE__);
+  if (Array.isArray(live)) return { listings: live };
+  return { script: node ? node.textContent : '' };
+}
+"""
+
+
+def _plausible(listings) -> bool:
+    return isinstance(listings, list) and all(
+        isinstance(e, dict) and ("listing" in e or "id" in e) for e in listings[:5]
+    )
+
+
+def _pick(state) -> Optional[list]:
+    node = state
+    for key in _PATH:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node if isinstance(node, list) else None
+
+
+def _listings_shortcut(text: str, start: int) -> Optional[list]:
+    pos = start
+    for key in _PATH:
+        pos = text.find(f'"{key}"', pos)
+        if pos < 0:
+            return None
+        pos += len(key) + 2
+    m = _colon_re.match(text, pos)
+    if not m:
+        return None
+    try:
+        value, _end = _decoder.raw_decode(text, m.end())
+    except json.JSONDecodeError:
+        return None
+    return value if _plausible(value) else None
+
+
+def listings_from_state_text(text: str, start: int = 0) -> Optional[list]:
+    """
+    The raw listings array from text holding `window.__INITIAL_STATE__ = {...}`
+    (a script body or a whole HTML page), or None if there is no usable state.
+    """
+    marker = text.find(_MARKER, start)
+    if marker < 0:
+        return None
+    listings = _listings_shortcut(text, marker)
+    if listings is not None:
+        return listings
+
+    # fallback: decode the whole object (raw_decode stops at its closing brace)
+    brace = text.find("{", marker)
+    if brace < 0:
+        return None
+    try:
+        state, _end = _decoder.raw_decode(text, brace)
+    except json.JSONDecodeError:
+        return None
+    return _pick(state)
+
+
+def item_from_search_entry(entry: dict) -> Optional[dict]:
+    """
+    One resultList listing → {url, title, price, rooms, location}.
+    Mirrors extractListingFromState() in homegate-scraper.js, which reads the
+    same node shape from the PDP state.
+    """
+    node = entry.get("listing") or {}
+    listing_id = node.get("id") or entry.get("id")
+    if not listing_id:
+        return None
+
+    loc = node.get("localization") or {}
+    title = ((loc.get("de") or {}).get("text") or {}).get("title") \
+        or ((loc.get("en") or {}).get("text") or {}).get("title") or ""
+
+    prices = node.get("prices") or {}
+    gross = (prices.get("rent") or {}).get("gross")
+    price = f"{prices.get('currency') or 'CHF'} {gross}" if gross is not None else None
+
+    rooms = (node.get("characteristics") or {}).get("numberOfRooms")
+
+    address = node.get("address") or {}
+    location = ", ".join(p for p in (
+        address.get("street") or "",
+        address.get("postalCode") or "",
+        address.get("region") or address.get("locality") or "",
+    ) if p)
+
+    return {
+        "url": f"https://www.homegate.ch/mieten/{listing_id}",
+        "title": title or None,
+        "price": price,
+        "rooms": rooms,
+        "location": location or None,
+    }
+
+
+def search_items(listings: Optional[list]) -> List[dict]:
+    items = (item_from_search_entry(e) for e in (listings or []) if isinstance(e, dict))
+    return [it for it in items if it]
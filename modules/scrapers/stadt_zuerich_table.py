@@ -0,0 +1,175 @@
+"""
+Row extraction for the vermietungen.stadt-zuerich.ch result table.
+
+parse_rows(html) returns one dict per `div.table-container.main-table table
+tbody tr` with the raw cell texts (address, rooms, rent) and the apply link
+(href). Only the part of the page from the table container onwards is
+parsed, and every row is read in a single pass over its cells.
+
+Backends (STADT_ZUERICH_PARSER=auto|selectolax|lxml|soup): selectolax and
+lxml are C parsers; soup is BeautifulSoup restricted to the table container
+with a SoupStrainer and is the fallback when neither is installed. Cell
+texts match BeautifulSoup's get_text(strip=True): text nodes stripped and
+joined without a separator.
+"""
+from __future__ import annotations
+
+import os
+import re
+
+_BACKEND = os.getenv("STADT_ZUERICH_PARSER", "auto").lower()
+
+# td class -> field
+_CELL_FIELDS = {
+    "publicated_adress": "address",
+    "rooms": "rooms",
+    "rentalgross": "rent",
+}
+
+_CONTAINER_RE = re.compile(r"<div\b[^>]*\bclass\s*=\s*[\"']([^\"']*)[\"']", re.IGNORECASE)
+
+
+def _table_region(html: str) -> str:
+    """The page from the opening tag of div.table-container.main-table on ("" if absent)."""
+    for m in _CONTAINER_RE.finditer(html):
+        classes = m.group(1).split()
+        if "table-container" in classes and "main-table" in classes:
+            return html[m.start():]
+    return ""
+
+
+def _empty_row() -> dict:
+    return {"address": "", "rooms": "", "rent": "", "href": ""}
+
+
+# ---- selectolax
+def _selectolax_parser():
+    try:
+        from selectolax.lexbor import LexborHTMLParser
+        return LexborHTMLParser
+    except ImportError:
+        from selectolax.parser import HTMLParser  # selectolax < 0.3.13
+        return HTMLParser
+
+
+def _rows_selectolax(region: str) -> list[dict]:
+    tree = _selectolax_parser()(region)
+    rows = []
+    for tr in tree.css("div.table-container.main-table table tbody tr"):
+        row = _empty_row()
+        for td in tr.css("td"):
+            classes = (td.attributes.get("class") or "").split()
+            for cls in classes:
+                field = _CELL_FIELDS.get(cls)
+                if field and not row[field]:
+                    row[field] = td.text(deep=True, separator="", strip=True)
+            if "apply_button" in classes and not row["href"]:
+                for a in td.css("a"):
+                    if "apply_button" in (a.attributes.get("class") or "").split():
+                        row["href"] = a.attributes.get("href") or ""
+                        break
+        rows.append(row)
+    return rows
+
+
+# ---- lxml
+_XP_ROWS = (
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' table-container ')"
+    " and contains(concat(' ', normalize-space(@class), ' '), ' main-table ')]"
+    "//table//tbody//tr"
+)
+
+
+def _rows_lxml(region: str) -> list[dict]:
+    import lxml.html
+
+    root = lxml.html.document_fromstring(region)
+    rows = []
+    for tr in root.xpath(_XP_ROWS):
+        row = _empty_row()
+        for td in tr.iter("td"):
+            classes = (td.get("class") or "").split()
+            for cls in classes:
+                field = _CELL_FIELDS.get(cls)
+                if field and not row[field]:
+                    row[field] = "".join(t.strip() for t in td.itertext())
+            if "apply_button" in classes and not row["href"]:
+                for a in td.iter("a"):
+                    if "apply_button" in (a.get("class") or "").split():
+                        row["href"] = a.get("href") or ""
+                        break
+        rows.append(row)
+    return rows
+
+
+# ---- BeautifulSoup (+ SoupStrainer)
+def _rows_soup(region: str) -> list[dict]:
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    try:
+        import lxml  # noqa: F401
+        features = "lxml"
+    except ImportError:
+        features = "html.parser"
+
+    # a callable works on every bs4 version (older ones pass each class token, newer the whole value)
+    only_table = SoupStrainer("div", attrs={"class": lambda c: bool(c) and "main-table" in c.split()})
+    soup = BeautifulSoup(region, features, parse_only=only_table)
+    rows = []
+    for tr in soup.select("div.table-container.main-table table tbody tr"):
+        row = _empty_row()
+        for td in tr.find_all("td"):
+            classes = td.get("class") or []
+            for cls in classes:
+                field = _CELL_FIELDS.get(cls)
+                if field and not row[field]:
+                    row[field] = td.get_text(strip=True)
+            if "apply_button" in classes and not row["href"]:
+                a = td.find("a", class_="apply_button")
+                if a is not None:
+                    row["href"] = a.get("href") or ""
+        rows.append(row)
+    return rows
+
+
+_BACKENDS = {
+    "selectolax": _rows_selectolax,
+    "lxml": _rows_lxml,
+    "soup": _rows_soup,
+}
+
+
+def available_backends() -> list[str]:
+    out = []
+    for name, probe in (("selectolax", _selectolax_parser),
+                        ("lxml", lambda: __import__("lxml.html")),
+                        ("soup", lambda: __import__("bs4"))):
+        try:
+            probe()
+            out.append(name)
+        except ImportError:
+            continue
+    return out
+
+
+_auto: str | None = None
+
+
+def _resolve(backend: str | None) -> str:
+    global _auto
+    backend = (backend or _BACKEND).lower()
+    if backend != "auto":
+        return backend
+    if _auto is None:
+        available = available_backends()
+        if not available:
+            raise ImportError("no HTML parser available (install lxml, selectolax or beautifulsoup4)")
+        _auto = available[0]
+    return _auto
+
+
+def parse_rows(html: str, backend: str | None = None) -> list[dict]:
+    region = _table_region(html or "")
+    if not region:
+        return []
+    return _BACKENDS[_resolve(backend)](region)
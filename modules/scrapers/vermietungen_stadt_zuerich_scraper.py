@@ -1,13 +1,28 @@
 from __future__ import annotations
+import asyncio
+import os
 import re
+import time
 from urllib.parse import urljoin
 
-import requests
-from bs4 import BeautifulSoup
+import httpx
 
 from modules.base_scraper import BaseScraper
+from modules.scrapers.stadt_zuerich_table import parse_rows
 from models.real_estate_listing import RealEstateListing
 from utils.url_builder import build_stadt_zuerich_url
+from utils.crawl_cache import cached_fetch, get_cache, normalize_request
+from utils.async_loop import run_async, on_stop
+from utils.crawl_control import DomainCoolingDown, cooldown_remaining, polite_pause, report_blocked, report_success
+from utils import metrics
+
+# By default each profile (or merged group member) POSTs its own rooms filter,
+# concurrently over one shared client. STADT_ZUERICH_SUPERSET=true reuses the
+# unfiltered list instead (one cached GET per cycle); rows are filtered locally
+# either way.
+_SUPERSET = os.getenv("STADT_ZUERICH_SUPERSET", "false").lower() == "true"
+_CSRF_TTL = float(os.getenv("STADT_ZUERICH_CSRF_TTL_SEC", "3600"))
+_ORIGIN = "https://www.vermietungen.stadt-zuerich.ch"
 
 def _first_num(txt: str) -> str:
     if not txt:
@@ -15,99 +30,208 @@ def _first_num(txt: str) -> str:
     m = re.search(r"\d+(?:[.,]\d+)?", txt.replace("’", "'"))
     return m.group(0).replace(",", ".") if m else ""
 
+def _to_float(x):
+    try:
+        return float(x) if x is not None else None
+    except Exception:
+        return None
+
+def _rooms_value(params: dict) -> str:
+    """The form's rooms filter ("min,max") for one profile's params; "" = no filter."""
+    exact_rooms = _to_float(params.get("exact_rooms"))
+    min_rooms = _to_float(params.get("min_rooms"))
+    max_rooms = _to_float(params.get("max_rooms"))
+    if exact_rooms is not None:
+        min_rooms = max_rooms = exact_rooms
+    if min_rooms is not None and max_rooms is not None:
+        return f"{min_rooms},{max_rooms}"
+    if min_rooms is not None:
+        return f"{min_rooms},{min_rooms}"
+    if max_rooms is not None:
+        return f"{max_rooms},{max_rooms}"
+    return ""
+
+
+class _CityClient:
+    """
+    One httpx.AsyncClient for every Stadt Zürich profile (runs on the shared
+    loop of utils/async_loop.py). The csrftoken cookie from the list GET is
+    reused until it expires (at most STADT_ZUERICH_CSRF_TTL_SEC), so N room
+    filters cost one handshake plus N concurrent POSTs.
+    """
+
+    def __init__(self):
+        self._client: httpx.AsyncClient | None = None
+        self._csrf: str | None = None
+        self._csrf_expires = 0.0
+        self._csrf_lock: asyncio.Lock | None = None
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                                   "AppleWebKit/537.36 (KHTML, like Gecko) "
+                                   "Chrome/124.0 Safari/537.36"),
+                    "Accept": "text/html,application/xhtml+xml",
+                },
+                timeout=20,
+                follow_redirects=True,
+            )
+            self._csrf_lock = asyncio.Lock()
+            on_stop(self.aclose)
+        return self._client
+
+    def _remember_csrf(self) -> None:
+        now = time.time()
+        for cookie in self._client.cookies.jar:
+            if cookie.name == "csrftoken":
+                self._csrf = cookie.value
+                expires = cookie.expires or now + _CSRF_TTL
+                self._csrf_expires = min(expires, now + _CSRF_TTL)
+                return
+
+    async def get_list(self, url: str) -> str:
+        r = await self._http().get(url)
+        r.raise_for_status()
+        self._remember_csrf()
+        return r.text
+
+    async def _token(self, url: str) -> str | None:
+        self._http()
+        async with self._csrf_lock:
+            if self._csrf is None or time.time() >= self._csrf_expires:
+                await self.get_list(url)
+            return self._csrf
+
+    async def post(self, url: str, data: dict) -> str | None:
+        """
+        Filtered list HTML, or None if the POST didn't yield one. Raises
+        httpx.HTTPStatusError on 429, or on a 403 that a fresh token didn't fix.
+        """
+        for attempt in (1, 2):
+            csrf = await self._token(url)
+            headers = {"Referer": url, "Origin": _ORIGIN, "X-Requested-With": "XMLHttpRequest"}
+            if csrf:
+                headers["X-CSRFToken"] = csrf
+            r = await self._http().post(url, headers=headers, data=data)
+            if r.status_code == 403 and attempt == 1:
+                self._csrf = None  # token rotated server-side; fetch a fresh one once
+                continue
+            if r.status_code in (403, 429):
+                r.raise_for_status()
+            if r.is_success and "text/html" in r.headers.get("content-type", "") and r.text.strip():
+                return r.text
+            return None
+        return None
+
+    async def post_many(self, url: str, datas: list[dict]) -> list[str | None]:
+        await self._token(url)  # one handshake for all of them
+        return await asyncio.gather(*(self.post(url, d) for d in datas))
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._csrf = None
+
+
+_city = _CityClient()
+
+
 class VermietungenStadtZuerichScraper(BaseScraper):
-    def __init__(self, config: dict):
-        super().__init__(config)
-        self._s = requests.Session()
-        self._s.headers.update({
-            "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                           "AppleWebKit/537.36 (KHTML, like Gecko) "
-                           "Chrome/124.0 Safari/537.36"),
-            "Accept": "text/html,application/xhtml+xml",
-        })
+    domain = "stadt-zuerich.ch"
+
+    def __init__(self, config: dict, seen_filter=None):
+        super().__init__(config, seen_filter=seen_filter)
 
     def _list_url(self) -> str:
         # Keep signature parity with other builders; params are ignored for now
         return build_stadt_zuerich_url(self.config.get("params"))
 
-    def _post_with_filters(self, min_rooms: float | None, max_rooms: float | None) -> str:
-        list_url = self._list_url()
-
-        r0 = self._s.get(list_url, timeout=20)
-        r0.raise_for_status()
-        csrf = self._s.cookies.get("csrftoken")
-
-        headers = {
-            "Referer": list_url,
-            "Origin": "https://www.vermietungen.stadt-zuerich.ch",
-            "X-Requested-With": "XMLHttpRequest",
-        }
-        if csrf:
-            headers["X-CSRFToken"] = csrf
-
-        if min_rooms is not None and max_rooms is not None:
-            rooms_value = f"{min_rooms},{max_rooms}"
-        elif min_rooms is not None:
-            rooms_value = f"{min_rooms},{min_rooms}"
-        elif max_rooms is not None:
-            rooms_value = f"{max_rooms},{max_rooms}"
-        else:
-            rooms_value = ""
+    def _get_list(self) -> str:
+        url = self._list_url()
+        return cached_fetch(url, lambda: self._timed_http(url, lambda: _city.get_list(url)))
 
-        data = {"rooms": rooms_value, "search": ""}
+    def _timed_http(self, url: str, make_coro, requests: int = 1):
+        """
+        Pace `requests` calls through the shared limiter, run them on the async
+        loop and report the outcome: 403/429 lowers stadt-zuerich.ch's rate,
+        starts its cooldown and raises DomainCoolingDown, like the browser scrapers.
+        """
+        polite_pause(url, requests=requests)
+        try:
+            with metrics.timer("http", domain=self.domain):
+                result = run_async(make_coro())
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (403, 429):
+                print(f"⚠️  Stadt Zürich answered HTTP {e.response.status_code}, cooling {self.domain} down...")
+                report_blocked(url)
+                raise DomainCoolingDown(self.domain, cooldown_remaining(url))
+            raise
+        report_success(url)
+        return result
 
-        r1 = self._s.post(list_url, headers=headers, data=data, timeout=20)
-        if r1.ok and "text/html" in r1.headers.get("content-type", "") and r1.text.strip():
-            return r1.text
-        return r0.text
+    def _post_filters(self, rooms_values: list[str]) -> list[str]:
+        """
+        One HTML page per distinct rooms filter: cached ones from the crawl cache,
+        the rest POSTed concurrently. A failed POST falls back to the full list.
+        """
+        url = self._list_url()
+        cache = get_cache()
+        datas = [{"rooms": v, "search": ""} for v in rooms_values]
+        htmls = [cache.get(normalize_request(url, d)) if cache else None for d in datas]
+
+        missing = [i for i, html in enumerate(htmls) if html is None]
+        if missing:
+            todo = [datas[i] for i in missing]
+            posted = self._timed_http(url, lambda: _city.post_many(url, todo), requests=len(todo))
+            for i, html in zip(missing, posted):
+                if html and cache:
+                    cache.put(normalize_request(url, datas[i]), html)
+                htmls[i] = html or self._get_list()
+        return htmls
 
     def scrape(self) -> list[RealEstateListing]:
         params = self.config.get("params", {}) or {}
 
-        def _to_float(x):
-            try:
-                return float(x) if x is not None else None
-            except Exception:
-                return None
-
         exact_rooms = _to_float(params.get("exact_rooms"))
         min_rooms   = _to_float(params.get("min_rooms"))
         max_rooms   = _to_float(params.get("max_rooms"))
 
-        if exact_rooms is not None:
-            html = self._post_with_filters(exact_rooms, exact_rooms)
-        elif min_rooms is not None or max_rooms is not None:
-            html = self._post_with_filters(min_rooms, max_rooms)
+        # a merged fetch group lists its members' own params; POST each member's filter
+        rooms_values = list(dict.fromkeys(_rooms_value(p or {}) for p in self.config.get("members") or [params]))
+        if _SUPERSET or "" in rooms_values:
+            htmls = [self._get_list()]
         else:
-            r = self._s.get(self._list_url(), timeout=20)
-            r.raise_for_status()
-            html = r.text
+            htmls = self._post_filters(rooms_values)
 
-        soup = BeautifulSoup(html, "html.parser")
-        rows = soup.select("div.table-container.main-table table tbody tr")
+        rows = []
+        with metrics.timer("parse"):
+            for html in dict.fromkeys(htmls):
+                rows.extend(parse_rows(html))  # STADT_ZUERICH_PARSER picks the backend
 
         # If nothing matched, just return an empty list instead of crashing
         if not rows:
             return []
 
-        def text_of(tr, css: str) -> str:
-            el = tr.select_one(css)
-            return el.get_text(strip=True) if el else ""
-
-        def href_of(tr, css: str) -> str:
-            el = tr.select_one(css)
-            return (el.get("href") or "") if el else ""
-
         listings: list[RealEstateListing] = []
-        for tr in rows:
-            address    = text_of(tr, "td.publicated_adress")
-            rooms_txt  = text_of(tr, "td.rooms")
-            brutto_txt = text_of(tr, "td.rentalgross")
+        urls_so_far = set()
+        for row in rows:
+            address    = row["address"]
+            rooms_txt  = row["rooms"]
+            brutto_txt = row["rent"]
 
-            href = href_of(tr, "td.apply_button a.apply_button")
-            url  = urljoin("https://www.vermietungen.stadt-zuerich.ch", href) if href else self._list_url()
+            href = row["href"]
+            url  = urljoin(_ORIGIN, href) if href else self._list_url()
+            if href and url in urls_so_far:
+                continue  # same row in several filtered pages
+            urls_so_far.add(url)
 
-            price_str = _first_num(brutto_txt)
+            # the rent as shown ("CHF 2’450.–"); RealEstateListing parses the grouped amount
+            price = (brutto_txt or "").strip()
+            if price and "CHF" not in price:
+                price = f"CHF {price}"
             rooms_str = _first_num(rooms_txt)
 
             # numeric rooms for filtering
@@ -126,13 +250,13 @@ class VermietungenStadtZuerichScraper(BaseScraper):
             parts = []
             if address:   parts.append(address)
             if rooms_str: parts.append(f"{rooms_str} Zi.")
-            if price_str: parts.append(f"CHF {price_str}")
+            if price:     parts.append(price)
             title = ", ".join(parts) + " | vermietungen.stadt-zuerich.ch"
 
             listings.append(
                 RealEstateListing(
                     title=title,
-                    price=(f"CHF {price_str}" if price_str else ""),
+                    price=price,
                     location="Zürich",
                     url=url,
                     rooms=(rooms_str or ""),
@@ -0,0 +1,56 @@
+# tests/test_cross_site_duplicates.py
+"""
+split_duplicates(): the same flat on another site (or the same URL under
+another profile) is a duplicate; another URL on the same site is a
+different flat with the same address, rooms and rent.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.real_estate_listing import RealEstateListing  # noqa: E402
+from utils.dedupe_db import close_connection, init_db, split_duplicates  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_path = str(tmp_path / "dedupe.db")
+    init_db(db_path)
+    yield db_path
+    close_connection(db_path)
+
+
+def _flat(url: str) -> RealEstateListing:
+    return RealEstateListing(title="Hohlstrasse 12, 3.5 Zi.", price="CHF 2’450.–", location="Zürich",
+                             url=url, rooms="3.5")
+
+
+def test_same_site_other_url_is_a_different_flat(db):
+    first = _flat("https://www.vermietungen.stadt-zuerich.ch/publication/apartment/1")
+    second = _flat("https://www.vermietungen.stadt-zuerich.ch/publication/apartment/2")
+    assert split_duplicates("jid", "p", [first], db_path=db) == ([first], [])
+    assert split_duplicates("jid", "p", [second], db_path=db) == ([second], [])
+
+
+def test_same_site_other_url_in_one_batch_stays_fresh(db):
+    flats = [_flat("https://flatfox.ch/de/flat/1/"), _flat("https://flatfox.ch/de/flat/2/")]
+    assert split_duplicates("jid", "p", flats, db_path=db) == (flats, [])
+
+
+def test_other_site_is_a_duplicate(db):
+    homegate = _flat("https://www.homegate.ch/rent/4000000001")
+    flatfox = _flat("https://flatfox.ch/de/flat/9/")
+    split_duplicates("jid", "p", [homegate], db_path=db)
+    assert split_duplicates("jid", "q", [flatfox], db_path=db) == ([], [flatfox])
+
+
+def test_same_url_under_another_profile_is_a_duplicate(db):
+    flat = _flat("https://flatfox.ch/de/flat/1/")
+    split_duplicates("jid", "p", [flat], db_path=db)
+    assert split_duplicates("jid", "q", [flat], db_path=db) == ([], [flat])
+    assert split_duplicates("jid", "p", [flat], db_path=db) == ([flat], [])  # the owner itself
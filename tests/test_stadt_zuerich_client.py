@@ -0,0 +1,130 @@
+# tests/test_stadt_zuerich_client.py
+"""
+Stadt Zürich scraper against a local stub of the city's list page: one GET
+for the csrftoken, then each member's rooms filter POSTed concurrently; a
+429 is reported to the shared limiter.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.scrapers import vermietungen_stadt_zuerich_scraper as vsz  # noqa: E402
+from utils import crawl_cache  # noqa: E402
+from utils.async_loop import run_async  # noqa: E402
+from utils.crawl_control import DomainCoolingDown  # noqa: E402
+
+APARTMENTS = [("Hohlstrasse 1", "2.5", "1’450", "/apply/1"),
+              ("Limmatstrasse 2", "3.5", "1’950", "/apply/2"),
+              ("Seefeldstrasse 3", "4.5", "2’600", "/apply/3")]
+
+
+def _page(rows) -> str:
+    trs = "".join(
+        f'<tr><td class="publicated_adress">{addr}</td><td class="rooms">{rooms}</td>'
+        f'<td class="rentalgross">CHF {rent}</td>'
+        f'<td class="apply_button"><a class="apply_button" href="{href}">Bewerben</a></td></tr>'
+        for addr, rooms, rent, href in rows)
+    return f'<html><body><div class="table-container main-table"><table><tbody>{trs}</tbody></table></div></body></html>'
+
+
+class StubCity:
+    """GET sets csrftoken and returns every row; POST needs the token and returns rows matching `rooms`."""
+
+    def __init__(self, concurrent_posts: int):
+        self.requests = []  # (method, rooms filter or None)
+        self.post_status = 200
+        self.both_posts_in_flight = threading.Barrier(concurrent_posts, timeout=3)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _html(self, status, body, headers=()):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                for k, v in headers:
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                stub.requests.append(("GET", None))
+                self._html(200, _page(APARTMENTS), [("Set-Cookie", "csrftoken=tok1; Path=/")])
+
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                rooms = form["rooms"][0]
+                stub.requests.append(("POST", rooms))
+                if self.headers.get("X-CSRFToken") != "tok1":
+                    return self._html(403, "csrf")
+                if stub.post_status != 200:
+                    return self._html(stub.post_status, "slow down")
+                stub.both_posts_in_flight.wait()  # times out if the POSTs run one after another
+                lo, hi = (float(x) for x in rooms.split(","))
+                self._html(200, _page([a for a in APARTMENTS if lo <= float(a[1]) <= hi]))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/publication/apartment/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def city(monkeypatch):
+    stub = StubCity(concurrent_posts=2)
+    client = vsz._CityClient()
+    monkeypatch.setattr(vsz, "_city", client)
+    monkeypatch.setattr(vsz, "build_stadt_zuerich_url", lambda _params=None: stub.url)
+    monkeypatch.setattr(crawl_cache, "_ENABLED", False)
+    stub.limiter = []  # (call, url) instead of the SQLite limiter
+    monkeypatch.setattr(vsz, "polite_pause", lambda url, requests=1: stub.limiter.append(("pause", requests)))
+    monkeypatch.setattr(vsz, "report_blocked", lambda url: stub.limiter.append(("blocked", url)))
+    monkeypatch.setattr(vsz, "report_success", lambda url: stub.limiter.append(("success", url)))
+    monkeypatch.setattr(vsz, "cooldown_remaining", lambda url: 120.0)
+    yield stub
+    run_async(client.aclose())
+    stub.close()
+
+
+def test_member_filters_cost_one_handshake_and_concurrent_posts(city):
+    members = [{"exact_rooms": 2.5}, {"min_rooms": 3.5, "max_rooms": 4.5}]
+    scraper = vsz.VermietungenStadtZuerichScraper(
+        {"name": "g", "params": {"min_rooms": 2.5, "max_rooms": 4.5}, "members": members})
+
+    listings = scraper.scrape()
+
+    assert sorted(city.requests, key=str) == [("GET", None), ("POST", "2.5,2.5"), ("POST", "3.5,4.5")]
+    assert [l.url for l in listings] == ["https://www.vermietungen.stadt-zuerich.ch/apply/1",
+                                         "https://www.vermietungen.stadt-zuerich.ch/apply/2",
+                                         "https://www.vermietungen.stadt-zuerich.ch/apply/3"]
+    assert listings[1].rooms == 3.5
+    assert city.limiter == [("pause", 2), ("success", city.url)]
+    assert (listings[1].price_amount, listings[1].price_currency) == (1950.0, "CHF")
+
+
+def test_csrf_token_is_reused_across_profiles(city):
+    city.both_posts_in_flight = threading.Barrier(1)
+    for rooms in (2.5, 3.5):
+        vsz.VermietungenStadtZuerichScraper({"name": f"p{rooms}", "params": {"exact_rooms": rooms}}).scrape()
+    assert [m for m, _ in city.requests] == ["GET", "POST", "POST"]
+
+
+def test_429_is_reported_and_raises_cooling_down(city):
+    city.post_status = 429
+    with pytest.raises(DomainCoolingDown):
+        vsz.VermietungenStadtZuerichScraper({"name": "p", "params": {"exact_rooms": 2.5}}).scrape()
+    assert city.limiter == [("pause", 1), ("blocked", city.url)]
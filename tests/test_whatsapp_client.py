@@ -0,0 +1,194 @@
+# tests/test_whatsapp_client.py
+"""
+WhatsAppClient and the outbox dispatcher against a local stub of
+whatsapp-service: 202 batch hand-off with delivery confirmed via
+GET /messages/:id, 429 backpressure, and the 404 fallback to /send-message.
+
+    python -m pytest -q tests
+"""
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.dedupe_db import close_connection, enqueue_notifications, init_db, outbox_counts  # noqa: E402
+from utils.notify_dispatcher import NotificationDispatcher  # noqa: E402
+from utils.whatsapp import BatchUnsupported, WhatsAppBackpressure, WhatsAppClient  # noqa: E402
+
+
+class StubService:
+    """Scripted whatsapp-service: routes map 'METHOD /path' to (status, headers, body)."""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []  # (method, path, json body)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                stub.requests.append((method, self.path, body))
+                status, headers, payload = stub.routes.get(f"{method} {self.path}", (404, {}, {"error": "no route"}))
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._answer("GET")
+
+            def do_POST(self):
+                self._answer("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def client(self) -> WhatsAppClient:
+        return WhatsAppClient(send_url=f"{self.base}/send-message", batch_url=f"{self.base}/send-batch",
+                              status_url=f"{self.base}/messages", read_timeout=5)
+
+    def calls(self, method, path):
+        return [body for m, p, body in self.requests if m == method and p == path]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def service():
+    stub = StubService()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    db_path = str(tmp_path / "outbox.db")
+    init_db(db_path)
+    yield db_path
+    close_connection(db_path)
+
+
+def _dispatcher(client, db_path, batch=True):
+    d = NotificationDispatcher(client.send, send_batch=client.send_batch if batch else None,
+                               message_status=client.message_status, db_path=db_path,
+                               min_interval=0, backoff_base=0, backoff_max=0)
+    d.status_poll = 0  # check statuses on the next pass
+    return d
+
+
+def test_send_batch_202_returns_ids_per_entry(service):
+    service.routes["POST /send-batch"] = (202, {}, {"accepted": 1, "ids": ["m1", None], "rejected": [{"index": 1}]})
+    ids = service.client().send_batch([("41790000000@s.whatsapp.net", "hi"), ("bad", "x")])
+    assert ids == ["m1", None]
+    assert service.calls("POST", "/send-batch")[0]["messages"][0] == {"jid": "41790000000@s.whatsapp.net",
+                                                                      "message": "hi"}
+
+
+def test_send_batch_429_raises_backpressure(service):
+    service.routes["POST /send-batch"] = (429, {"Retry-After": "7"}, {"error": "Send queue full"})
+    with pytest.raises(WhatsAppBackpressure) as e:
+        service.client().send_batch([("a@g.us", "hi")])
+    assert e.value.retry_after == 7
+
+
+def test_send_batch_404_raises_batch_unsupported(service):
+    with pytest.raises(BatchUnsupported):
+        service.client().send_batch([("a@g.us", "hi")])
+
+
+def test_message_status_unknown_id_is_none(service):
+    service.routes["GET /messages/m1"] = (200, {}, {"id": "m1", "status": "queued"})
+    client = service.client()
+    assert client.message_status("m1")["status"] == "queued"
+    assert client.message_status("gone") is None
+
+
+def test_batch_rows_stay_pending_until_delivery_is_confirmed(service, outbox):
+    service.routes["POST /send-batch"] = (202, {}, {"accepted": 1, "ids": ["m1"], "rejected": []})
+    service.routes["GET /messages/m1"] = (200, {}, {"id": "m1", "status": "queued"})
+    enqueue_notifications("p", "a@g.us", [("https://x/1", "hello")], db_path=outbox)
+    d = _dispatcher(service.client(), outbox)
+
+    d._drain_once()  # handed off (202)
+    d._drain_once()  # still queued at the service
+    assert outbox_counts(outbox) == {"pending": 1}
+    assert len(service.calls("POST", "/send-batch")) == 1  # never re-sent while the service holds it
+
+    service.routes["GET /messages/m1"] = (200, {}, {"id": "m1", "status": "sent"})
+    d._drain_once()
+    assert outbox_counts(outbox) == {"sent": 1}
+    assert d.sent == 1
+
+
+def test_message_lost_by_service_is_sent_again(service, outbox):
+    service.routes["POST /send-batch"] = (202, {}, {"accepted": 1, "ids": ["m1"], "rejected": []})
+    enqueue_notifications("p", "a@g.us", [("https://x/1", "hello")], db_path=outbox)
+    d = _dispatcher(service.client(), outbox)
+
+    d._drain_once()  # handed off
+    d._drain_once()  # GET /messages/m1 → 404 (service restarted): released and sent again
+    assert len(service.calls("POST", "/send-batch")) == 2
+    assert outbox_counts(outbox) == {"pending": 1}
+
+
+def test_batch_429_releases_rows_without_an_attempt(service, outbox):
+    service.routes["POST /send-batch"] = (429, {"Retry-After": "30"}, {"error": "Send queue full"})
+    enqueue_notifications("p", "a@g.us", [("https://x/1", "hello")], db_path=outbox)
+    d = _dispatcher(service.client(), outbox)
+
+    d._drain_once()
+    d._drain_once()  # not due again for 30s
+    assert len(service.calls("POST", "/send-batch")) == 1
+    assert outbox_counts(outbox) == {"pending": 1}
+    assert d.failed == 0
+
+
+def test_batch_404_falls_back_to_send_message(service, outbox):
+    service.routes["POST /send-message"] = (200, {}, {"success": True})
+    enqueue_notifications("p", "a@g.us", [("https://x/1", "hello")], db_path=outbox)
+    d = _dispatcher(service.client(), outbox)
+
+    d._drain_once()  # /send-batch → 404: batch mode off, rows released
+    d._drain_once()
+    assert service.calls("POST", "/send-message") == [{"jid": "a@g.us", "message": "hello"}]
+    assert outbox_counts(outbox) == {"sent": 1}
+
+
+def test_send_503_while_disconnected_releases_rows_without_an_attempt(service, outbox):
+    service.routes["POST /send-message"] = (503, {"Retry-After": "30"}, {"error": "WhatsApp not connected"})
+    enqueue_notifications("p", "a@g.us", [("https://x/1", "hello")], db_path=outbox)
+    d = _dispatcher(service.client(), outbox, batch=False)
+
+    d._drain_once()
+    d._drain_once()  # not due again for 30s
+    assert len(service.calls("POST", "/send-message")) == 1
+    assert outbox_counts(outbox) == {"pending": 1}
+    assert d.failed == 0
+
+
+def test_batch_503_while_disconnected_releases_rows_without_an_attempt(service, outbox):
+    service.routes["POST /send-batch"] = (503, {"Retry-After": "30"}, {"error": "socket not ready"})
+    enqueue_notifications("p", "a@g.us", [("https://x/1", "hello")], db_path=outbox)
+    d = _dispatcher(service.client(), outbox)
+
+    for _ in range(4):  # more passes than the give-up limit would allow as failures
+        d._drain_once()
+    assert len(service.calls("POST", "/send-batch")) == 1  # not due again for 30s
+    assert outbox_counts(outbox) == {"pending": 1}
+    assert d.failed == 0
@@ -0,0 +1,61 @@
+# utils/async_loop.py
+"""
+One asyncio event loop on a background thread, shared by the sync scrapers.
+
+Async HTTP clients (httpx.AsyncClient) are bound to the loop they were
+created on. Running them all on this loop lets every scheduler thread share
+one client, with its connections and cookies: a thread submits a coroutine
+with run_async() and blocks on the result while other threads' requests run
+concurrently on the same loop.
+"""
+import asyncio
+import threading
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_on_stop: List[Callable[[], Awaitable[None]]] = []
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="async-loop", daemon=True)
+            _thread.start()
+        return _loop
+
+
+def run_async(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run `coro` on the shared loop and wait for its result (never call from the loop itself)."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def on_stop(cleanup: Callable[[], Awaitable[None]]) -> None:
+    """Register an async cleanup (e.g. client.aclose) to run in stop_loop()."""
+    with _lock:
+        _on_stop.append(cleanup)
+
+
+def stop_loop(timeout: float = 10.0) -> None:
+    global _loop, _thread
+    with _lock:
+        loop, thread = _loop, _thread
+        cleanups = list(_on_stop)
+        _on_stop.clear()
+        _loop = _thread = None
+    if loop is None:
+        return
+    for cleanup in cleanups:
+        try:
+            asyncio.run_coroutine_threadsafe(cleanup(), loop).result(timeout)
+        except Exception as e:
+            print(f"⚠️  async cleanup failed: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    if thread is not None:
+        thread.join(timeout)
+    loop.close()
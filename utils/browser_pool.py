@@ -0,0 +1,186 @@
+# utils/browser_pool.py
+"""
+Warm Playwright browsers shared by the scrapers.
+
+Playwright's sync API is bound to the thread that started it, so every worker
+thread owns one pool: a single Chromium plus named, reusable contexts
+(e.g. "homegate", "flatfox"). Scrapers borrow a page from a context instead of
+launching a browser per scrape(). A context is recycled after
+BROWSER_POOL_MAX_NAVIGATIONS main-frame navigations or once a page released
+from it reported a JS heap above BROWSER_POOL_MAX_HEAP_MB.
+Call close_thread_pool() from the owning thread when a run ends.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from utils import metrics
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_MAX_NAVIGATIONS = _env_int("BROWSER_POOL_MAX_NAVIGATIONS", 50)
+_MAX_HEAP_MB = _env_float("BROWSER_POOL_MAX_HEAP_MB", 512.0)
+
+_HEAP_JS = "() => (performance.memory && performance.memory.usedJSHeapSize) || 0"
+
+
+class _WarmContext:
+    def __init__(self, context):
+        self.context = context
+        self.navigations = 0
+        self.heap_mb = 0.0
+        self.fresh = True  # no page has been handed out yet (cookie banners etc.)
+
+    def worn_out(self) -> bool:
+        if _MAX_NAVIGATIONS > 0 and self.navigations >= _MAX_NAVIGATIONS:
+            return True
+        if _MAX_HEAP_MB > 0 and self.heap_mb >= _MAX_HEAP_MB:
+            return True
+        return False
+
+
+class PageLease:
+    """What borrow_page() yields: the page plus whether its context is brand new."""
+
+    def __init__(self, page, fresh: bool):
+        self.page = page
+        self.fresh = fresh
+
+
+class BrowserPool:
+    def __init__(self):
+        self._pw = None
+        self._browser = None
+        self._contexts: Dict[str, _WarmContext] = {}
+        self.launches = 0
+
+    def _ensure_browser(self):
+        if self._browser is not None and self._browser.is_connected():
+            return self._browser
+
+        from playwright.sync_api import sync_playwright
+
+        headless = os.environ.get("HEADLESS", "true").lower() == "true"
+        channel = os.getenv("PW_CHANNEL")  # optional (e.g., "msedge" or "chrome")
+
+        if self._pw is None:
+            self._pw = sync_playwright().start()
+        launch_opts = {"headless": headless}
+        if channel:
+            launch_opts["channel"] = channel
+
+        self._contexts.clear()  # contexts die with their browser
+        with metrics.timer("browser_launch"):
+            self._browser = self._pw.chromium.launch(**launch_opts)
+        self.launches += 1
+        print(f"🌐 Browser launched (thread={threading.current_thread().name}, launches={self.launches})")
+        return self._browser
+
+    def _close_context(self, key: str) -> None:
+        warm = self._contexts.pop(key, None)
+        if warm is None:
+            return
+        try:
+            warm.context.close()
+        except Exception:
+            pass
+
+    def _context(self, key: str, context_options: Optional[dict], init_script: Optional[str]) -> _WarmContext:
+        browser = self._ensure_browser()
+        warm = self._contexts.get(key)
+        if warm is not None and warm.worn_out():
+            print(f"♻️  Recycling browser context '{key}' "
+                  f"(navigations={warm.navigations}, heap={warm.heap_mb:.0f}MB)")
+            self._close_context(key)
+            warm = None
+        if warm is None:
+            with metrics.timer("browser_context", context=key):
+                context = browser.new_context(**(context_options or {}))
+                if init_script:
+                    context.add_init_script(init_script)
+            warm = _WarmContext(context)
+            self._contexts[key] = warm
+        return warm
+
+    @contextmanager
+    def borrow_page(self, key: str, context_options: Optional[dict] = None,
+                    init_script: Optional[str] = None):
+        """
+        Yields a PageLease on the warm context `key`. The options and init script
+        are only applied when the context is (re)created.
+        """
+        warm = self._context(key, context_options, init_script)
+        fresh, warm.fresh = warm.fresh, False
+        page = warm.context.new_page()
+
+        def _on_nav(frame):
+            if frame == page.main_frame:
+                warm.navigations += 1
+
+        page.on("framenavigated", _on_nav)
+        try:
+            yield PageLease(page, fresh)
+        finally:
+            try:
+                warm.heap_mb = (page.evaluate(_HEAP_JS) or 0) / (1024 * 1024)
+            except Exception:
+                pass
+            try:
+                page.close()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        for key in list(self._contexts):
+            self._close_context(key)
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._pw is not None:
+            try:
+                self._pw.stop()
+            except Exception:
+                pass
+            self._pw = None
+
+
+_local = threading.local()
+
+
+def get_pool() -> BrowserPool:
+    """The calling thread's pool (created lazily; no browser until first borrow)."""
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = BrowserPool()
+        _local.pool = pool
+    return pool
+
+
+def borrow_page(key: str, context_options: Optional[dict] = None, init_script: Optional[str] = None):
+    return get_pool().borrow_page(key, context_options=context_options, init_script=init_script)
+
+
+def close_thread_pool() -> None:
+    """Shut down the calling thread's browser. Must run on the thread that used it."""
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        return
+    pool.close()
+    _local.pool = None
@@ -0,0 +1,238 @@
+# utils/crawl_cache.py
+"""
+Crawl cache shared by all profiles and scrapers.
+
+Responses are keyed by the normalized request (URL with sorted query, no
+fragment, plus the POST body if any) and kept in SQLite. Profiles whose
+queries resolve to the same request in one cycle therefore share a single
+fetch; within the process, concurrent callers of the same key wait for the
+one fetch already in flight (single-flight) instead of starting their own.
+
+Result pages must never outlive the crawl cycle that fetched them: a later
+run or poll would miss new listings and the poll planner would see stale
+arrival rates. By default an entry is scoped to the current cycle id and
+additionally capped at CRAWL_CACHE_TTL_SEC. A one-shot run calls
+start_cycle() once; the daemon runs each poll inside `with in_cycle(id):`,
+with one id per batch of polls that fell due together, so a new batch never
+changes the cycle under polls still running on other threads. Only `durable`
+entries (detail pages, whose data barely changes) are shared across cycles
+for their own TTL.
+
+Payloads must be JSON-serializable (HTML strings, parsed item lists, ...).
+The cache lives in its own database file so long scrapes never contend with
+the dedupe transactions for the write lock.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils.dedupe_db import get_repository
+
+CACHE_DB_PATH = os.environ.get("CRAWL_CACHE_PATH", "data/crawl_cache.db")
+_ENABLED = os.environ.get("CRAWL_CACHE", "true").lower() == "true"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_TTL = _env_float("CRAWL_CACHE_TTL_SEC", 600.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_cache (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,  -- JSON
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def normalize_request(url: str, body: Union[None, str, dict] = None) -> str:
+    """Cache key: scheme/host lower-cased, default port and fragment dropped, query and form body sorted."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    key = urlunsplit((scheme, host, parts.path or "/", query, ""))
+    if body:
+        if isinstance(body, dict):
+            body = urlencode(sorted((str(k), str(v)) for k, v in body.items()))
+        key += " " + body
+    return key
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.error: Optional[BaseException] = None
+
+
+class CrawlCache:
+    def __init__(self, db_path: str = CACHE_DB_PATH, ttl: float = _TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._repo = get_repository(db_path)
+        self._repo.connection().executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # waited for another caller's in-flight fetch
+        self._local = threading.local()  # per-thread cycle set by in_cycle()
+        self.start_cycle()
+
+    def start_cycle(self, cycle_id: Optional[str] = None) -> str:
+        """Begin a new crawl cycle; cycle-scoped entries of earlier cycles are no longer seen."""
+        self.cycle = cycle_id or new_cycle_id()
+        return self.cycle
+
+    @contextmanager
+    def in_cycle(self, cycle_id: str):
+        """Scope the calling thread's lookups to `cycle_id` (overrides start_cycle()'s)."""
+        previous = getattr(self._local, "cycle", None)
+        self._local.cycle = cycle_id
+        try:
+            yield
+        finally:
+            self._local.cycle = previous
+
+    def _scoped(self, key: str, durable: bool) -> str:
+        if durable:
+            return key
+        return f"{getattr(self._local, 'cycle', None) or self.cycle}|{key}"
+
+    def get(self, key: str, durable: bool = False) -> Optional[Any]:
+        row = self._repo.connection().execute(
+            "SELECT payload FROM crawl_cache WHERE key = ? AND expires_at > ?",
+            (self._scoped(key, durable), time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, payload: Any, ttl: Optional[float] = None, durable: bool = False) -> None:
+        key = self._scoped(key, durable)
+        now = time.time()
+        with self._repo.transaction() as con:
+            con.execute("""
+                INSERT INTO crawl_cache (key, payload, fetched_at, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    payload=excluded.payload, fetched_at=excluded.fetched_at, expires_at=excluded.expires_at
+            """, (key, json.dumps(payload), now, now + (self.ttl if ttl is None else ttl)))
+
+    def fetch(self, url: str, loader: Callable[[], Any], body: Union[None, str, dict] = None,
+              ttl: Optional[float] = None, cache_if: Callable[[Any], bool] = bool,
+              durable: bool = False) -> Any:
+        """
+        Cached loader() result for this request. Results failing `cache_if`
+        (by default: empty ones, i.e. failed loads) are returned but not stored.
+        """
+        request = normalize_request(url, body)
+        key = self._scoped(request, durable)
+        payload = self.get(request, durable)
+        if payload is not None:
+            with self._lock:
+                self.hits += 1
+            return payload
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.payload
+
+        try:
+            flight.payload = loader()
+            if cache_if(flight.payload):
+                self.put(request, flight.payload, ttl, durable)
+            return flight.payload
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def purge_expired(self) -> int:
+        with self._repo.transaction() as con:
+            return con.execute("DELETE FROM crawl_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self, reset: bool = False) -> Dict[str, int]:
+        with self._lock:
+            out = {"crawl_cache_hits": self.hits, "crawl_cache_misses": self.misses,
+                   "crawl_cache_shared": self.shared}
+            if reset:
+                self.hits = self.misses = self.shared = 0
+        return out
+
+
+_cache: Optional[CrawlCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[CrawlCache]:
+    """Process-wide cache, or None when disabled (CRAWL_CACHE=false)."""
+    global _cache
+    if not _ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CrawlCache()
+        return _cache
+
+
+def cached_fetch(url: str, loader: Callable[[], Any], body: Union[None, str, dict] = None,
+                 ttl: Optional[float] = None, cache_if: Callable[[Any], bool] = bool,
+                 durable: bool = False) -> Any:
+    cache = get_cache()
+    if cache is None:
+        return loader()
+    return cache.fetch(url, loader, body=body, ttl=ttl, cache_if=cache_if, durable=durable)
+
+
+def new_cycle_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def start_cycle() -> None:
+    """Call at the start of a one-shot run's crawl cycle."""
+    cache = get_cache()
+    if cache is not None:
+        cache.start_cycle()
+
+
+@contextmanager
+def in_cycle(cycle_id: str):
+    """Run the block's cache lookups in `cycle_id` (no-op while the cache is disabled)."""
+    cache = get_cache()
+    if cache is None:
+        yield
+        return
+    with cache.in_cycle(cycle_id):
+        yield
+
+
+def close_cache_connection() -> None:
+    """Close the calling thread's cache connection (worker exit)."""
+    if _cache is not None:
+        _cache._repo.close()
@@ -1,40 +1,278 @@
 # utils/crawl_control.py
-import os, time, random, threading
-from contextlib import contextmanager
+"""
+Request pacing shared by every thread and process on the host.
+
+Each domain has a token bucket whose state (tokens, last update) lives in a
+small SQLite file (CRAWL_RATE_DB_PATH), so scraper threads, daemon and
+one-shot runs, and the Node PDP worker (which asks the Python side for its
+tokens over the worker protocol) all draw from the same budget.
+
+acquire() reserves its tokens in one short write transaction, letting the
+balance go negative, and then sleeps until that debt is repaid; concurrent
+callers are therefore served in reservation order without polling. Each
+request costs a random 0.5–1.5 tokens so the spacing is not metronomic.
+
+Rates are requests per second: CRAWL_RATE="homegate.ch=0.33,flatfox.ch=1";
+other domains get CRAWL_RATE_DEFAULT, which defaults to the mean of the old
+per-request pause (CRAWL_MIN_DELAY_SEC + CRAWL_JITTER_SEC / 2). 0 means
+unlimited. CRAWL_RATE_BURST is the bucket size in requests.
+
+Block handling is AIMD plus a circuit breaker, also persisted per domain:
+report_blocked() multiplies the domain's rate by CRAWL_AIMD_DECREASE and
+opens the breaker for a cooldown that doubles with every consecutive block
+(CRAWL_COOLDOWN_BASE_SEC .. CRAWL_COOLDOWN_MAX_SEC); after
+CRAWL_AIMD_SUCCESS_RUN successes in a row report_success() gives back
+CRAWL_AIMD_INCREASE of the configured rate. While a domain cools down,
+acquire() raises DomainCoolingDown instead of sleeping, so callers drop the
+fetch and the scheduler moves on to other sites.
+"""
+import os, time, random, sqlite3, threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from utils import metrics
 
 _MIN = float(os.getenv("CRAWL_MIN_DELAY_SEC", "2.0"))
 _JIT = float(os.getenv("CRAWL_JITTER_SEC", "2.0"))
 _MAX_DETAIL = int(os.getenv("CRAWL_MAX_DETAIL_PER_RUN", "25"))
 
-_BACKOFF_MIN = float(os.getenv("CRAWL_BACKOFF_MIN", "10"))
-_BACKOFF_MAX = float(os.getenv("CRAWL_BACKOFF_MAX", "300"))
+_AIMD_DECREASE = float(os.getenv("CRAWL_AIMD_DECREASE", "0.5"))
+_AIMD_INCREASE = float(os.getenv("CRAWL_AIMD_INCREASE", "0.1"))
+_AIMD_SUCCESS_RUN = max(1, int(os.getenv("CRAWL_AIMD_SUCCESS_RUN", "20")))
+_AIMD_MIN_FACTOR = float(os.getenv("CRAWL_AIMD_MIN_FACTOR", "0.05"))
+_COOLDOWN_BASE = float(os.getenv("CRAWL_COOLDOWN_BASE_SEC", "120"))
+_COOLDOWN_MAX = float(os.getenv("CRAWL_COOLDOWN_MAX_SEC", "3600"))
+
+_DB_PATH = os.getenv("CRAWL_RATE_DB_PATH", "data/crawl_rate.db")
+_BURST = max(1.0, float(os.getenv("CRAWL_RATE_BURST", "1")))
+_DEFAULT_RATE = float(os.getenv("CRAWL_RATE_DEFAULT", str(1.0 / max(0.05, _MIN + _JIT / 2))))
+
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    """"homegate.ch=0.33,flatfox.ch=1" -> {"homegate.ch": 0.33, "flatfox.ch": 1.0}"""
+    rates = {}
+    for part in spec.split(","):
+        domain, sep, value = part.partition("=")
+        if not sep:
+            continue
+        try:
+            rates[domain.strip().lower()] = float(value)
+        except ValueError:
+            continue
+    return rates
+
+
+_RATES = _parse_rates(os.getenv("CRAWL_RATE", ""))
+
+
+def domain_of(url_or_domain: Optional[str]) -> str:
+    """'https://www.homegate.ch/mieten/1' -> 'homegate.ch'; '*' when unknown."""
+    if not url_or_domain:
+        return "*"
+    host = urlsplit(url_or_domain).hostname if "//" in url_or_domain else url_or_domain
+    host = (host or "").lower().strip(".")
+    if not host:
+        return "*"
+    labels = host.split(".")
+    return ".".join(labels[-2:]) if len(labels) > 2 else host
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    domain TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,      -- may be negative: tokens reserved by waiting callers
+    updated_at REAL NOT NULL   -- unix time of the last reservation
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS domain_health (
+    domain TEXT PRIMARY KEY,
+    factor REAL NOT NULL,          -- share of the configured rate currently allowed (AIMD)
+    successes INTEGER NOT NULL,    -- in a row, since the last block or increase
+    blocks INTEGER NOT NULL,       -- in a row; sets the cooldown length
+    cooldown_until REAL NOT NULL,  -- unix time; breaker open until then
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class DomainCoolingDown(RuntimeError):
+    """The domain's circuit breaker is open; skip it instead of waiting."""
+
+    def __init__(self, domain: str, remaining: float):
+        super().__init__(f"{domain} is cooling down for another {remaining:.0f}s")
+        self.domain = domain
+        self.remaining = remaining
+
+
+class SharedRateLimiter:
+    """Per-domain token buckets persisted in SQLite (one connection per thread)."""
+
+    def __init__(self, db_path: str = _DB_PATH, rates: Optional[Dict[str, float]] = None,
+                 default_rate: float = _DEFAULT_RATE, burst: float = _BURST):
+        self.db_path = db_path
+        self.rates = dict(_RATES if rates is None else rates)
+        self.default_rate = default_rate
+        self.capacity = burst + 0.5  # room for the largest single cost
+        self._local = threading.local()
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.executescript(_SCHEMA)
+            self._local.con = con
+        return con
 
-_lock = threading.Lock()
-_last_ts = 0.0
+    def rate_for(self, domain: str) -> float:
+        return self.rates.get(domain, self.default_rate)
 
-def _sleep_gap():
-    global _last_ts
-    with _lock:
-        now = time.time()
-        gap = (_MIN + random.random() * _JIT)
-        wait = max(0.0, (_last_ts + gap) - now)
+    @staticmethod
+    def _health(con: sqlite3.Connection, domain: str):
+        """(factor, successes, blocks, cooldown_until) for a domain."""
+        row = con.execute(
+            "SELECT factor, successes, blocks, cooldown_until FROM domain_health WHERE domain = ?", (domain,)
+        ).fetchone()
+        return row or (1.0, 0, 0, 0.0)
+
+    def cooldown_remaining(self, url_or_domain: Optional[str]) -> float:
+        """Seconds until the domain's breaker closes again (0 if it is closed)."""
+        cooldown_until = self._health(self._con(), domain_of(url_or_domain))[3]
+        return max(0.0, cooldown_until - time.time())
+
+    def report(self, url_or_domain: Optional[str], blocked: bool) -> None:
+        """Feed one request outcome into the domain's AIMD state."""
+        domain = domain_of(url_or_domain)
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            factor, successes, blocks, cooldown_until = self._health(con, domain)
+            if blocked:
+                factor = max(_AIMD_MIN_FACTOR, factor * _AIMD_DECREASE)
+                blocks, successes = blocks + 1, 0
+                cooldown = min(_COOLDOWN_MAX, _COOLDOWN_BASE * 2 ** (blocks - 1)) * random.uniform(0.8, 1.2)
+                # concurrent reports of the same block don't stack up
+                cooldown_until = max(cooldown_until, now + cooldown)
+                print(f"🧊 {domain} blocked ({blocks} in a row): rate ×{factor:.2f}, "
+                      f"cooling down {cooldown:.0f}s")
+                metrics.count("blocks", domain=domain)
+            else:
+                blocks, successes = 0, successes + 1
+                if successes >= _AIMD_SUCCESS_RUN and factor < 1.0:
+                    factor = min(1.0, factor + _AIMD_INCREASE)
+                    successes = 0
+                    print(f"🌡️  {domain}: {_AIMD_SUCCESS_RUN} requests without a block, rate ×{factor:.2f}")
+            con.execute(
+                "INSERT INTO domain_health (domain, factor, successes, blocks, cooldown_until, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(domain) DO UPDATE SET factor = excluded.factor, "
+                "successes = excluded.successes, blocks = excluded.blocks, "
+                "cooldown_until = excluded.cooldown_until, updated_at = excluded.updated_at",
+                (domain, factor, successes, blocks, cooldown_until, now),
+            )
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def reserve(self, url_or_domain: Optional[str], requests: float = 1.0) -> float:
+        """
+        Take the tokens for `requests` requests now; returns how long the caller
+        must wait. Raises DomainCoolingDown while the domain's breaker is open.
+        """
+        domain = domain_of(url_or_domain)
+        rate = self.rate_for(domain)
+        cost = sum(random.uniform(0.5, 1.5) for _ in range(max(1, int(requests))))
+
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            factor, _successes, _blocks, cooldown_until = self._health(con, domain)
+            if cooldown_until > now:
+                raise DomainCoolingDown(domain, cooldown_until - now)
+            if rate <= 0:
+                con.execute("COMMIT")
+                return 0.0
+            rate *= factor
+            row = con.execute("SELECT tokens, updated_at FROM rate_buckets WHERE domain = ?", (domain,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * rate)
+            tokens -= cost
+            con.execute(
+                "INSERT INTO rate_buckets (domain, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(domain) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (domain, tokens, now),
+            )
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        return -tokens / rate if tokens < 0 else 0.0
+
+    def acquire(self, url_or_domain: Optional[str], requests: float = 1.0) -> float:
+        """Block until `requests` requests to the URL's domain are allowed; returns the seconds waited."""
+        domain = domain_of(url_or_domain)
+        try:
+            wait = self.reserve(domain, requests)
+        except DomainCoolingDown:
+            metrics.count("requests_denied_cooling", requests, domain=domain)
+            raise
+        metrics.count("requests_paced", requests, domain=domain)
         if wait > 0:
-            time.sleep(wait)
-        _last_ts = time.time()
+            with metrics.timer("polite_wait", domain=domain):
+                time.sleep(wait)
+        return wait
+
+    def close(self) -> None:
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+
+_limiter: Optional[SharedRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> SharedRateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = SharedRateLimiter()
+        return _limiter
+
+
+def polite_pause(url: Optional[str] = None, requests: int = 1):
+    """
+    Call before each networked page.goto()/requests.get(); paces per domain
+    across processes. Raises DomainCoolingDown while the domain cools down.
+    """
+    return get_limiter().acquire(url, requests)
+
+
+def report_blocked(url: Optional[str]) -> None:
+    """A block/challenge page: lower the domain's rate and start its cooldown."""
+    get_limiter().report(url, blocked=True)
+
+
+def report_success(url: Optional[str]) -> None:
+    get_limiter().report(url, blocked=False)
+
+
+def cooldown_remaining(url_or_domain: Optional[str]) -> float:
+    return get_limiter().cooldown_remaining(url_or_domain)
+
+
+def close_limiter_connection() -> None:
+    """Close the calling thread's limiter connection (worker-exit hook)."""
+    if _limiter is not None:
+        _limiter.close()
 
-def polite_pause():
-    """Call before each networked page.goto()/requests.get()."""
-    _sleep_gap()
 
 def capped_range(n: int):
     """Use in detail loops to cap per-run pages."""
     return range(min(n, _MAX_DETAIL))
-
-@contextmanager
-def backoff_on_fail():
-    """Wrap a risky block; on exception sleep a random backoff."""
-    try:
-        yield
-    except Exception:
-        time.sleep(random.uniform(_BACKOFF_MIN, _BACKOFF_MAX))
-        raise
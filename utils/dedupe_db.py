@@ -1,12 +1,17 @@
 # utils/dedupe_db.py
+import hashlib
 import os
-import re
 import sqlite3
-from typing import Iterable, List, Tuple, Optional
+import threading
+from typing import Dict, Iterable, List, Tuple, Optional, Set
 from contextlib import contextmanager
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
 
 from models.real_estate_listing import RealEstateListing
+from utils.seen_index import SeenIndex
+from utils.url_canon import canonical_url
+from utils.fingerprint import listing_fingerprint
 
 DEFAULT_DB_PATH = os.environ.get("DEDUP_DB_PATH", "data/realestate.db")
 print(f"[DB] using SQLite at: {DEFAULT_DB_PATH}")
@@ -15,9 +20,11 @@ def _now_iso() -> str:
     # e.g., "2025-09-12T14:32:05Z"
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
 
-_SCHEMA = """
-PRAGMA journal_mode=WAL;
+def _iso_in(seconds: float) -> str:
+    ts = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+    return ts.replace(microsecond=0).isoformat().replace("+00:00", "Z")
 
+_SCHEMA = """
 CREATE TABLE IF NOT EXISTS seen_listings (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     profile_name TEXT NOT NULL,
@@ -36,6 +43,7 @@ CREATE TABLE IF NOT EXISTS listings (
     price_currency TEXT,
     location TEXT,
     rooms REAL,
+    content_hash TEXT,           -- hash of the tracked fields, see record_listing_changes()
     first_seen_at TEXT NOT NULL, -- ISO-8601 UTC
     last_seen_at  TEXT NOT NULL, -- ISO-8601 UTC
     UNIQUE(profile_name, url)
@@ -43,159 +51,749 @@ CREATE TABLE IF NOT EXISTS listings (
 
 CREATE INDEX IF NOT EXISTS idx_listings_profile_lastseen
     ON listings(profile_name, last_seen_at DESC);
+
+-- one row per observed version of a listing, only written when something changed
+CREATE TABLE IF NOT EXISTS listing_snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile_name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    change TEXT NOT NULL,        -- new | changed | price_drop | relisted
+    content_hash TEXT,
+    title TEXT,
+    price_amount REAL,
+    price_currency TEXT,
+    location TEXT,
+    rooms REAL,
+    observed_at TEXT NOT NULL    -- ISO-8601 UTC
+);
+
+CREATE INDEX IF NOT EXISTS idx_snapshots_profile_url
+    ON listing_snapshots(profile_name, url, id);
+
+-- written in the same transaction as seen_listings, drained by utils/notify_dispatcher.py
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile_name TEXT NOT NULL,
+    url TEXT,
+    jid TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending | sent | failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TEXT NOT NULL,          -- ISO-8601 UTC; also the claim lease while sending
+    last_error TEXT,
+    created_at TEXT NOT NULL,               -- ISO-8601 UTC
+    sent_at TEXT,                           -- ISO-8601 UTC
+    service_id TEXT                         -- set while whatsapp-service holds it, until delivery is confirmed
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_status_next
+    ON notification_outbox(status, next_attempt_at);
+
+-- address/rooms/price fingerprint → first listing notified with it, per recipient
+-- (scope = the profile's JID), so the same flat on another site, or the same URL
+-- under another profile, is recognized before it is notified again; see
+-- utils/fingerprint.py
+CREATE TABLE IF NOT EXISTS listing_fingerprints (
+    scope TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    profile_name TEXT NOT NULL,
+    url TEXT NOT NULL,           -- canonical URL
+    site TEXT,                   -- host of url without "www."
+    first_seen_at TEXT NOT NULL, -- ISO-8601 UTC
+    last_seen_at  TEXT NOT NULL, -- ISO-8601 UTC
+    PRIMARY KEY (scope, fingerprint)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_fingerprints_profile_url
+    ON listing_fingerprints(profile_name, url);
 """
 
-@contextmanager
-def _conn(db_path: str = DEFAULT_DB_PATH):
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    con = sqlite3.connect(db_path)
-    try:
-        yield con
-    finally:
-        con.close()
+_MMAP_BYTES = int(os.environ.get("DEDUP_DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+
+# applied once per connection, not per call
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA mmap_size={_MMAP_BYTES}",
+)
+
+class DedupeRepository:
+    """
+    One long-lived SQLite connection per thread for a given database file.
+    Statements are fixed SQL strings, so sqlite3's per-connection statement
+    cache keeps them prepared. Writes go through transaction(); nested calls
+    join the outer transaction, which is how unit_of_work() groups a
+    profile's filter/save/mark-seen into a single commit.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.rollback_listeners = []  # callables run after a ROLLBACK (cache invalidation)
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    def connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            # isolation_level=None: we issue BEGIN/COMMIT ourselves
+            con = sqlite3.connect(self.db_path, isolation_level=None, cached_statements=256)
+            for pragma in _PRAGMAS:
+                con.execute(pragma)
+            self._local.con = con
+            self._local.depth = 0
+        return con
+
+    @contextmanager
+    def transaction(self):
+        con = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield con
+            finally:
+                self._local.depth -= 1
+            return
+
+        # IMMEDIATE takes the write lock up front, so concurrent profiles wait on
+        # busy_timeout instead of failing a read→write upgrade mid-transaction
+        con.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            for listener in self.rollback_listeners:
+                listener()
+            raise
+        else:
+            con.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def close(self) -> None:
+        """Close the calling thread's connection (if any)."""
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+_repos = {}
+_repos_lock = threading.Lock()
+
+def get_repository(db_path: str = DEFAULT_DB_PATH) -> DedupeRepository:
+    with _repos_lock:
+        repo = _repos.get(db_path)
+        if repo is None:
+            repo = _repos[db_path] = DedupeRepository(db_path)
+        return repo
+
+def _read(db_path: str) -> sqlite3.Connection:
+    return get_repository(db_path).connection()
+
+def _write(db_path: str):
+    return get_repository(db_path).transaction()
+
+def unit_of_work(db_path: str = DEFAULT_DB_PATH):
+    """
+    Group several calls into one transaction on this thread's connection:
+
+        with unit_of_work():
+            save_listings(...)
+            mark_seen(...)
+    """
+    return get_repository(db_path).transaction()
+
+def close_connection(db_path: str = DEFAULT_DB_PATH) -> None:
+    get_repository(db_path).close()
 
 def init_db(db_path: str = DEFAULT_DB_PATH) -> None:
-    with _conn(db_path) as con:
-        con.executescript(_SCHEMA)
-        con.commit()
+    # executescript manages its own transaction; don't call inside unit_of_work()
+    con = _read(db_path)
+    con.executescript(_SCHEMA)
+    # databases created before change tracking
+    cols = {row[1] for row in con.execute("PRAGMA table_info(listings)")}
+    if "content_hash" not in cols:
+        con.execute("ALTER TABLE listings ADD COLUMN content_hash TEXT")
+    # databases created before batch delivery was confirmed per message
+    cols = {row[1] for row in con.execute("PRAGMA table_info(notification_outbox)")}
+    if "service_id" not in cols:
+        con.execute("ALTER TABLE notification_outbox ADD COLUMN service_id TEXT")
+    # databases created before fingerprints remembered the owner's site (NULL: derived from url)
+    cols = {row[1] for row in con.execute("PRAGMA table_info(listing_fingerprints)")}
+    if "site" not in cols:
+        con.execute("ALTER TABLE listing_fingerprints ADD COLUMN site TEXT")
+    if con.execute("PRAGMA user_version").fetchone()[0] < 1:
+        _canonicalize_stored_urls(con)
+        con.execute("PRAGMA user_version = 1")
+
+def _canonicalize_stored_urls(con: sqlite3.Connection) -> None:
+    """
+    Databases from before URL canonicalization keyed rows on the raw URL.
+    Rewrite them to canonical_url(); where two raw forms collapse into one
+    key, the row already holding the key wins and the other is dropped.
+    """
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        for table in ("seen_listings", "listings", "listing_snapshots"):
+            rows = con.execute(f"SELECT id, url FROM {table}").fetchall()
+            renamed = [(canonical_url(url), rid) for rid, url in rows if canonical_url(url) != url]
+            if not renamed:
+                continue
+            if table == "listing_snapshots":
+                con.executemany(f"UPDATE {table} SET url = ? WHERE id = ?", renamed)
+            else:
+                con.executemany(f"UPDATE OR IGNORE {table} SET url = ? WHERE id = ?", renamed)
+                # leftovers are duplicates of a row that already had the canonical key
+                con.executemany(f"DELETE FROM {table} WHERE id = ? AND url != ?",
+                                [(rid, url) for url, rid in renamed])
+            print(f"[DB] canonicalized {len(renamed)} URL(s) in {table}")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
 
 # ------------------------------
 # DEDUPE
 # ------------------------------
 
+_SQL_MAX_VARS = 500  # well below SQLITE_MAX_VARIABLE_NUMBER on old builds (999)
+# SEEN_INDEX=auto (default): only processes that call enable_seen_index() (the
+# daemon) use the in-memory index; its load only pays off over many polls, see
+# utils/seen_index.py. true/false force it on/off.
+_SEEN_INDEX_MODE = os.environ.get("SEEN_INDEX", "auto").lower()
+_SEEN_INDEX_ENABLED = _SEEN_INDEX_MODE == "true"
+_SEEN_INDEX_FP_RATE = float(os.environ.get("SEEN_INDEX_FP_RATE", "0.01"))
+
+def _query_seen(profile_name: str, urls: List[str], db_path: str) -> Set[str]:
+    con = _read(db_path)
+    seen: Set[str] = set()
+    for i in range(0, len(urls), _SQL_MAX_VARS):
+        chunk = urls[i:i + _SQL_MAX_VARS]
+        placeholders = ",".join("?" * len(chunk))
+        cur = con.execute(f"""
+            SELECT url FROM seen_listings
+            WHERE profile_name = ? AND url IN ({placeholders})
+        """, (profile_name, *chunk))
+        seen.update(row[0] for row in cur.fetchall())
+    return seen
+
+def _load_seen_rows(profile_name: str, after_id: int, db_path: str):
+    return _read(db_path).execute(
+        # "+profile_name" keeps the planner on the rowid range instead of the (profile_name, url) index
+        "SELECT id, url FROM seen_listings WHERE id > ? AND +profile_name = ?",
+        (after_id, profile_name),
+    )
+
+def enable_seen_index() -> None:
+    """Long-running processes: answer seen lookups from SeenIndex unless SEEN_INDEX=false."""
+    global _SEEN_INDEX_ENABLED
+    _SEEN_INDEX_ENABLED = _SEEN_INDEX_MODE != "false"
+
+_seen_indexes = {}
+
+def get_seen_index(db_path: str = DEFAULT_DB_PATH) -> SeenIndex:
+    repo = get_repository(db_path)
+    with _repos_lock:
+        index = _seen_indexes.get(db_path)
+        if index is None:
+            index = _seen_indexes[db_path] = SeenIndex(
+                loader=lambda profile, after_id: _load_seen_rows(profile, after_id, db_path),
+                counter=lambda profile: _read(db_path).execute(
+                    "SELECT COUNT(*) FROM seen_listings WHERE profile_name = ?", (profile,)
+                ).fetchone()[0],
+                checker=lambda profile, urls: _query_seen(profile, urls, db_path),
+                error_rate=_SEEN_INDEX_FP_RATE,
+            )
+            repo.rollback_listeners.append(index.invalidate)
+        return index
+
+def seen_urls(profile_name: str, urls: Iterable[str], db_path: str = DEFAULT_DB_PATH) -> Set[str]:
+    """Subset of `urls` (any form) whose canonical URL is recorded in seen_listings for this profile."""
+    by_key = {}
+    for u in urls:
+        if u:
+            by_key.setdefault(canonical_url(u), []).append(u)
+    if not by_key:
+        return set()
+    keys = list(by_key)
+    if _SEEN_INDEX_ENABLED:
+        seen = get_seen_index(db_path).seen(profile_name, keys)
+    else:
+        seen = _query_seen(profile_name, keys, db_path)
+    return {u for key in seen for u in by_key[key]}
+
 def filter_new_listings(profile_name: str, listings: List[RealEstateListing], db_path: str = DEFAULT_DB_PATH) -> List[RealEstateListing]:
     if not listings:
         return []
-    urls = [l.url for l in listings if l.url]
-    if not urls:
+    keys = [l.url_key for l in listings if l.url_key]
+    if not keys:
         return listings
-    placeholders = ",".join("?" * len(urls))
-    with _conn(db_path) as con:
-        cur = con.cursor()
-        cur.execute(f"""
-            SELECT url FROM seen_listings
-            WHERE profile_name = ? AND url IN ({placeholders})
-        """, (profile_name, *urls))
-        seen = {row[0] for row in cur.fetchall()}
-    return [l for l in listings if l.url not in seen]
+    seen = seen_urls(profile_name, keys, db_path=db_path)
+    return [l for l in listings if l.url_key not in seen]
+
+_MARK_SEEN_SQL = """
+    INSERT INTO seen_listings (profile_name, url, first_seen_at, last_seen_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(profile_name, url)
+    DO UPDATE SET last_seen_at=excluded.last_seen_at
+"""
 
 def mark_seen(profile_name: str, listings: Iterable[RealEstateListing], db_path: str = DEFAULT_DB_PATH) -> None:
     now = _now_iso()
     rows: List[Tuple[str, str, str, str]] = []
     for l in listings:
-        if not l.url:
+        if not l.url_key:
             continue
-        rows.append((profile_name, l.url, now, now))
+        rows.append((profile_name, l.url_key, now, now))
     if not rows:
         return
-    with _conn(db_path) as con:
-        cur = con.cursor()
-        cur.executemany("""
-            INSERT INTO seen_listings (profile_name, url, first_seen_at, last_seen_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(profile_name, url)
-            DO UPDATE SET last_seen_at=excluded.last_seen_at
-        """, rows)
-        con.commit()
+    with _write(db_path) as con:
+        con.executemany(_MARK_SEEN_SQL, rows)
+    if _SEEN_INDEX_ENABLED:
+        get_seen_index(db_path).add(profile_name, (r[1] for r in rows))
 
 # ------------------------------
 # LISTINGS STORAGE
 # ------------------------------
 
-_price_cur_re = re.compile(r"\b([A-Z]{3})\b")
-_price_num_re = re.compile(r"([-+]?\d+(?:[.,]\d+)?)")
-
-def _parse_price(price: Optional[str]):
-    if not price:
-        return (None, None)
-    cur = None
-    mcur = _price_cur_re.search(price)
-    if mcur:
-        cur = mcur.group(1)
-    cleaned = price.replace("’", "'").replace(" ", "").replace("'", "")
-    mnum = _price_num_re.search(cleaned)
-    amt = None
-    if mnum:
-        try:
-            amt = float(mnum.group(1).replace(",", "."))
-        except Exception:
-            amt = None
-    return (amt, cur)
+_SAVE_LISTINGS_SQL = """
+    INSERT INTO listings (
+        profile_name, url, title, price_amount, price_currency,
+        location, rooms, content_hash, first_seen_at, last_seen_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(profile_name, url) DO UPDATE SET
+        title=excluded.title,
+        price_amount=excluded.price_amount,
+        price_currency=excluded.price_currency,
+        location=excluded.location,
+        rooms=excluded.rooms,
+        content_hash=excluded.content_hash,
+        last_seen_at=excluded.last_seen_at
+"""
 
-def _to_float(x) -> Optional[float]:
-    try:
-        if x is None:
-            return None
-        if isinstance(x, (int, float)):
-            return float(x)
-        return float(str(x).replace(",", "."))
-    except Exception:
-        return None
+def _content_hash(fields: Tuple) -> str:
+    raw = "\x1f".join("" if v is None else str(v) for v in fields)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
 
 def save_listings(profile_name: str, listings: Iterable[RealEstateListing], db_path: str = DEFAULT_DB_PATH) -> None:
     now = _now_iso()
     rows = []
     for l in listings:
-        if not l.url:
+        if not l.url_key:
             continue
-        amount, currency = _parse_price(l.price if isinstance(l.price, str) else str(l.price) if l.price is not None else "")
-        rooms_val = _to_float(l.rooms)
-        rows.append((
-            profile_name,
-            l.url,
-            l.title or "",
-            amount,
-            currency,
-            l.location or "",
-            rooms_val,
-            now,
-            now
-        ))
+        fields = l.to_row()
+        rows.append((profile_name, l.url_key, *fields, _content_hash(fields), now, now))
     if not rows:
         return
-    with _conn(db_path) as con:
-        cur = con.cursor()
-        cur.executemany("""
-            INSERT INTO listings (
-                profile_name, url, title, price_amount, price_currency,
-                location, rooms, first_seen_at, last_seen_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(profile_name, url) DO UPDATE SET
-                title=excluded.title,
-                price_amount=excluded.price_amount,
-                price_currency=excluded.price_currency,
-                location=excluded.location,
-                rooms=excluded.rooms,
-                last_seen_at=excluded.last_seen_at
-        """, rows)
-        con.commit()
+    with _write(db_path) as con:
+        con.executemany(_SAVE_LISTINGS_SQL, rows)
 
 def get_recent_listings(profile_name: str, limit: int = 50, db_path: str = DEFAULT_DB_PATH) -> List[dict]:
-    with _conn(db_path) as con:
-        cur = con.cursor()
-        cur.execute("""
-            SELECT url, title, price_amount, price_currency, location, rooms, first_seen_at, last_seen_at
-            FROM listings
-            WHERE profile_name = ?
-            ORDER BY last_seen_at DESC
-            LIMIT ?
-        """, (profile_name, limit))
-        cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, row)) for row in cur.fetchall()]
+    cur = _read(db_path).execute("""
+        SELECT url, title, price_amount, price_currency, location, rooms, first_seen_at, last_seen_at
+        FROM listings
+        WHERE profile_name = ?
+        ORDER BY last_seen_at DESC
+        LIMIT ?
+    """, (profile_name, limit))
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
 
 def delete_listing(profile_name: str, url: str, *, also_clear_seen: bool = False,
                    db_path: str = DEFAULT_DB_PATH) -> None:
-    with _conn(db_path) as con:
-        cur = con.cursor()
-        cur.execute("DELETE FROM listings WHERE profile_name=? AND url=?", (profile_name, url))
+    url = canonical_url(url)
+    with _write(db_path) as con:
+        con.execute("DELETE FROM listings WHERE profile_name=? AND url=?", (profile_name, url))
+        con.execute("DELETE FROM listing_snapshots WHERE profile_name=? AND url=?", (profile_name, url))
+        con.execute("DELETE FROM listing_fingerprints WHERE profile_name=? AND url=?", (profile_name, url))
         if also_clear_seen:
-            cur.execute("DELETE FROM seen_listings WHERE profile_name=? AND url=?", (profile_name, url))
-        con.commit()
+            con.execute("DELETE FROM seen_listings WHERE profile_name=? AND url=?", (profile_name, url))
+    if also_clear_seen:
+        get_seen_index(db_path).invalidate(profile_name)
 
 def purge_profile(profile_name: str, *, db_path: str = DEFAULT_DB_PATH) -> None:
     """Danger: remove ALL rows for a profile."""
-    with _conn(db_path) as con:
-        cur = con.cursor()
-        cur.execute("DELETE FROM listings WHERE profile_name=?", (profile_name,))
-        cur.execute("DELETE FROM seen_listings WHERE profile_name=?", (profile_name,))
-        con.commit()
\ No newline at end of file
+    with _write(db_path) as con:
+        con.execute("DELETE FROM listings WHERE profile_name=?", (profile_name,))
+        con.execute("DELETE FROM listing_snapshots WHERE profile_name=?", (profile_name,))
+        con.execute("DELETE FROM seen_listings WHERE profile_name=?", (profile_name,))
+        con.execute("DELETE FROM listing_fingerprints WHERE profile_name=?", (profile_name,))
+    get_seen_index(db_path).invalidate(profile_name)
+
+# ------------------------------
+# CROSS-SITE DUPLICATES
+# ------------------------------
+
+def _site(url: str) -> str:
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+def split_duplicates(scope: str, profile_name: str, listings: List[RealEstateListing],
+                     db_path: str = DEFAULT_DB_PATH) -> Tuple[List[RealEstateListing], List[RealEstateListing]]:
+    """
+    (fresh, duplicates) of listings new to a profile: a duplicate has the
+    fingerprint of a listing already notified to the same scope (recipient)
+    either on another site, or under the same URL by another profile.
+    Another URL on the same site is a different flat (same building, rooms
+    and rent) and stays fresh. Fresh fingerprints are recorded. Call inside
+    the profile's unit_of_work, with the listings that are about to be
+    notified.
+    """
+    prints = [listing_fingerprint(l) for l in listings]
+    wanted = list({fp for fp in prints if fp is not None})
+    if not wanted:
+        return list(listings), []
+
+    con = _read(db_path)
+    known = {}
+    for i in range(0, len(wanted), _SQL_MAX_VARS):
+        chunk = wanted[i:i + _SQL_MAX_VARS]
+        cur = con.execute(f"""
+            SELECT fingerprint, profile_name, url, site FROM listing_fingerprints
+            WHERE scope = ? AND fingerprint IN ({",".join("?" * len(chunk))})
+        """, (scope, *chunk))
+        known.update((fp, (owner, url, site or _site(url))) for fp, owner, url, site in cur.fetchall())
+
+    now = _now_iso()
+    fresh, duplicates, inserts, touches = [], [], [], []
+    for l, fp in zip(listings, prints):
+        if fp is None:
+            fresh.append(l)
+            continue
+        site = _site(l.url_key)
+        owner = known.get(fp)
+        if owner is None:
+            # first of its fingerprint in this batch; later ones from other sites are duplicates
+            known[fp] = (profile_name, l.url_key, site)
+            fresh.append(l)
+            inserts.append((scope, fp, profile_name, l.url_key, site, now, now))
+            continue
+        owner_profile, owner_url, owner_site = owner
+        if owner_site != site or (owner_url == l.url_key and owner_profile != profile_name):
+            duplicates.append(l)
+            touches.append((now, scope, fp))
+        else:
+            fresh.append(l)
+
+    if inserts or touches:
+        with _write(db_path) as con:
+            con.executemany("""
+                INSERT OR IGNORE INTO listing_fingerprints
+                    (scope, fingerprint, profile_name, url, site, first_seen_at, last_seen_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, inserts)
+            con.executemany(
+                "UPDATE listing_fingerprints SET last_seen_at = ? WHERE scope = ? AND fingerprint = ?", touches
+            )
+    return fresh, duplicates
+
+_FINGERPRINT_KEEP_DAYS = int(os.environ.get("LISTING_FINGERPRINT_DAYS", "60"))
+
+def purge_stale_fingerprints(older_than_days: int = _FINGERPRINT_KEEP_DAYS, db_path: str = DEFAULT_DB_PATH) -> None:
+    """
+    Forget fingerprints whose flat hasn't been scraped for a while (neither as
+    a duplicate nor as the listing that recorded it), so a flat advertised
+    again much later is notified again.
+    """
+    cutoff = _iso_in(-older_than_days * 86400)
+    with _write(db_path) as con:
+        con.execute("""
+            DELETE FROM listing_fingerprints
+            WHERE last_seen_at < ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM listings l
+                  WHERE l.profile_name = listing_fingerprints.profile_name
+                    AND l.url = listing_fingerprints.url
+                    AND l.last_seen_at >= ?
+              )
+        """, (cutoff, cutoff))
+
+# ------------------------------
+# CHANGE TRACKING
+# ------------------------------
+
+_RELIST_AFTER_SEC = float(os.environ.get("LISTING_RELIST_AFTER_DAYS", "7")) * 86400
+_TOUCH_AFTER_SEC = float(os.environ.get("LISTING_TOUCH_HOURS", "6")) * 3600
+_PRICE_DROP_MIN = float(os.environ.get("LISTING_PRICE_DROP_MIN", "1"))
+
+class ListingChange:
+    """A known listing that came back cheaper (price_drop) or after a gap (relisted)."""
+
+    def __init__(self, kind: str, listing: RealEstateListing, old_price: Optional[float] = None,
+                 new_price: Optional[float] = None, currency: Optional[str] = None,
+                 away_days: Optional[float] = None):
+        self.kind = kind
+        self.listing = listing
+        self.old_price = old_price
+        self.new_price = new_price
+        self.currency = currency
+        self.away_days = away_days
+
+    def __repr__(self):
+        return f"ListingChange({self.kind}, {self.listing.url})"
+
+_SNAPSHOT_SQL = """
+    INSERT INTO listing_snapshots (
+        profile_name, url, change, content_hash, title, price_amount,
+        price_currency, location, rooms, observed_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _load_listing_state(profile_name: str, urls: List[str], db_path: str) -> dict:
+    con = _read(db_path)
+    state = {}
+    for i in range(0, len(urls), _SQL_MAX_VARS):
+        chunk = urls[i:i + _SQL_MAX_VARS]
+        placeholders = ",".join("?" * len(chunk))
+        cur = con.execute(f"""
+            SELECT url, title, price_amount, price_currency, location, rooms, content_hash, last_seen_at
+            FROM listings
+            WHERE profile_name = ? AND url IN ({placeholders})
+        """, (profile_name, *chunk))
+        for row in cur.fetchall():
+            state[row[0]] = row[1:]
+    return state
+
+def record_listing_changes(profile_name: str, listings: Iterable[RealEstateListing],
+                           db_path: str = DEFAULT_DB_PATH) -> List[ListingChange]:
+    """
+    Upsert everything a scrape returned (new and known listings) and return
+    the notifiable changes of known ones. Nothing is written for a listing
+    whose content hash is unchanged, except a last_seen_at refresh at most
+    every LISTING_TOUCH_HOURS; a snapshot row is added only when its content
+    changed, it is new, or it reappeared after LISTING_RELIST_AFTER_DAYS.
+    """
+    by_url = {}
+    for l in listings:
+        if l.url_key:
+            by_url[l.url_key] = l
+    if not by_url:
+        return []
+
+    state = _load_listing_state(profile_name, list(by_url), db_path)
+    now = datetime.now(timezone.utc)
+    now_iso = _now_iso()
+    inserts, updates, touches, snapshots = [], [], [], []
+    changes: List[ListingChange] = []
+
+    for url, l in by_url.items():
+        fields = l.to_row()
+        old = state.get(url)
+        if old is None:
+            h = _content_hash(fields)
+            inserts.append((profile_name, url, *fields, h, now_iso, now_iso))
+            snapshots.append((profile_name, url, "new", h, *fields, now_iso))
+            continue
+
+        old_fields, old_hash, last_seen = old[:5], old[5], old[6]
+        # list-only scrapes leave some fields empty; that is missing data, not a change
+        fields = tuple(old_v if v in (None, "") else v for v, old_v in zip(fields, old_fields))
+        h = _content_hash(fields)
+        away = (now - datetime.fromisoformat(last_seen.replace("Z", "+00:00"))).total_seconds()
+
+        old_amount, new_amount = old_fields[1], fields[1]
+        dropped = (old_amount is not None and new_amount is not None
+                   and old_amount - new_amount >= _PRICE_DROP_MIN)
+        relisted = away >= _RELIST_AFTER_SEC
+
+        kind = None
+        if dropped:
+            kind = "price_drop"
+        elif relisted:
+            kind = "relisted"
+        elif h != old_hash:
+            kind = "changed"
+
+        if h != old_hash:
+            updates.append((*fields, h, now_iso, profile_name, url))
+        elif away >= _TOUCH_AFTER_SEC:
+            touches.append((now_iso, profile_name, url))
+        if kind:
+            snapshots.append((profile_name, url, kind, h, *fields, now_iso))
+        if kind in ("price_drop", "relisted"):
+            changes.append(ListingChange(
+                kind, l, old_price=old_amount, new_price=new_amount, currency=fields[2],
+                away_days=away / 86400 if relisted else None,
+            ))
+
+    if not (inserts or updates or touches or snapshots):
+        return changes
+    with _write(db_path) as con:
+        if inserts:
+            con.executemany(_SAVE_LISTINGS_SQL, inserts)
+        if updates:
+            con.executemany("""
+                UPDATE listings
+                SET title = ?, price_amount = ?, price_currency = ?, location = ?, rooms = ?,
+                    content_hash = ?, last_seen_at = ?
+                WHERE profile_name = ? AND url = ?
+            """, updates)
+        if touches:
+            con.executemany("UPDATE listings SET last_seen_at = ? WHERE profile_name = ? AND url = ?", touches)
+        if snapshots:
+            con.executemany(_SNAPSHOT_SQL, snapshots)
+    return changes
+
+def get_listing_history(profile_name: str, url: str, db_path: str = DEFAULT_DB_PATH) -> List[dict]:
+    cur = _read(db_path).execute("""
+        SELECT change, title, price_amount, price_currency, location, rooms, observed_at
+        FROM listing_snapshots
+        WHERE profile_name = ? AND url = ?
+        ORDER BY id
+    """, (profile_name, url))
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+# ------------------------------
+# NOTIFICATION OUTBOX
+# ------------------------------
+
+def enqueue_notifications(profile_name: str, jid: str, messages: Iterable[Tuple[str, str]],
+                          db_path: str = DEFAULT_DB_PATH) -> int:
+    """
+    Queue (url, message) pairs for delivery. Call inside the same unit_of_work
+    as mark_seen so a listing is either seen *and* queued, or neither.
+    """
+    now = _now_iso()
+    rows = [(profile_name, url, jid, msg, now, now) for url, msg in messages]
+    if not rows:
+        return 0
+    with _write(db_path) as con:
+        con.executemany("""
+            INSERT INTO notification_outbox (profile_name, url, jid, message, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    return len(rows)
+
+def due_notifications(limit: int = 200, db_path: str = DEFAULT_DB_PATH) -> List[dict]:
+    """Pending rows whose next_attempt_at has passed, oldest first (not those the service holds)."""
+    cur = _read(db_path).execute("""
+        SELECT id, profile_name, url, jid, message, attempts
+        FROM notification_outbox
+        WHERE status = 'pending' AND service_id IS NULL AND next_attempt_at <= ?
+        ORDER BY id
+        LIMIT ?
+    """, (_now_iso(), limit))
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+def claim_notifications(ids: List[int], lease_sec: float, db_path: str = DEFAULT_DB_PATH) -> bool:
+    """
+    Push next_attempt_at of still-due rows `lease_sec` into the future. Returns
+    False if another drainer got any of them first. A crashed sender's rows
+    become due again once the lease runs out (at-least-once delivery).
+    """
+    if not ids:
+        return True
+    placeholders = ",".join("?" * len(ids))
+    now = _now_iso()
+    with _write(db_path) as con:  # BEGIN IMMEDIATE: check and update are atomic
+        still_due = con.execute(f"""
+            SELECT COUNT(*) FROM notification_outbox
+            WHERE id IN ({placeholders}) AND status = 'pending' AND service_id IS NULL AND next_attempt_at <= ?
+        """, (*ids, now)).fetchone()[0]
+        if still_due != len(ids):
+            return False
+        con.execute(f"""
+            UPDATE notification_outbox SET next_attempt_at = ?
+            WHERE id IN ({placeholders})
+        """, (_iso_in(lease_sec), *ids))
+    return True
+
+def mark_notifications_sent(ids: List[int], db_path: str = DEFAULT_DB_PATH) -> None:
+    if not ids:
+        return
+    now = _now_iso()
+    with _write(db_path) as con:
+        con.executemany("""
+            UPDATE notification_outbox
+            SET status = 'sent', sent_at = ?, attempts = attempts + 1, last_error = NULL
+            WHERE id = ?
+        """, [(now, i) for i in ids])
+
+def mark_notifications_failed(ids: List[int], error: str, retry_in_sec: Optional[float],
+                              db_path: str = DEFAULT_DB_PATH) -> None:
+    """retry_in_sec=None gives up (status 'failed'); otherwise schedules the next attempt."""
+    if not ids:
+        return
+    status = "failed" if retry_in_sec is None else "pending"
+    next_at = _now_iso() if retry_in_sec is None else _iso_in(retry_in_sec)
+    with _write(db_path) as con:
+        con.executemany("""
+            UPDATE notification_outbox
+            SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ?, service_id = NULL
+            WHERE id = ?
+        """, [(status, next_at, (error or "")[:500], i) for i in ids])
+
+def release_notifications(ids: List[int], retry_in_sec: float = 0.0, db_path: str = DEFAULT_DB_PATH) -> None:
+    """Hand claimed rows back without counting an attempt (e.g. the service asked us to slow down)."""
+    if not ids:
+        return
+    next_at = _iso_in(retry_in_sec)
+    with _write(db_path) as con:
+        con.executemany("""
+            UPDATE notification_outbox SET next_attempt_at = ?, service_id = NULL
+            WHERE id = ? AND status = 'pending'
+        """, [(next_at, i) for i in ids])
+
+def mark_notifications_handed_off(service_ids: Dict[int, str], check_in_sec: float,
+                                  db_path: str = DEFAULT_DB_PATH) -> None:
+    """
+    The service accepted these rows (row id -> its message id). They stay
+    pending, and are not sent again, until their status is confirmed; the
+    first check is due in `check_in_sec`.
+    """
+    if not service_ids:
+        return
+    next_at = _iso_in(check_in_sec)
+    with _write(db_path) as con:
+        con.executemany("""
+            UPDATE notification_outbox SET service_id = ?, next_attempt_at = ?
+            WHERE id = ? AND status = 'pending'
+        """, [(sid, next_at, i) for i, sid in service_ids.items()])
+
+def handed_off_notifications(limit: int = 200, db_path: str = DEFAULT_DB_PATH) -> List[dict]:
+    """Rows the service holds whose delivery status is due for a check."""
+    cur = _read(db_path).execute("""
+        SELECT id, jid, attempts, service_id
+        FROM notification_outbox
+        WHERE status = 'pending' AND service_id IS NOT NULL AND next_attempt_at <= ?
+        ORDER BY id
+        LIMIT ?
+    """, (_now_iso(), limit))
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+def postpone_notifications(ids: List[int], retry_in_sec: float, db_path: str = DEFAULT_DB_PATH) -> None:
+    """Check a handed-off row again later (still queued at the service, or the service unreachable)."""
+    if not ids:
+        return
+    next_at = _iso_in(retry_in_sec)
+    with _write(db_path) as con:
+        con.executemany("""
+            UPDATE notification_outbox SET next_attempt_at = ?
+            WHERE id = ? AND status = 'pending'
+        """, [(next_at, i) for i in ids])
+
+def outbox_counts(db_path: str = DEFAULT_DB_PATH) -> dict:
+    cur = _read(db_path).execute("SELECT status, COUNT(*) FROM notification_outbox GROUP BY status")
+    return dict(cur.fetchall())
+
+def next_outbox_attempt_in(db_path: str = DEFAULT_DB_PATH) -> Optional[float]:
+    """Seconds until the earliest pending row is due (0 if overdue), None if nothing is pending."""
+    row = _read(db_path).execute(
+        "SELECT MIN(next_attempt_at) FROM notification_outbox WHERE status = 'pending'"
+    ).fetchone()
+    if not row or not row[0]:
+        return None
+    due = datetime.fromisoformat(row[0].replace("Z", "+00:00"))
+    return max(0.0, (due - datetime.now(timezone.utc)).total_seconds())
+
+def purge_sent_notifications(older_than_days: int = 30, db_path: str = DEFAULT_DB_PATH) -> None:
+    cutoff = _iso_in(-older_than_days * 86400)
+    with _write(db_path) as con:
+        con.execute("DELETE FROM notification_outbox WHERE status = 'sent' AND sent_at < ?", (cutoff,))
@@ -0,0 +1,54 @@
+# utils/fingerprint.py
+"""
+Site-independent identity of a flat: normalized street address, rooms and
+price. The same flat advertised on Homegate and Flatfox has different URLs
+but the same fingerprint. Listings without a street + house number, rooms
+or price get no fingerprint (None) and are only deduped by URL: a missed
+duplicate costs one extra message, a false match would hide a flat.
+"""
+import hashlib
+import re
+import unicodedata
+from typing import Optional
+
+from models.real_estate_listing import RealEstateListing
+
+_FOLD = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_SUFFIXES = (
+    "strasse", "str", "weg", "gasse", "platz", "quai", "rain", "halde", "allee", "ring",
+    "steig", "steg", "matte", "hof", "acker", "graben", "berg", "park", "gässli", "weid",
+)
+_suffix_alt = "|".join(sorted({s.translate(_FOLD) for s in _SUFFIXES}, key=len, reverse=True))
+# "<street name ending in a street suffix> <house number>[letter]"; the name is one word
+# (or "Badener Strasse"), so words before the street name aren't picked up
+_street_re = re.compile(rf"\b([a-z][a-z\-]*?(?:{_suffix_alt})|[a-z][a-z\-]* (?:{_suffix_alt}))\.?\s+(\d{{1,4}}[a-z]?)\b")
+
+
+def _fold(text: str) -> str:
+    text = text.lower().translate(_FOLD)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9 \-]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def street_address(text: str) -> Optional[str]:
+    """'Seefeldstr. 12a, 8008 Zürich' → 'seefeldstrasse 12a' (None without street + number)."""
+    m = _street_re.search(_fold(text or ""))
+    if not m:
+        return None
+    street = m.group(1).replace(" ", "").replace("-", "")
+    if street.endswith("str"):
+        street += "asse"
+    return f"{street} {m.group(2)}"
+
+
+def listing_fingerprint(listing: RealEstateListing) -> Optional[str]:
+    if listing.rooms is None or listing.price_amount is None:
+        return None
+    # the location field is often just the town; scrapers put the street in the title then
+    address = street_address(listing.location) or street_address(listing.title)
+    if not address:
+        return None
+    raw = f"{address}|{listing.rooms:g}|{listing.price_amount:.0f}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
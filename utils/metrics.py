@@ -0,0 +1,273 @@
+# utils/metrics.py
+"""
+Counters and stage timers for finding where a polling cycle spends its time.
+
+    with metrics.timer("navigation", domain="homegate.ch"):
+        page.goto(url)
+    metrics.count("detail_fetches_avoided", 3)
+
+Every value is keyed by its name plus labels (profile, scraper, domain, ...).
+Labels set with `with metrics.labels(scraper="homegate"):` apply to everything
+recorded on that thread inside the block, so the browser pool, the rate
+limiter and the scrapers don't pass them around; explicit labels win.
+Stages nest: "scrape" contains that scrape's polite_wait, navigation, parse
+and node_details, "process_profile" contains dedupe_db.
+
+Totals are cumulative for the process. report() returns what changed since
+the previous report (one run, or one housekeeping period of the daemon),
+appends it as one JSON line to METRICS_SUMMARY_PATH and rewrites the
+Prometheus text file METRICS_PROM_PATH (node_exporter textfile collector).
+With METRICS_PORT > 0 the same text is served at http://<host>:<port>/metrics.
+Empty paths switch the respective output off.
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_SUMMARY_PATH = os.getenv("METRICS_SUMMARY_PATH", "data/metrics/runs.jsonl")
+_PROM_PATH = os.getenv("METRICS_PROM_PATH", "data/metrics/scraper.prom")
+_PORT = _env_int("METRICS_PORT", 0)
+_PREFIX = "realestate_"
+
+Labels = Tuple[Tuple[str, str], ...]
+_Key = Tuple[str, Labels]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = {}
+_timers: Dict[_Key, list] = {}  # key -> [count, total seconds, max seconds]
+_reported_counters: Dict[_Key, float] = {}
+_reported_timers: Dict[_Key, list] = {}
+_started_at = time.time()
+_last_report_at = _started_at
+_local = threading.local()
+
+
+def _current() -> Dict[str, str]:
+    return getattr(_local, "labels", None) or {}
+
+
+def _key(name: str, labels: Dict[str, Optional[str]]) -> _Key:
+    merged = dict(_current())
+    merged.update(labels)
+    return name, tuple(sorted((k, str(v)) for k, v in merged.items() if v is not None))
+
+
+@contextmanager
+def labels(**values):
+    """Attach labels to everything the calling thread records inside the block."""
+    previous = _current()
+    _local.labels = dict(previous, **{k: v for k, v in values.items() if v is not None})
+    try:
+        yield
+    finally:
+        _local.labels = previous
+
+
+def count(name: str, n: float = 1, **labels) -> None:
+    if not n:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def count_all(counts: Dict[str, float], **labels) -> None:
+    """Fold a Counter (e.g. a scraper's stats) into the counters."""
+    for name, n in counts.items():
+        count(name, n, **labels)
+
+
+def observe(stage: str, seconds: float, **labels) -> None:
+    key = _key(stage, labels)
+    with _lock:
+        t = _timers.get(key)
+        if t is None:
+            _timers[key] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            t[2] = max(t[2], seconds)
+
+
+@contextmanager
+def timer(stage: str, **labels):
+    """Time the block as `stage` (also when it raises)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0, **labels)
+
+
+def snapshot() -> dict:
+    """Cumulative totals: {"counters": [...], "timers": [...]} with labels as dicts."""
+    with _lock:
+        return {
+            "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(_counters.items())],
+            "timers": [{"stage": n, "labels": dict(l), "count": t[0], "seconds": round(t[1], 4),
+                        "max_seconds": round(t[2], 4)} for (n, l), t in sorted(_timers.items())],
+        }
+
+
+def _since_last_report() -> dict:
+    """Values recorded since the previous call; advances the report baseline."""
+    global _last_report_at
+    now = time.time()
+    with _lock:
+        counters = []
+        for key, value in sorted(_counters.items()):
+            delta = value - _reported_counters.get(key, 0)
+            if delta:
+                counters.append({"name": key[0], "labels": dict(key[1]), "value": delta})
+        timers = []
+        for key, (n, total, longest) in sorted(_timers.items()):
+            n0, total0, _ = _reported_timers.get(key, (0, 0.0, 0.0))
+            if n > n0:
+                # max is the process-wide maximum; per-period maxima would need resetting it
+                timers.append({"stage": key[0], "labels": dict(key[1]), "count": n - n0,
+                               "seconds": round(total - total0, 4), "max_seconds": round(longest, 4)})
+        _reported_counters.clear()
+        _reported_counters.update(_counters)
+        _reported_timers.clear()
+        _reported_timers.update({k: list(t) for k, t in _timers.items()})
+        started, _last_report_at = _last_report_at, now
+    return {"started_at": started, "finished_at": now, "duration_seconds": round(now - started, 3),
+            "counters": counters, "timers": timers}
+
+
+def _stage_totals(timers) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for t in timers:
+        totals[t["stage"]] = totals.get(t["stage"], 0.0) + t["seconds"]
+    return totals
+
+
+def _metric_name(name: str) -> str:
+    return _PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _prom_labels(labels: Labels, **extra) -> str:
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def prometheus_text() -> str:
+    """Cumulative totals in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        timers = sorted(_timers.items())
+    lines = []
+    by_name: Dict[str, list] = {}
+    for (name, labels_), value in counters:
+        by_name.setdefault(name, []).append((labels_, value))
+    for name, series in by_name.items():
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(f"{metric}{_prom_labels(l)} {v:g}" for l, v in series)
+
+    if timers:
+        base = _PREFIX + "stage_seconds"
+        lines.append(f"# HELP {base} Wall time spent per stage.")
+        lines.append(f"# TYPE {base} summary")
+        for (stage, labels_), (n, total, _) in timers:
+            lines.append(f"{base}_sum{_prom_labels(labels_, stage=stage)} {total:.6f}")
+            lines.append(f"{base}_count{_prom_labels(labels_, stage=stage)} {n}")
+        lines.append(f"# TYPE {base}_max gauge")
+        for (stage, labels_), (_, _, longest) in timers:
+            lines.append(f"{base}_max{_prom_labels(labels_, stage=stage)} {longest:.6f}")
+    lines.append(f"# TYPE {_PREFIX}process_start_time_seconds gauge")
+    lines.append(f"{_PREFIX}process_start_time_seconds {_started_at:.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, text: str) -> None:
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)  # the collector never reads a half-written file
+
+
+def report(extra: Optional[dict] = None) -> dict:
+    """
+    Print the stage breakdown since the last report, append it to the JSON
+    summary and refresh the Prometheus file. Returns the summary.
+    """
+    summary = _since_last_report()
+    if extra:
+        summary.update(extra)
+
+    totals = _stage_totals(summary["timers"])
+    if totals:
+        print("⏱️  Stage time: " + ", ".join(f"{stage}={sec:.1f}s"
+                                             for stage, sec in sorted(totals.items(), key=lambda kv: -kv[1])))
+    counters: Dict[str, float] = {}
+    for c in summary["counters"]:
+        counters[c["name"]] = counters.get(c["name"], 0) + c["value"]
+    if counters:
+        print("📊 Run stats: " + ", ".join(f"{k}={v:g}" for k, v in sorted(counters.items())))
+
+    try:
+        if _SUMMARY_PATH:
+            dirname = os.path.dirname(_SUMMARY_PATH)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(_SUMMARY_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        if _PROM_PATH:
+            _write_atomic(_PROM_PATH, prometheus_text())
+    except OSError as e:
+        print(f"⚠️  Could not write metrics: {e}")
+    return summary
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # no access log on stdout
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve(port: int = _PORT) -> None:
+    """Serve /metrics on a daemon thread (no-op when port is 0 or already serving)."""
+    global _server
+    if port <= 0 or _server is not None:
+        return
+    try:
+        _server = ThreadingHTTPServer(("", port), _Handler)
+    except OSError as e:
+        print(f"⚠️  Metrics endpoint not started on :{port}: {e}")
+        return
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 Metrics at http://0.0.0.0:{port}/metrics")
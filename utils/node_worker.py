@@ -0,0 +1,215 @@
+# utils/node_worker.py
+"""
+Long-lived Node subprocess speaking JSON lines.
+
+    request  (stdin):  {"id": 7, "url": "https://..."}
+    response (stdout): {"id": 7, "result": {...}}   or   {"id": 7, "error": "..."}
+
+Other stdout lines carrying a "type" (e.g. {"type": "ready"}) are events, not
+responses; they go to `on_event(msg, reply)`, where reply(dict) writes a line
+back to the same process (e.g. granting a rate-limit token). Results are delivered as soon as Node writes them; a crashed
+process is restarted on demand and its in-flight requests are re-sent once.
+
+cancel(ids) forgets requests nobody waits for any more and tells the worker
+with {"type": "cancel", "ids": [...]}, so it can drop the ones it hasn't
+started; late responses for those ids are ignored.
+"""
+import itertools
+import json
+import queue
+import subprocess
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class NodeWorkerError(RuntimeError):
+    pass
+
+
+class NodeWorker:
+    def __init__(self, script: str, args: Tuple[str, ...] = ("--worker",),
+                 name: str = "node", max_resends: int = 1,
+                 on_event: Optional[Callable[[dict, Callable[[dict], None]], None]] = None):
+        self.script = script
+        self.args = tuple(args)
+        self.name = name
+        self.max_resends = max_resends
+        self.on_event = on_event
+
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._ids = itertools.count(1)
+        # id -> (future, payload, resends, process it was written to)
+        self._inflight: Dict[int, Tuple[Future, dict, int, subprocess.Popen]] = {}
+        self.restarts = 0
+
+    # ---- process lifecycle
+    def _alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _spawn(self) -> None:
+        proc = subprocess.Popen(
+            ["node", self.script, *self.args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            bufsize=1,  # line-buffered
+        )
+        self._proc = proc
+        threading.Thread(target=self._read_stdout, args=(proc,), name=f"{self.name}-stdout", daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(proc,), name=f"{self.name}-stderr", daemon=True).start()
+        print(f"🟢 {self.name} worker started (pid={proc.pid})")
+
+    def _ensure_started(self) -> subprocess.Popen:
+        # caller holds self._lock; only spawns — re-sending is _on_exit's job, which counts it
+        if not self._alive():
+            if self._proc is not None:
+                self.restarts += 1
+                print(f"🔁 {self.name} worker restarting (restarts={self.restarts})")
+            self._spawn()
+        return self._proc
+
+    def _write(self, msg: dict) -> None:
+        # caller holds self._lock
+        try:
+            self._proc.stdin.write(json.dumps(msg) + "\n")
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            pass  # reader notices the exit and handles in-flight requests
+
+    def _reply(self, proc: subprocess.Popen, msg: dict) -> None:
+        with self._lock:
+            if proc is self._proc:  # a restarted process never asked
+                self._write(msg)
+
+    def _read_stderr(self, proc: subprocess.Popen) -> None:
+        for line in proc.stderr:
+            line = line.rstrip()
+            if line:
+                print(f"🔴 {self.name}: {line}")
+
+    def _read_stdout(self, proc: subprocess.Popen) -> None:
+        for line in proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️  {self.name}: non-JSON output: {line[:200]}")
+                continue
+            if "id" not in msg:
+                # event line (ready, acquire, ...)
+                if self.on_event is not None:
+                    try:
+                        self.on_event(msg, lambda reply, p=proc: self._reply(p, reply))
+                    except Exception as e:
+                        print(f"⚠️  {self.name}: event handler failed: {e}")
+                continue
+            with self._lock:
+                entry = self._inflight.pop(msg["id"], None)
+            if entry is None:
+                continue
+            fut = entry[0]
+            if fut.done():  # cancelled by the caller
+                continue
+            if "error" in msg:
+                fut.set_exception(NodeWorkerError(str(msg["error"])))
+            else:
+                fut.set_result(msg.get("result"))
+        self._on_exit(proc)
+
+    def _on_exit(self, proc: subprocess.Popen) -> None:
+        code = proc.wait()
+        crashed: List[Future] = []
+        with self._lock:
+            if self._proc is None:
+                return  # close() settles what is left
+            # requests this process never answered; a submit() may already have started its successor
+            lost = [(req_id, entry) for req_id, entry in self._inflight.items() if entry[3] is proc]
+            if not lost:
+                return
+            print(f"❌ {self.name} worker exited (code={code}) with {len(lost)} request(s) in flight")
+            for req_id, (fut, payload, resends, _proc) in lost:
+                if resends >= self.max_resends or fut.done():
+                    del self._inflight[req_id]
+                    crashed.append(fut)
+                else:
+                    self._inflight[req_id] = (fut, payload, resends + 1, self._ensure_started())
+                    self._write(dict(payload, id=req_id))
+        for fut in crashed:
+            if not fut.done():
+                fut.set_exception(NodeWorkerError(f"{self.name} worker crashed (code={code})"))
+
+    # ---- requests
+    def _submit(self, payload: dict) -> Tuple[int, Future]:
+        fut: Future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._inflight[req_id] = (fut, payload, 0, self._ensure_started())
+            self._write(dict(payload, id=req_id))
+        return req_id, fut
+
+    def submit(self, payload: dict) -> Future:
+        return self._submit(payload)[1]
+
+    def cancel(self, req_ids: List[int]) -> None:
+        """Give up on requests: drop them, ask the worker to skip them, cancel their futures."""
+        with self._lock:
+            dropped = [self._inflight.pop(i) for i in req_ids if i in self._inflight]
+            if dropped and self._alive():
+                self._write({"type": "cancel", "ids": list(req_ids)})
+        for fut, _payload, _resends, _proc in dropped:
+            fut.cancel()
+
+    def stream(self, payloads: List[dict], timeout: Optional[float] = None) -> Iterator[Tuple[dict, object]]:
+        """
+        Submit all payloads and yield (payload, result) in completion order.
+        Failed or timed-out requests yield (payload, None).
+        """
+        done: "queue.Queue[Tuple[int, dict, Future]]" = queue.Queue()
+        pending = set()
+        for payload in payloads:
+            req_id, fut = self._submit(payload)
+            pending.add(req_id)
+            fut.add_done_callback(lambda f, i=req_id, p=payload: done.put((i, p, f)))
+
+        try:
+            while pending:
+                try:
+                    req_id, payload, fut = done.get(timeout=timeout)
+                except queue.Empty:
+                    print(f"⏱️  {self.name}: timed out waiting for results, cancelling {len(pending)} request(s)")
+                    return
+                pending.discard(req_id)
+                try:
+                    yield payload, fut.result(timeout=0)
+                except (NodeWorkerError, FutureTimeout) as e:
+                    print(f"❌ {self.name}: {payload} failed: {e}")
+                    yield payload, None
+        finally:
+            # timed out, or the caller stopped iterating: don't spend the rate budget on abandoned pages
+            if pending:
+                self.cancel(sorted(pending))
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Close stdin so Node can drain and exit; kill it if it doesn't."""
+        with self._lock:
+            proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        with self._lock:
+            pending, self._inflight = list(self._inflight.values()), {}
+        for fut, _payload, _resends, _proc in pending:
+            if not fut.done():  # answered or cancelled meanwhile
+                fut.set_exception(NodeWorkerError(f"{self.name} worker closed"))
@@ -0,0 +1,297 @@
+# utils/notify_dispatcher.py
+"""
+Background delivery of WhatsApp notifications from the durable outbox.
+
+process_profile writes messages to notification_outbox (utils/dedupe_db.py) in the
+same transaction as mark_seen; this drain loop delivers pending rows while
+scraping continues, so a slow or crashed WhatsApp service no longer delays
+persistence, and a crash mid-run never re-sends what was already delivered.
+
+Pacing is per JID (WHATSAPP_SEND_DELAY_SEC between two sends to the same
+chat). With WHATSAPP_DIGEST_MAX > 1 several pending rows for one chat are
+merged into a single digest. Failed rows get attempts+1 and a next_attempt_at
+with exponential backoff, and are marked failed after WHATSAPP_MAX_ATTEMPTS.
+Rows are claimed with a short lease so two drainers never send the same row
+and a crashed sender's rows become due again.
+
+Given a send_batch callable, each pass hands every due row to the service's
+/send-batch endpoint in one request and leaves pacing to the service; a 429
+only pushes the rows back (no attempt is counted). If the endpoint is missing
+the dispatcher falls back to one request per message. A 202 only means the
+service queued the message: the row keeps its service id and stays pending
+(never re-sent) until message_status (GET /messages/:id, checked every
+WHATSAPP_STATUS_POLL_SEC) reports it sent; "failed" counts as a failed
+attempt, and an id the service no longer knows (restart) is sent again.
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.dedupe_db import (
+    DEFAULT_DB_PATH, due_notifications, claim_notifications, mark_notifications_sent,
+    mark_notifications_failed, release_notifications, outbox_counts, next_outbox_attempt_in,
+    close_connection, mark_notifications_handed_off, handed_off_notifications, postpone_notifications,
+)
+from utils.whatsapp import BatchUnsupported
+from utils import metrics
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_MIN_INTERVAL = _env_float("WHATSAPP_SEND_DELAY_SEC", 10.0)
+_DIGEST_MAX = _env_int("WHATSAPP_DIGEST_MAX", 1)
+_MAX_ATTEMPTS = _env_int("WHATSAPP_MAX_ATTEMPTS", 5)
+_BACKOFF_BASE = _env_float("WHATSAPP_BACKOFF_BASE_SEC", 2.0)
+_BACKOFF_MAX = _env_float("WHATSAPP_BACKOFF_MAX_SEC", 300.0)
+_POLL_SEC = _env_float("OUTBOX_POLL_SEC", 5.0)
+_LEASE_SEC = _env_float("OUTBOX_LEASE_SEC", 120.0)
+_STATUS_POLL_SEC = _env_float("WHATSAPP_STATUS_POLL_SEC", 5.0)
+_FETCH_LIMIT = 200
+
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
+
+
+def merge_digest(texts: List[str]) -> str:
+    if len(texts) == 1:
+        return texts[0]
+    return f"🏠 {len(texts)} neue Inserate" + DIGEST_SEPARATOR + DIGEST_SEPARATOR.join(texts)
+
+
+class NotificationDispatcher:
+    def __init__(self, send: Callable[[str, str], None],
+                 send_batch: Optional[Callable[[List[Tuple[str, str]]], List[Optional[str]]]] = None,
+                 message_status: Optional[Callable[[str], Optional[dict]]] = None,
+                 db_path: str = DEFAULT_DB_PATH,
+                 min_interval: Optional[float] = None,
+                 digest_max: Optional[int] = None,
+                 max_attempts: Optional[int] = None,
+                 backoff_base: Optional[float] = None,
+                 backoff_max: Optional[float] = None):
+        if send_batch is not None and message_status is None:
+            raise ValueError("batch delivery needs message_status to confirm what the service accepted")
+        self._send = send
+        self._send_batch = send_batch
+        self._message_status = message_status
+        self.status_poll = _STATUS_POLL_SEC
+        self.db_path = db_path
+        self.min_interval = _MIN_INTERVAL if min_interval is None else min_interval
+        self.digest_max = max(1, _DIGEST_MAX if digest_max is None else digest_max)
+        self.max_attempts = max(1, _MAX_ATTEMPTS if max_attempts is None else max_attempts)
+        self.backoff_base = _BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = _BACKOFF_MAX if backoff_max is None else backoff_max
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._progress = threading.Condition()
+        self._next_at: Dict[str, float] = {}  # jid -> earliest time the next send may start
+        self._thread: Optional[threading.Thread] = None
+
+        self.sent = 0
+        self.failed = 0
+
+    # ---- control
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="wa-outbox", daemon=True)
+            self._thread.start()
+
+    def wake(self) -> None:
+        """New rows were committed; don't wait for the next poll."""
+        self.start()
+        self._wake.set()
+
+    def pending(self) -> int:
+        return outbox_counts(self.db_path).get("pending", 0)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no pending rows are left (delivered or given up on)."""
+        self.wake()
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            with self._progress:
+                self._progress.wait(min(_POLL_SEC, remaining) if remaining is not None else _POLL_SEC)
+        return True
+
+    def stop(self, timeout: float = 30.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---- drain loop
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return max(self.min_interval, delay + random.random() * min(1.0, delay))
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                try:
+                    wait = self._drain_once()
+                except Exception as e:
+                    print(f"⚠️  Outbox drain failed: {e}")
+                    wait = _POLL_SEC
+                with self._progress:
+                    self._progress.notify_all()
+                if wait > 0:
+                    self._wake.wait(wait)
+                    self._wake.clear()
+        finally:
+            close_connection(self.db_path)
+
+    def _drain_once(self) -> float:
+        """One pass over due rows; returns how long to sleep before the next pass."""
+        if self._message_status is not None:
+            self._confirm_handed_off()
+
+        groups: Dict[str, List[dict]] = {}
+        for row in due_notifications(limit=_FETCH_LIMIT, db_path=self.db_path):
+            groups.setdefault(row["jid"], []).append(row)
+
+        if self._send_batch is not None and groups:
+            return self._drain_batch(groups)
+
+        sent_any = False
+        now = time.time()
+        for jid, rows in groups.items():
+            if self._next_at.get(jid, 0.0) > now:
+                continue
+            batch = rows[:self.digest_max]
+            ids = [r["id"] for r in batch]
+            if not claim_notifications(ids, _LEASE_SEC, db_path=self.db_path):
+                continue  # another drainer took them
+
+            try:
+                with metrics.timer("whatsapp_send"):
+                    self._send(merge_digest([r["message"] for r in batch]), jid)
+                mark_notifications_sent(ids, db_path=self.db_path)
+                self.sent += len(ids)
+                metrics.count("whatsapp_sent", len(ids))
+            except Exception as e:
+                self._failed(batch, e)
+            self._next_at[jid] = time.time() + self.min_interval
+            sent_any = True
+
+        if sent_any:
+            return 0.0
+        # nothing sendable: sleep until a paced chat frees up or a retry falls due
+        waits = [_POLL_SEC]
+        now = time.time()
+        waits += [self._next_at.get(jid, 0.0) - now for jid in groups]
+        due_in = next_outbox_attempt_in(self.db_path)
+        if due_in is not None:
+            waits.append(due_in)
+        return max(0.05, min(waits))
+
+    def _confirm_handed_off(self) -> None:
+        """Settle rows the service accepted: sent → done, failed → retry or give up, unknown → send again."""
+        by_service_id: Dict[str, List[dict]] = {}
+        for row in handed_off_notifications(limit=_FETCH_LIMIT, db_path=self.db_path):
+            by_service_id.setdefault(row["service_id"], []).append(row)  # a digest shares one id
+
+        unreachable: List[int] = []
+        for service_id, rows in by_service_id.items():
+            ids = [r["id"] for r in rows]
+            if unreachable:
+                unreachable.extend(ids)
+                continue
+            try:
+                status = self._message_status(service_id)
+            except Exception as e:
+                print(f"⚠️  WhatsApp status check failed ({e}); asking again in {self.status_poll:.0f}s")
+                unreachable.extend(ids)
+                continue
+
+            state = None if status is None else status.get("status")
+            if status is None:
+                # the service restarted or expired the id: nothing says it went out
+                release_notifications(ids, db_path=self.db_path)
+                print(f"↩️  WhatsApp service no longer knows {len(ids)} message(s); sending them again")
+            elif state == "sent":
+                mark_notifications_sent(ids, db_path=self.db_path)
+                self.sent += len(ids)
+                metrics.count("whatsapp_sent", len(ids))
+            elif state == "failed":
+                self._failed(rows, RuntimeError(status.get("error") or "delivery failed"))
+            else:
+                postpone_notifications(ids, self.status_poll, db_path=self.db_path)
+        postpone_notifications(unreachable, self.status_poll, db_path=self.db_path)
+
+    def _failed(self, rows: List[dict], e: Exception) -> None:
+        ids = [r["id"] for r in rows]
+        retry_after = getattr(e, "retry_after", None)
+        if retry_after is not None:
+            release_notifications(ids, retry_after, db_path=self.db_path)
+            print(f"⏸️  WhatsApp service busy; {len(ids)} message(s) back in {retry_after:.0f}s")
+            return
+        attempts = max(r["attempts"] for r in rows) + 1
+        jids = ", ".join(sorted({r["jid"] for r in rows}))
+        if attempts >= self.max_attempts:
+            mark_notifications_failed(ids, str(e), None, db_path=self.db_path)
+            self.failed += len(ids)
+            metrics.count("whatsapp_failed", len(ids))
+            print(f"❌ Giving up on {len(ids)} WhatsApp message(s) to {jids} after {attempts} attempts: {e}")
+        else:
+            retry_in = self._backoff(attempts)
+            metrics.count("whatsapp_retries", len(ids))
+            mark_notifications_failed(ids, str(e), retry_in, db_path=self.db_path)
+            print(f"⚠️  WhatsApp send to {jids} failed ({e}); retrying in {retry_in:.1f}s")
+
+    def _drain_batch(self, groups: Dict[str, List[dict]]) -> float:
+        """All due rows in one /send-batch call; the service does the pacing, delivery is confirmed later."""
+        entries = []  # (rows, jid, text)
+        for jid, rows in groups.items():
+            for i in range(0, len(rows), self.digest_max):
+                chunk = rows[i:i + self.digest_max]
+                entries.append((chunk, jid, merge_digest([r["message"] for r in chunk])))
+
+        ids = [r["id"] for rows, _, _ in entries for r in rows]
+        if not claim_notifications(ids, _LEASE_SEC, db_path=self.db_path):
+            return 0.05  # raced with another drainer; re-read
+
+        try:
+            with metrics.timer("whatsapp_send_batch"):
+                accepted = self._send_batch([(jid, text) for _, jid, text in entries])
+        except BatchUnsupported as e:
+            print(f"ℹ️  {e}; falling back to one request per message.")
+            self._send_batch = None
+            release_notifications(ids, db_path=self.db_path)
+            return 0.0
+        except Exception as e:
+            self._failed([r for rows, _, _ in entries for r in rows], e)
+            return 0.0
+
+        handed_off, rejected = {}, []
+        for (rows, _, _), service_id in zip(entries, accepted + [None] * (len(entries) - len(accepted))):
+            if service_id:
+                handed_off.update((r["id"], service_id) for r in rows)
+            else:
+                rejected.extend(rows)
+        # queued at the service, not delivered yet: stays pending until GET /messages/:id says "sent"
+        mark_notifications_handed_off(handed_off, self.status_poll, db_path=self.db_path)
+        if rejected:
+            # the service validated and refused them (bad JID / empty text): retrying won't help
+            mark_notifications_failed([r["id"] for r in rejected], "rejected by service", None, db_path=self.db_path)
+            self.failed += len(rejected)
+            metrics.count("whatsapp_failed", len(rejected))
+            print(f"❌ WhatsApp service rejected {len(rejected)} message(s).")
+        return 0.0
@@ -0,0 +1,216 @@
+# utils/poll_scheduler.py
+"""
+Adaptive polling for daemon mode (daemon.py).
+
+Each fetch group (see utils/query_planner.py) gets its own next-poll time.
+After every poll, the number of new listings each member profile got is
+folded into an EWMA of "new listings per hour", kept both overall and per
+local hour of day. The next interval aims at POLL_TARGET_NEW new listings
+per poll: busy profiles are polled more often (down to POLL_MIN_SEC), idle
+ones less often (up to POLL_MAX_SEC). A group follows its busiest member.
+
+On top of that every site has a crawl budget of fetches per sliding hour
+(DAEMON_SITE_BUDGET, e.g. "homegate=6,flatfox=20"); a due group whose site
+has spent its budget waits until the oldest fetch leaves the window, and one
+whose site cools down after a block (`cooldown_of`) until the cooldown ends.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from utils.scheduler import _parse_site_caps
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_MIN_SEC = _env_float("POLL_MIN_SEC", 300.0)
+_MAX_SEC = _env_float("POLL_MAX_SEC", 3600.0)
+_BASE_SEC = _env_float("POLL_BASE_SEC", 900.0)       # until a profile has a rate estimate
+_TARGET_NEW = _env_float("POLL_TARGET_NEW", 1.0)     # new listings we'd like to see per poll
+_ALPHA = _env_float("POLL_EWMA_ALPHA", 0.3)
+_JITTER = _env_float("POLL_JITTER", 0.1)             # ±10% so groups don't fire in lockstep
+_RETRY_SEC = _env_float("POLL_RETRY_SEC", 600.0)     # after a failed fetch
+_BUDGET_DEFAULT = _env_int("DAEMON_SITE_BUDGET_DEFAULT", 12)
+_BUDGETS = _parse_site_caps(os.getenv("DAEMON_SITE_BUDGET", "homegate=6,flatfox=20"))
+
+_WINDOW_SEC = 3600.0
+
+
+def _hour(ts: float) -> int:
+    return time.localtime(ts).tm_hour
+
+
+class ProfileRate:
+    """EWMA of new listings per hour, overall and per local hour of day."""
+
+    def __init__(self, alpha: float = _ALPHA):
+        self.alpha = alpha
+        self.overall: Optional[float] = None
+        self.by_hour: List[Optional[float]] = [None] * 24
+
+    def _mix(self, old: Optional[float], value: float) -> float:
+        return value if old is None else old + self.alpha * (value - old)
+
+    def observe(self, new_count: int, elapsed_sec: float, hour: int) -> None:
+        if elapsed_sec <= 0:
+            return
+        per_hour = new_count * 3600.0 / elapsed_sec
+        self.overall = self._mix(self.overall, per_hour)
+        self.by_hour[hour] = self._mix(self.by_hour[hour], per_hour)
+
+    def estimate(self, hour: int) -> Optional[float]:
+        at_hour = self.by_hour[hour]
+        if at_hour is None:
+            return self.overall
+        return (at_hour + self.overall) / 2  # an hour bucket alone is too noisy
+
+
+def next_interval(rate_per_hour: Optional[float], min_sec: float = _MIN_SEC, max_sec: float = _MAX_SEC,
+                  base_sec: float = _BASE_SEC, target_new: float = _TARGET_NEW) -> float:
+    if rate_per_hour is None:
+        return min(max(base_sec, min_sec), max_sec)
+    if rate_per_hour <= 0:
+        return max_sec
+    return min(max(target_new / rate_per_hour * 3600.0, min_sec), max_sec)
+
+
+class SiteBudget:
+    """At most `per_hour` fetches per site within any sliding hour."""
+
+    def __init__(self, per_hour: Optional[Dict[str, int]] = None, default: Optional[int] = None):
+        self.per_hour = dict(_BUDGETS if per_hour is None else per_hour)
+        self.default = max(1, _BUDGET_DEFAULT if default is None else default)
+        self._spent: Dict[str, Deque[float]] = {}
+
+    def limit(self, site: str) -> int:
+        return self.per_hour.get(site, self.default)
+
+    def wait_time(self, site: str, now: float) -> float:
+        """0 if a fetch may start now, else seconds until one may."""
+        spent = self._spent.setdefault(site, deque())
+        while spent and spent[0] <= now - _WINDOW_SEC:
+            spent.popleft()
+        if len(spent) < self.limit(site):
+            return 0.0
+        return spent[0] + _WINDOW_SEC - now
+
+    def spend(self, site: str, now: float) -> None:
+        self._spent.setdefault(site, deque()).append(now)
+
+
+class _GroupState:
+    def __init__(self, group, next_at: float):
+        self.group = group
+        self.next_at = next_at
+        self.running = False
+        self.last_polled: Optional[float] = None  # start of the last successful poll
+        self.started: Optional[float] = None
+
+
+class PollPlanner:
+    def __init__(self, groups: List, budget: Optional[SiteBudget] = None, now: Optional[float] = None,
+                 cooldown_of: Optional[Callable[[object], float]] = None):
+        now = time.time() if now is None else now
+        self.budget = budget or SiteBudget()
+        self.cooldown_of = cooldown_of  # group -> seconds its site still cools down
+        self._lock = threading.Lock()
+        # first round is spread over a minute instead of firing all at once
+        self._states = [_GroupState(g, now + i * min(60.0, _MIN_SEC) / max(1, len(groups)))
+                        for i, g in enumerate(groups)]
+        self._rates: Dict[str, ProfileRate] = {}
+
+    def _rate(self, profile_name: str) -> ProfileRate:
+        rate = self._rates.get(profile_name)
+        if rate is None:
+            rate = self._rates[profile_name] = ProfileRate()
+        return rate
+
+    def due(self, now: Optional[float] = None) -> List:
+        """Groups to start now; their site budget is spent on the way out."""
+        now = time.time() if now is None else now
+        out = []
+        with self._lock:
+            for st in sorted(self._states, key=lambda s: s.next_at):
+                if st.running or st.next_at > now:
+                    continue
+                site = st.group.scraper
+                wait = self.budget.wait_time(site, now)
+                if wait <= 0 and self.cooldown_of is not None:
+                    wait = self.cooldown_of(st.group)
+                if wait > 0:
+                    st.next_at = now + wait
+                    continue
+                self.budget.spend(site, now)
+                st.running = True
+                st.started = now
+                out.append(st.group)
+        return out
+
+    def _state(self, group) -> _GroupState:
+        for st in self._states:
+            if st.group is group:
+                return st
+        raise KeyError(group.name)
+
+    def completed(self, group, new_counts: Dict[str, int], now: Optional[float] = None) -> float:
+        """Record a poll's new listings per profile; returns the group's next interval."""
+        now = time.time() if now is None else now
+        with self._lock:
+            st = self._state(group)
+            hour = _hour(now)
+            intervals = []
+            for profile in group.profiles:
+                rate = self._rate(profile["name"])
+                # the first poll only sees the backlog, not a rate
+                if st.last_polled is not None:
+                    rate.observe(new_counts.get(profile["name"], 0), st.started - st.last_polled, hour)
+                intervals.append(next_interval(rate.estimate(hour)))
+            interval = min(intervals) if intervals else _BASE_SEC
+            interval *= 1 + random.uniform(-_JITTER, _JITTER)
+            st.last_polled = st.started
+            st.next_at = now + interval
+            st.running = False
+            return interval
+
+    def failed(self, group, now: Optional[float] = None, retry_in: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        with self._lock:
+            st = self._state(group)
+            st.next_at = now + (_RETRY_SEC if retry_in is None else retry_in)
+            st.running = False
+
+    def next_wakeup(self, now: Optional[float] = None) -> float:
+        """Seconds until the earliest idle group is due (capped so budgets get re-checked)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            pending = [st.next_at for st in self._states if not st.running]
+        if not pending:
+            return _MIN_SEC
+        return max(0.0, min(min(pending) - now, _MIN_SEC))
+
+    def describe(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            lines = []
+            for st in self._states:
+                rates = [self._rates[p["name"]].overall for p in st.group.profiles if p["name"] in self._rates]
+                known = [r for r in rates if r is not None]
+                rate_txt = f"{max(known):.2f}/h" if known else "n/a"
+                state = "running" if st.running else f"next in {max(0.0, st.next_at - now) / 60:.0f} min"
+                lines.append(f"{st.group.name}: {state}, new≈{rate_txt}")
+            return lines
@@ -0,0 +1,164 @@
+# utils/query_planner.py
+"""
+Merges search profiles that query the same area into one superset fetch.
+
+Profiles are grouped by scraper and geography (Homegate: zip + radius;
+Flatfox: region/query/bbox/categories; Stadt Zürich: the one city list).
+Each group is scraped once with the union of its members' constraints
+(lowest min_rooms, highest max_rooms/max_price; a constraint only one member
+leaves open is dropped), and the result is fanned out to every member by
+applying its own filters locally. Fetches per cycle then scale with the
+number of distinct areas, not with the number of profiles.
+
+Flatfox answers with one page of at most `take` results, so a broader merged
+query could push a narrower member's listings out of that window; its
+profiles are only merged when their queries are identical.
+"""
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models.real_estate_listing import RealEstateListing, parse_number
+
+_ENABLED = os.getenv("QUERY_PLANNER", "true").lower() == "true"
+
+# scraper -> params that identify the area (everything else is a filter)
+_AREA_KEYS = {
+    "homegate": ("zip", "radius"),
+    "flatfox": ("region", "query", "bbox", "temporary", "object_categories", "place_type"),
+    "vermietungen-stadt-zuerich": (),
+}
+# params the URL builder can't do without; a group that would lose one isn't merged
+_REQUIRED = {
+    "flatfox": ("min_rooms", "max_price"),
+}
+# scrapers that fetch a single, capped result page (no pagination)
+_SINGLE_PAGE = ("flatfox",)
+_LOWER_BOUNDS = ("min_rooms",)
+_UPPER_BOUNDS = ("max_rooms", "max_price", "take")
+
+
+class FetchGroup:
+    """One remote query (`params`) serving one or more profiles."""
+
+    def __init__(self, scraper: str, params: dict, profiles: List[dict]):
+        self.scraper = scraper
+        self.params = params
+        self.profiles = profiles
+
+    @property
+    def name(self) -> str:
+        return "+".join(p["name"] for p in self.profiles)
+
+    def config(self) -> dict:
+        """Scraper config for the superset query; `members` lets a scraper fetch per member instead."""
+        return {"name": self.name, "scraper": self.scraper, "params": self.params,
+                "members": [p.get("params") or {} for p in self.profiles]}
+
+    def __repr__(self):
+        return f"FetchGroup({self.scraper}, {self.name})"
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(sorted(_freeze(v) for v in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def _area_key(profile: dict) -> Optional[Tuple]:
+    keys = _AREA_KEYS.get(profile["scraper"])
+    if keys is None:
+        return None  # unknown scraper: never merged
+    params = profile.get("params") or {}
+    if profile["scraper"] in _SINGLE_PAGE:
+        return (profile["scraper"], _freeze(params))  # identical queries only
+    return (profile["scraper"],) + tuple(_freeze(params.get(k)) for k in keys)
+
+
+def _bounds(params: dict) -> dict:
+    """exact_rooms is min_rooms == max_rooms for merging purposes."""
+    params = dict(params or {})
+    exact = params.pop("exact_rooms", None)
+    if exact is not None:
+        params["min_rooms"] = params["max_rooms"] = exact
+    return params
+
+
+def superset_params(scraper: str, members: List[dict]) -> Optional[dict]:
+    """Union of the members' constraints, or None if the builder couldn't express it."""
+    if len(members) == 1:
+        return dict(members[0].get("params") or {})
+
+    bounded = [_bounds(m.get("params")) for m in members]
+    merged = dict(bounded[0])
+    for key in _LOWER_BOUNDS + _UPPER_BOUNDS:
+        values = [b.get(key) for b in bounded]
+        merged.pop(key, None)
+        if any(v is None for v in values):
+            continue  # one member leaves it open → so does the superset
+        merged[key] = min(values) if key in _LOWER_BOUNDS else max(values)
+
+    if any(merged.get(k) is None for k in _REQUIRED.get(scraper, ())):
+        return None
+    return merged
+
+
+def plan_fetches(profiles: Iterable[dict]) -> List[FetchGroup]:
+    """Group profiles into fetches, keeping the order of each group's first profile."""
+    profiles = list(profiles)
+    if not _ENABLED:
+        return [FetchGroup(p["scraper"], dict(p.get("params") or {}), [p]) for p in profiles]
+
+    by_area: Dict[object, List[dict]] = {}
+    for i, p in enumerate(profiles):
+        key = _area_key(p)
+        by_area.setdefault(key if key is not None else ("__single__", i), []).append(p)
+
+    groups: List[FetchGroup] = []
+    for members in by_area.values():
+        scraper = members[0]["scraper"]
+        params = superset_params(scraper, members)
+        if params is None:
+            groups.extend(FetchGroup(scraper, dict(m.get("params") or {}), [m]) for m in members)
+        else:
+            groups.append(FetchGroup(scraper, params, members))
+    return groups
+
+
+def matches(listing: RealEstateListing, params: dict) -> bool:
+    """
+    Would the profile's own remote query have returned this listing? Values
+    the scraper couldn't extract don't exclude a listing.
+    """
+    params = params or {}
+    rooms = listing.rooms
+    price = listing.price_amount
+
+    exact = parse_number(params.get("exact_rooms"))
+    if exact is not None and rooms is not None and abs(rooms - exact) > 1e-9:
+        return False
+    min_rooms = parse_number(params.get("min_rooms"))
+    if min_rooms is not None and rooms is not None and rooms < min_rooms:
+        return False
+    max_rooms = parse_number(params.get("max_rooms"))
+    if max_rooms is not None and rooms is not None and rooms > max_rooms:
+        return False
+    max_price = parse_number(params.get("max_price"))
+    if max_price is not None and price is not None and price > max_price:
+        return False
+    return True
+
+
+def interested_profiles(group: FetchGroup, listing: RealEstateListing) -> List[dict]:
+    """The members whose own query would have returned the listing."""
+    if len(group.profiles) == 1:
+        return group.profiles
+    return [p for p in group.profiles if matches(listing, p.get("params"))]
+
+
+def fan_out(group: FetchGroup, listings: List[RealEstateListing]) -> List[Tuple[dict, List[RealEstateListing]]]:
+    """(profile, its listings) for every member of the group."""
+    if len(group.profiles) == 1:
+        return [(group.profiles[0], listings)]
+    return [(p, [l for l in listings if matches(l, p.get("params"))]) for p in group.profiles]
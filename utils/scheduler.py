@@ -0,0 +1,163 @@
+# utils/scheduler.py
+import os
+import threading
+import traceback
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _parse_site_caps(raw: str) -> Dict[str, int]:
+    """'homegate=1,flatfox=2' → {'homegate': 1, 'flatfox': 2}"""
+    caps: Dict[str, int] = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        key, val = part.split("=", 1)
+        try:
+            caps[key.strip()] = max(1, int(val.strip()))
+        except ValueError:
+            continue
+    return caps
+
+
+# ---- Run controls (all configurable via env)
+_MAX_WORKERS = _env_int("RUN_MAX_WORKERS", 4)
+_DEFAULT_SITE_CAP = _env_int("RUN_SITE_CONCURRENCY_DEFAULT", 1)
+_SITE_CAPS = _parse_site_caps(os.getenv("RUN_SITE_CONCURRENCY", ""))
+
+
+class SiteScheduler:
+    """
+    Runs items on a small worker pool while keeping at most `cap(site)` items
+    of the same site in flight. Items of different sites overlap freely; items
+    of one site keep the politeness budget of a sequential run (cap=1 default).
+    Items are started in input order whenever their site has a free slot.
+
+    run() handles a fixed batch and returns when it is done. start()/submit()/
+    shutdown() keep the pool (and each worker's warm browser) alive for a
+    long-running caller that feeds items as they become due.
+    """
+
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 site_caps: Optional[Dict[str, int]] = None,
+                 default_cap: Optional[int] = None,
+                 on_worker_exit: Optional[Callable[[], None]] = None):
+        self.max_workers = max(1, max_workers if max_workers is not None else _MAX_WORKERS)
+        self.site_caps = dict(_SITE_CAPS if site_caps is None else site_caps)
+        self.default_cap = max(1, default_cap if default_cap is not None else _DEFAULT_SITE_CAP)
+        self.on_worker_exit = on_worker_exit
+
+        self._cond = threading.Condition()
+        self._pending: List[tuple] = []
+        self._running: Dict[str, int] = {}
+        self._closed = True  # no more items will arrive; idle workers exit
+        self._threads: List[threading.Thread] = []
+        self._site_of: Optional[Callable[[object], str]] = None
+
+    def cap(self, site: str) -> int:
+        return self.site_caps.get(site, self.default_cap)
+
+    def run(self, items: Iterable, site_of: Callable[[object], str],
+            handler: Callable[[object], None]) -> None:
+        """Blocks until every item has been handled. Handler errors are logged, not raised."""
+        with self._cond:
+            self._pending = [(site_of(it), it) for it in items]
+            self._running = {}
+            self._closed = True
+        if not self._pending:
+            return
+
+        threads = self._spawn(handler, min(self.max_workers, len(self._pending)))
+        for t in threads:
+            t.join()
+
+    def start(self, site_of: Callable[[object], str], handler: Callable[[object], None]) -> None:
+        """Start the pool without a batch; feed it with submit(), end it with shutdown()."""
+        with self._cond:
+            self._pending = []
+            self._running = {}
+            self._closed = False
+            self._site_of = site_of
+        self._threads = self._spawn(handler, self.max_workers)
+
+    def submit(self, item) -> None:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is not accepting items")
+            self._pending.append((self._site_of(item), item))
+            self._cond.notify_all()
+
+    def busy(self, site: str) -> int:
+        """Items of `site` queued or running."""
+        with self._cond:
+            return self._running.get(site, 0) + sum(1 for s, _ in self._pending if s == site)
+
+    def shutdown(self, wait: bool = True, drop_pending: bool = False) -> None:
+        """Stop accepting items; workers finish what is queued (or only what is running) and exit."""
+        with self._cond:
+            self._closed = True
+            if drop_pending:
+                self._pending = []
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def _spawn(self, handler: Callable[[object], None], n_workers: int) -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=self._worker, args=(handler,), name=f"scheduler-{i}", daemon=True)
+            for i in range(n_workers)
+        ]
+        for t in threads:
+            t.start()
+        return threads
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                for idx, (site, item) in enumerate(self._pending):
+                    if self._running.get(site, 0) < self.cap(site):
+                        self._pending.pop(idx)
+                        self._running[site] = self._running.get(site, 0) + 1
+                        return site, item
+                # every pending item belongs to a saturated site → wait for a slot
+                self._cond.wait()
+
+    def _release(self, site: str) -> None:
+        with self._cond:
+            self._running[site] -= 1
+            self._cond.notify_all()
+
+    def _worker(self, handler: Callable[[object], None]) -> None:
+        try:
+            while True:
+                nxt = self._next()
+                if nxt is None:
+                    return
+                site, item = nxt
+                try:
+                    handler(item)
+                except Exception as e:
+                    print(f"❌ [{site}] job failed: {e}")
+                    traceback.print_exc()
+                finally:
+                    self._release(site)
+        finally:
+            if self.on_worker_exit:
+                try:
+                    self.on_worker_exit()
+                except Exception as e:
+                    print(f"⚠️  worker cleanup failed: {e}")
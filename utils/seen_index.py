@@ -0,0 +1,148 @@
+# utils/seen_index.py
+"""
+In-memory membership filter in front of seen_listings.
+
+Per profile we keep a Bloom filter over every seen URL plus an exact set of
+URLs that SQLite has already confirmed as seen. A Bloom miss is a definite
+"new" and never touches the database; Bloom hits that are not in the exact
+set are verified with chunked SQLite queries.
+
+The index is loaded lazily on first use and then only pulls rows with a
+higher id than the last one it saw, so rows written by other processes are
+picked up without a full reload. mark_seen() adds its URLs to the Bloom
+filter and the exact set, so re-checking them right away needs no query; a
+rolled-back transaction invalidates the index (see get_seen_index()).
+
+The load is the expensive part: about 6.5 µs per seen URL (1.3 s for 200k,
+8 s for 1M), while a warm lookup saves only ~0.06 ms per 60-URL batch over
+SQLite's indexed IN (...) query (benchmarks/bench_seen_index.py prints the
+break-even). It pays off only after 0.1–0.3 lookup batches per seen URL of
+the profile (tens of thousands of polls for 200k URLs), i.e. only in a
+long-running process. dedupe_db therefore uses it only after
+enable_seen_index() (daemon.py), unless SEEN_INDEX=true|false says so.
+"""
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.m = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # double hashing (h1 + i*h2). The filter never leaves this process, so the
+        # builtin (per-process salted, cached on the str object) hash is enough.
+        h1 = hash(item)
+        h2 = hash((item, 0x9E3779B9)) | 1
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def add(self, item: str) -> None:
+        bits = self.bits
+        for pos in self._positions(item):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def saturated(self) -> bool:
+        return self.count > self.capacity
+
+
+# loader(profile_name, after_id) -> rows of (id, url); counter(profile_name) -> row count;
+# checker(profile_name, urls) -> seen subset
+Loader = Callable[[str, int], Iterable[Tuple[int, str]]]
+Counter = Callable[[str], int]
+Checker = Callable[[str, List[str]], Set[str]]
+
+
+class _ProfileIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.confirmed: Set[str] = set()
+        self.last_id = 0
+
+
+class SeenIndex:
+    def __init__(self, loader: Loader, counter: Counter, checker: Checker,
+                 error_rate: float = 0.01, min_capacity: int = 10_000):
+        self._loader = loader
+        self._counter = counter
+        self._checker = checker
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, _ProfileIndex] = {}
+        self.db_checks = 0
+        self.db_skips = 0
+
+    def _profile(self, profile_name: str) -> _ProfileIndex:
+        with self._lock:
+            idx = self._profiles.get(profile_name)
+            if idx is None:
+                idx = self._profiles[profile_name] = _ProfileIndex()
+            return idx
+
+    def _load(self, profile_name: str, idx: _ProfileIndex) -> None:
+        # 2x headroom so mark_seen() can keep adding before a rebuild is due
+        capacity = max(self.min_capacity, 2 * self._counter(profile_name))
+        idx.bloom = BloomFilter(capacity, self.error_rate)
+        idx.confirmed = set()
+        idx.last_id = 0
+        for row_id, url in self._loader(profile_name, 0):  # streamed, never materialized
+            idx.bloom.add(url)
+            if row_id > idx.last_id:
+                idx.last_id = row_id
+
+    def _catch_up(self, profile_name: str, idx: _ProfileIndex) -> None:
+        if idx.bloom is None or idx.bloom.saturated():
+            self._load(profile_name, idx)
+            return
+        for row_id, url in self._loader(profile_name, idx.last_id):
+            idx.bloom.add(url)
+            if row_id > idx.last_id:
+                idx.last_id = row_id
+
+    def seen(self, profile_name: str, urls: List[str]) -> Set[str]:
+        idx = self._profile(profile_name)
+        with idx.lock:
+            self._catch_up(profile_name, idx)
+            seen = {u for u in urls if u in idx.confirmed}
+            maybe = [u for u in urls if u not in seen and u in idx.bloom]
+            self.db_skips += len(urls) - len(maybe)
+            if maybe:
+                self.db_checks += len(maybe)
+                hits = self._checker(profile_name, maybe)
+                idx.confirmed.update(hits)
+                seen |= hits
+            return seen
+
+    def add(self, profile_name: str, urls: Iterable[str]) -> None:
+        idx = self._profile(profile_name)
+        with idx.lock:
+            if idx.bloom is None:
+                return  # loaded lazily later, straight from the table
+            for u in urls:
+                idx.bloom.add(u)
+                idx.confirmed.add(u)
+
+    def invalidate(self, profile_name: str = None) -> None:
+        """Forget one profile (or all); the next lookup reloads from SQLite."""
+        with self._lock:
+            if profile_name is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(profile_name, None)
@@ -0,0 +1,82 @@
+# utils/url_canon.py
+"""
+Canonical listing URLs, so one listing has one dedupe key.
+
+canonical_url() lowercases scheme and host, drops the fragment, tracking
+parameters (utm_*, gclid, ...) and a trailing slash, sorts the remaining
+query, and rewrites the known sites' alternative forms of a listing URL
+(language prefixes, www/non-www, rent synonyms) to one form per listing ID.
+URLs are still valid links afterwards.
+"""
+import re
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+_TRACKING_PARAMS = {
+    "gclid", "gbraid", "wbraid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid",
+    "_ga", "_gl", "ref", "referrer", "source", "src", "campaign", "share", "shared",
+}
+_TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "hsa_")
+
+# host -> (path regex, canonical URL template); the first match wins
+_SITE_RULES = {
+    "homegate.ch": [
+        (re.compile(r"^(?:/(?:de|en|fr|it))?/(?:mieten|rent|louer|affittare)/(\d+)(?:/.*)?$"),
+         "https://www.homegate.ch/mieten/{0}"),
+    ],
+    "flatfox.ch": [
+        (re.compile(r"^/(?:de|en|fr|it)/(flat|listing)/([^/]+)/(\d+)(?:/.*)?$"),
+         "https://flatfox.ch/de/{0}/{1}/{2}/"),
+    ],
+    "vermietungen.stadt-zuerich.ch": [
+        (re.compile(r"^/publication/apartment/(\d+)(?:/.*)?$"),
+         "https://www.vermietungen.stadt-zuerich.ch/publication/apartment/{0}/"),
+    ],
+}
+
+
+# the forms the rules above produce: scraped URLs mostly already look like this,
+# and matching one regex is much cheaper than urlsplit() + a cache entry
+_ALREADY_CANONICAL = re.compile(
+    r"https://www\.homegate\.ch/mieten/\d+"
+    r"|https://flatfox\.ch/de/(?:flat|listing)/[^/?#]+/\d+/"
+    r"|https://www\.vermietungen\.stadt-zuerich\.ch/publication/apartment/\d+/"
+)
+
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in _TRACKING_PARAMS or name.startswith(_TRACKING_PREFIXES)
+
+
+# the same URLs come back every polling cycle; cached results also share one string
+@lru_cache(maxsize=16384)
+def _canonical(url: str) -> str:
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.endswith(":443") and parts.scheme.lower() == "https":
+        host = host[:-4]
+
+    site = host[4:] if host.startswith("www.") else host
+    for pattern, template in _SITE_RULES.get(site, ()):
+        m = pattern.match(parts.path)
+        if m:
+            canon = template.format(*m.groups())
+            return url if canon == url else canon
+
+    query = ""
+    if parts.query:
+        kept = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking(k)]
+        query = urlencode(sorted(kept))
+    path = parts.path.rstrip("/") or "/"
+    key = urlunsplit((parts.scheme.lower(), host, path, query, ""))
+    return url if key == url else key  # share the string when already canonical
+
+
+def canonical_url(url: Optional[str]) -> str:
+    if not url:
+        return ""
+    if _ALREADY_CANONICAL.fullmatch(url):
+        return url
+    return _canonical(url.strip())
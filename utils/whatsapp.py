@@ -1,11 +1,211 @@
-import os, requests
+# utils/whatsapp.py
+"""
+HTTP client for whatsapp-service.
+
+One pooled keep-alive session is shared by the whole process, so sends reuse
+TCP connections instead of opening one per message. WhatsAppClient and
+AsyncWhatsAppClient take explicit URLs, which makes them easy to point at a
+local stub server; send_whatsapp_message()/send_whatsapp_batch() use the
+default client built from the environment.
+"""
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
 WA_URL = os.getenv("WHATSAPP_API_URL", "http://localhost:3000/send-message")
+WA_BATCH_URL = os.getenv("WHATSAPP_BATCH_URL", WA_URL.rsplit("/", 1)[0] + "/send-batch")
+# GET <WA_STATUS_URL>/<id> → {"status": "queued" | "sent" | "failed", ...}; 404 once the service forgot the id
+WA_STATUS_URL = os.getenv("WHATSAPP_STATUS_URL", WA_URL.rsplit("/", 1)[0] + "/messages")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+_POOL_SIZE = _env_int("WHATSAPP_POOL_SIZE", 4)
+_CONNECT_TIMEOUT = _env_float("WHATSAPP_CONNECT_TIMEOUT_SEC", 3.0)
+_READ_TIMEOUT = _env_float("WHATSAPP_READ_TIMEOUT_SEC", 15.0)
+
+
+class WhatsAppBackpressure(RuntimeError):
+    """Service answered 429 (queue full) or 503 (not connected); retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"WhatsApp service saturated, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class BatchUnsupported(RuntimeError):
+    """The service has no /send-batch endpoint (older deployment)."""
+
+
+def _retry_after(headers) -> float:
+    try:
+        return max(1.0, float(headers.get("Retry-After", "5")))
+    except (TypeError, ValueError):
+        return 5.0
+
+
+def _batch_body(messages: Sequence[Tuple[str, str]]) -> dict:
+    return {"messages": [{"jid": jid, "message": text} for jid, text in messages]}
+
+
+def _batch_result(status: int, headers, payload_text: str, payload_json) -> List[Optional[str]]:
+    if status in (404, 405):
+        raise BatchUnsupported(f"HTTP {status} from batch endpoint")
+    if status in (429, 503):
+        raise WhatsAppBackpressure(_retry_after(headers))
+    if status >= 400:
+        raise RuntimeError(f"WA batch HTTP {status}: {payload_text[:400]}")
+    return list((payload_json or {}).get("ids") or [])
+
+
+def _status_result(status: int, payload_text: str, payload_json) -> Optional[dict]:
+    if status == 404:
+        return None
+    if status >= 400:
+        raise RuntimeError(f"WA status HTTP {status}: {payload_text[:400]}")
+    return payload_json or {}
+
+
+class WhatsAppClient:
+    def __init__(self, send_url: str = WA_URL, batch_url: str = WA_BATCH_URL,
+                 pool_size: int = _POOL_SIZE,
+                 connect_timeout: float = _CONNECT_TIMEOUT, read_timeout: float = _READ_TIMEOUT,
+                 status_url: str = WA_STATUS_URL):
+        self.send_url = send_url
+        self.batch_url = batch_url
+        self.status_url = status_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        # retries are the outbox's job; the adapter only pools connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def send(self, message: str, jid: str) -> None:
+        r = self._session.post(self.send_url, json={"jid": jid, "message": message}, timeout=self.timeout)
+        if r.status_code in (429, 503):
+            raise WhatsAppBackpressure(_retry_after(r.headers))
+        if r.status_code >= 400:
+            print(f"❌ WA HTTP {r.status_code}: {r.text[:400]}")
+        r.raise_for_status()
+
+    def send_batch(self, messages: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+        """POST (jid, text) pairs in one call. Returns service ids; None marks a rejected entry."""
+        if not messages:
+            return []
+        r = self._session.post(self.batch_url, json=_batch_body(messages), timeout=self.timeout)
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        return _batch_result(r.status_code, r.headers, r.text, body)
+
+    def message_status(self, service_id: str) -> Optional[dict]:
+        """Delivery status of a batch entry; None if the service doesn't know the id (restarted/expired)."""
+        r = self._session.get(f"{self.status_url}/{service_id}", timeout=self.timeout)
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        return _status_result(r.status_code, r.text, body)
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class AsyncWhatsAppClient:
+    """asyncio flavour of WhatsAppClient (httpx, pooled keep-alive connections)."""
+
+    def __init__(self, send_url: str = WA_URL, batch_url: str = WA_BATCH_URL,
+                 pool_size: int = _POOL_SIZE,
+                 connect_timeout: float = _CONNECT_TIMEOUT, read_timeout: float = _READ_TIMEOUT,
+                 status_url: str = WA_STATUS_URL):
+        import httpx
+
+        self.send_url = send_url
+        self.batch_url = batch_url
+        self.status_url = status_url.rstrip("/")
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max(1, pool_size), max_keepalive_connections=max(1, pool_size)),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def send(self, message: str, jid: str) -> None:
+        r = await self._client.post(self.send_url, json={"jid": jid, "message": message})
+        if r.status_code in (429, 503):
+            raise WhatsAppBackpressure(_retry_after(r.headers))
+        if r.status_code >= 400:
+            print(f"❌ WA HTTP {r.status_code}: {r.text[:400]}")
+        r.raise_for_status()
+
+    async def send_batch(self, messages: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+        if not messages:
+            return []
+        r = await self._client.post(self.batch_url, json=_batch_body(messages))
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        return _batch_result(r.status_code, r.headers, r.text, body)
+
+    async def message_status(self, service_id: str) -> Optional[dict]:
+        r = await self._client.get(f"{self.status_url}/{service_id}")
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        return _status_result(r.status_code, r.text, body)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+_default_client: Optional[WhatsAppClient] = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> WhatsAppClient:
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = WhatsAppClient()
+        return _default_client
+
 
 def send_whatsapp_message(message: str, jid: str):
     if not jid:
         print("❌ WhatsApp JID missing (got empty/None)."); return
-    r = requests.post(WA_URL, json={"jid": jid, "message": message}, timeout=15)
-    if r.status_code >= 400:
-        print(f"❌ WA HTTP {r.status_code}: {r.text[:400]}")
-    r.raise_for_status()
-    print(f"📤 Message sent to {jid}")
\ No newline at end of file
+    get_client().send(message, jid)
+    print(f"📤 Message sent to {jid}")
+
+
+def whatsapp_message_status(service_id: str) -> Optional[dict]:
+    return get_client().message_status(service_id)
+
+
+def send_whatsapp_batch(messages: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+    """(jid, text) pairs → service ids; the service queues and paces them (confirm with whatsapp_message_status)."""
+    ids = get_client().send_batch(messages)
+    print(f"📤 Batch of {len(messages)} handed to WhatsApp service ({sum(1 for i in ids if i)} accepted)")
+    return ids
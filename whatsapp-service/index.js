@@ -1,4 +1,5 @@
 import express from 'express';
+import { randomUUID } from 'crypto';
 import qrcode from 'qrcode-terminal';
 import Boom from '@hapi/boom';
 import {
@@ -14,6 +15,113 @@ app.use(express.json());
 let sock;
 let reconnectTimer = null;
 
+// ---- Send queue (env knobs) ----
+const QUEUE_MAX            = Number(process.env.SEND_QUEUE_MAX || 500);         // 429 beyond this
+const PER_JID_INTERVAL_MS  = Number(process.env.SEND_PER_JID_INTERVAL_MS || 3000);
+const GLOBAL_INTERVAL_MS   = Number(process.env.SEND_GLOBAL_INTERVAL_MS || 500);
+const SEND_MAX_ATTEMPTS    = Number(process.env.SEND_MAX_ATTEMPTS || 3);
+const SEND_REPLY_TIMEOUT_MS = Number(process.env.SEND_REPLY_TIMEOUT_MS || 10000); // keep below the client's read timeout
+const STATUS_TTL_MS        = 60 * 60 * 1000;                                    // keep /messages/:id for 1h
+
+const queue = [];                 // [{ id, jid, message, attempts, notBefore, done? }]
+const jidNextAt = new Map();      // jid -> earliest ms the next send may start
+const statuses = new Map();       // id -> { status, jid, attempts, error, queuedAt, sentAt }
+const sentTimes = [];             // send timestamps of the last minute (throughput)
+const totals = { sent: 0, failed: 0, rejected: 0 };
+let inflight = 0;
+let pumpTimer = null;
+let globalNextAt = 0;
+
+// "4179xxxxxxx" / "+4179xxxxxxx" → "...@s.whatsapp.net"; returns null if still invalid
+function normalizeJid(jid) {
+  if (jid && !jid.includes('@')) {
+    jid = jid.replace(/^\+/, '');        // drop leading plus
+    jid = `${jid}@s.whatsapp.net`;
+  }
+  const isGroup = jid?.endsWith('@g.us');
+  const isUser  = jid?.endsWith('@s.whatsapp.net');
+  return isGroup || isUser ? jid : null;
+}
+
+function retryAfterSec(extra = 0) {
+  // rough time until the queue has room again at the global send rate
+  const overflow = Math.max(1, queue.length + extra - QUEUE_MAX + 1);
+  return Math.max(1, Math.ceil((overflow * Math.max(GLOBAL_INTERVAL_MS, 1)) / 1000));
+}
+
+function enqueue(jid, message, done) {
+  const id = randomUUID();
+  queue.push({ id, jid, message, attempts: 0, notBefore: 0, done });
+  statuses.set(id, { status: 'queued', jid, attempts: 0, queuedAt: Date.now() });
+  schedulePump(0);
+  return id;
+}
+
+function schedulePump(ms) {
+  if (pumpTimer) return;
+  pumpTimer = setTimeout(() => {
+    pumpTimer = null;
+    pump().catch((e) => console.error('❌ Send pump error:', e?.message || e));
+  }, ms);
+}
+
+function pruneStats(now) {
+  while (sentTimes.length && now - sentTimes[0] > 60_000) sentTimes.shift();
+  for (const [id, st] of statuses) {
+    if (st.status !== 'queued' && now - (st.sentAt || st.queuedAt) > STATUS_TTL_MS) statuses.delete(id);
+  }
+}
+
+// Sends one ready message at a time, honouring per-JID and global pacing.
+async function pump() {
+  if (inflight) return;
+  const now = Date.now();
+  pruneStats(now);
+  if (!queue.length) return;
+  if (!sock?.user) return schedulePump(1000); // not connected yet; keep everything queued
+
+  let wait = Math.max(0, globalNextAt - now);
+  const idx = wait ? -1 : queue.findIndex((m) => m.notBefore <= now && (jidNextAt.get(m.jid) || 0) <= now);
+  if (idx === -1) {
+    if (!wait) {
+      wait = Math.min(
+        ...queue.map((m) => Math.max(m.notBefore, jidNextAt.get(m.jid) || 0) - now)
+      );
+    }
+    return schedulePump(Math.max(10, wait));
+  }
+
+  const [item] = queue.splice(idx, 1);
+  const st = statuses.get(item.id) || {};
+  inflight += 1;
+  item.attempts += 1;
+  try {
+    // Disable link preview to avoid requiring 'link-preview-js'
+    await sock.sendMessage(item.jid, { text: item.message });
+    console.log(`📨 Sent to ${item.jid}: ${item.message}`);
+    totals.sent += 1;
+    sentTimes.push(Date.now());
+    statuses.set(item.id, { ...st, status: 'sent', attempts: item.attempts, sentAt: Date.now() });
+    item.done?.(null);
+  } catch (err) {
+    console.error('❌ Error sending message:', err);
+    if (item.attempts < SEND_MAX_ATTEMPTS) {
+      item.notBefore = Date.now() + 1000 * 2 ** item.attempts;
+      queue.unshift(item);
+      statuses.set(item.id, { ...st, status: 'queued', attempts: item.attempts, error: err.message });
+    } else {
+      totals.failed += 1;
+      statuses.set(item.id, { ...st, status: 'failed', attempts: item.attempts, error: err.message, sentAt: Date.now() });
+      item.done?.(err);
+    }
+  } finally {
+    inflight -= 1;
+    jidNextAt.set(item.jid, Date.now() + PER_JID_INTERVAL_MS);
+    globalNextAt = Date.now() + GLOBAL_INTERVAL_MS;
+    schedulePump(0);
+  }
+}
+
 async function logGroupJIDs() {
   if (!sock) {
     console.log('❌ No WhatsApp connection.');
@@ -27,36 +135,93 @@ async function logGroupJIDs() {
 }
 
 app.get('/health', (_req, res) => {
-  res.json({ ok: Boolean(sock), connected: Boolean(sock?.user) });
+  pruneStats(Date.now());
+  res.json({
+    ok: Boolean(sock),
+    connected: Boolean(sock?.user),
+    queue: { depth: queue.length, inflight, capacity: QUEUE_MAX, jids: new Set(queue.map((m) => m.jid)).size },
+    throughput: { sentLastMinute: sentTimes.length, ...totals },
+  });
 });
 
 app.post('/send-message', async (req, res) => {
-  let { jid, message } = req.body;
-  if (!sock) return res.status(500).send("Socket not ready");
-
-  // --- normalize JID ---
-  // If user phone number comes as "4179xxxxxxx" or "+4179xxxxxxx", convert to "@s.whatsapp.net"
-  if (jid && !jid.includes('@')) {
-    jid = jid.replace(/^\+/, '');        // drop leading plus
-    jid = `${jid}@s.whatsapp.net`;
+  const { message } = req.body;
+  if (!sock?.user) {
+    // answer now instead of holding the request until reconnect; the caller retries later
+    res.set('Retry-After', '5');
+    return res.status(503).json({ success: false, error: 'WhatsApp not connected' });
   }
 
-  // Minimal validation
-  const isGroup = jid?.endsWith('@g.us');
-  const isUser  = jid?.endsWith('@s.whatsapp.net');
-  if (!isGroup && !isUser) {
+  const jid = normalizeJid(req.body.jid);
+  if (!jid) {
     return res.status(400).json({ success: false, error: 'Invalid JID. Use <phone>@s.whatsapp.net or <id>@g.us' });
   }
+  if (queue.length >= QUEUE_MAX) {
+    totals.rejected += 1;
+    res.set('Retry-After', String(retryAfterSec(1)));
+    return res.status(429).json({ success: false, error: 'Send queue full' });
+  }
 
-  try {
-    // Disable link preview to avoid requiring 'link-preview-js'
-    await sock.sendMessage(jid, { text: message });
-    console.log(`📨 Sent to ${jid}: ${message}`);
-    res.send({ success: true });
-  } catch (err) {
-    console.error('❌ Error sending message:', err);
-    res.status(500).send({ success: false, error: err.message });
+  // goes through the same queue/pacing as /send-batch, but answers once delivered
+  let timer = null;
+  const id = enqueue(jid, message, (err) => {
+    clearTimeout(timer);
+    if (res.headersSent) return;
+    if (err) res.status(500).send({ success: false, error: err.message });
+    else res.send({ success: true });
+  });
+  // Never outlive the caller's timeout: a caller that gives up retries and would
+  // send the message twice. Withdraw it if it hasn't started sending; once it is
+  // in flight the reply follows within one sendMessage call.
+  timer = setTimeout(() => {
+    const idx = queue.findIndex((m) => m.id === id);
+    if (idx === -1) return;
+    queue.splice(idx, 1);
+    statuses.set(id, { ...statuses.get(id), status: 'failed', error: 'not sent in time', sentAt: Date.now() });
+    res.set('Retry-After', String(retryAfterSec()));
+    res.status(503).json({ success: false, error: 'Not sent in time, message withdrawn' });
+  }, SEND_REPLY_TIMEOUT_MS);
+});
+
+// Body: { messages: [{ jid, message }, ...] } → 202 { accepted, ids, rejected }
+// ids[i] belongs to messages[i] (null if that entry was rejected); poll GET /messages/:id.
+app.post('/send-batch', (req, res) => {
+  if (!sock) {
+    // still starting up; the caller keeps its rows and retries (queued messages wait for the connection)
+    res.set('Retry-After', '5');
+    return res.status(503).json({ error: 'socket not ready' });
+  }
+  const messages = Array.isArray(req.body?.messages) ? req.body.messages : null;
+  if (!messages || !messages.length) {
+    return res.status(400).json({ error: 'Body must be { messages: [{ jid, message }, ...] }' });
   }
+
+  const rejected = [];
+  const valid = [];
+  messages.forEach((m, index) => {
+    const jid = normalizeJid(m?.jid);
+    if (!jid) rejected.push({ index, error: 'Invalid JID' });
+    else if (typeof m.message !== 'string' || !m.message) rejected.push({ index, error: 'Empty message' });
+    else valid.push({ index, jid, message: m.message });
+  });
+  if (!valid.length) return res.status(400).json({ error: 'No valid messages', rejected });
+
+  // all-or-nothing admission keeps the caller's retry logic simple
+  if (queue.length + valid.length > QUEUE_MAX) {
+    totals.rejected += valid.length;
+    res.set('Retry-After', String(retryAfterSec(valid.length)));
+    return res.status(429).json({ error: 'Send queue full', depth: queue.length, capacity: QUEUE_MAX });
+  }
+
+  const ids = new Array(messages.length).fill(null);
+  for (const m of valid) ids[m.index] = enqueue(m.jid, m.message);
+  res.status(202).json({ accepted: valid.length, ids, rejected });
+});
+
+app.get('/messages/:id', (req, res) => {
+  const st = statuses.get(req.params.id);
+  if (!st) return res.status(404).json({ error: 'unknown or expired id' });
+  res.json({ id: req.params.id, ...st });
 });
 
 app.get('/groups', async (_req, res) => {